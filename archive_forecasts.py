@@ -0,0 +1,28 @@
+import argparse
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archives the forecasts of "
+                                                 "all ended months into a "
+                                                 "memory-mappable columnar "
+                                                 "archive, partitioned by "
+                                                 "city and month.")
+    parser.add_argument("archive_dir",
+                        nargs="?",
+                        default="archive",
+                        help="Archive directory, created if missing.")
+
+    parser.add_argument("--full",
+                        action="store_true",
+                        help="Rewrite the whole archive instead of only "
+                             "appending the months archived since the "
+                             "last run.")
+    args = parser.parse_args()
+
+    from database.db import ReadDBSession, configure_database
+    from utils.archive import ForecastArchive
+
+    configure_database()
+    with ReadDBSession() as db_session:
+        summary = ForecastArchive(args.archive_dir).update(
+            db_session, incremental=not args.full)
+    print(summary.format())
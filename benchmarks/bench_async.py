@@ -0,0 +1,92 @@
+"""
+Measures POST /api/v1/forecasts throughput under concurrent requests
+against a slow local upstream, comparing the async request path with
+the previous implementation, a sync route using requests and DBSession.
+
+    python -m benchmarks.bench_async --requests 200 --latency 1.0
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+
+from benchmarks.stub_upstream import StubUpstream
+
+
+async def run_load(app, num_requests: int, prefix: str) -> float:
+    import httpx
+
+    today = datetime.date.today()
+    async with httpx.AsyncClient(app=app, base_url="http://bench",
+                                 timeout=None) as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post("/api/v1/forecasts",
+                        params={"city_name": f"{prefix} {i}",
+                                "start_date": today,
+                                "end_date": today + datetime.timedelta(days=6)})
+            for i in range(num_requests)))
+        seconds = time.perf_counter() - started
+    failed = [r for r in responses if r.status_code != 201]
+    if failed:
+        raise RuntimeError(f"{len(failed)} requests failed: {failed[0].text}")
+    return seconds
+
+
+def previous_app():
+    from fastapi import FastAPI
+    from starlette.responses import JSONResponse
+
+    from models.forecast import Forecast
+    from utils.utils import generate_open_meteo_config
+
+    app = FastAPI()
+
+    @app.post("/api/v1/forecasts")
+    def get_new_forecast(city_name: str,
+                         start_date: datetime.date,
+                         end_date: datetime.date):
+        result = Forecast.get_forecast(city_name,
+                                       generate_open_meteo_config(
+                                           {"city_name": city_name,
+                                            "start_date": start_date,
+                                            "end_date": end_date}))
+        return JSONResponse(status_code=201, content=result.to_dict())
+
+    return app
+
+
+async def main(args: argparse.Namespace) -> None:
+    import httpx
+
+    from database.db import configure_database
+    from start_server import app
+
+    configure_database()
+    app.state.http_client = httpx.AsyncClient(
+        timeout=None, limits=httpx.Limits(max_connections=None))
+
+    for name, bench_app in (("async", app), ("previous", previous_app())):
+        seconds = await run_load(bench_app, args.requests, name)
+        print(f"{name:>8}: {args.requests} requests in {seconds:.2f}s "
+              f"({args.requests / seconds:.1f} req/s)")
+
+    await app.state.http_client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=1.0,
+                        help="Upstream latency per request in seconds.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            StubUpstream(latency=args.latency) as stub:
+        # Must be set before the application modules are imported
+        os.environ["WAGA_DB_PATH"] = os.path.join(tmp_dir, "bench.db")
+        os.environ["WAGA_GEOCODING_URL"] = stub.geocoding_url
+        os.environ["WAGA_FORECAST_URL"] = stub.forecast_url
+        asyncio.run(main(args))
@@ -0,0 +1,75 @@
+"""
+Compares the forecast differences query with the previous implementation,
+which self-joined whole ORM objects grouped by measure date and subtracted
+them in Python.
+
+    python -m benchmarks.bench_diffs --rows 1000000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session, aliased
+
+from benchmarks.synthetic import fill_database
+from models.forecast import Forecast
+
+
+def previous_diffs(db_session: Session, city_name: str) -> list[dict]:
+    a = aliased(Forecast, name="a")
+    b = aliased(Forecast, name="b")
+    pairs = db_session.execute(select(a, b).where(
+        a.city_name == city_name,
+        b.city_name == city_name,
+        a.measure_date == b.measure_date,
+        a.is_forecast != b.is_forecast)
+                               .group_by(a.measure_date)
+                               .order_by(a.measure_date)).fetchall()
+    return [pair[0] - pair[1] for pair in pairs]
+
+
+def current_diffs(db_session: Session, city_name: str) -> list:
+    return db_session.execute(Forecast.diff_query(city_name)).fetchall()
+
+
+def measure(fn, repeat: int) -> tuple[float, int]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), len(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--cities", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        started = time.perf_counter()
+        inserted = fill_database(db_path, args.rows, num_cities=args.cities)
+        print(f"Generated {inserted} rows for {args.cities} cities "
+              f"in {time.perf_counter() - started:.1f}s.")
+
+        engine = create_engine(f"sqlite:///{db_path}")
+        city_name = "City 0"
+        with Session(engine) as db_session:
+            seconds, rows = measure(
+                lambda: current_diffs(db_session, city_name), args.repeat)
+            print(f"current:  {seconds * 1000:9.1f} ms ({rows} diffs)")
+
+            # The previous schema only had the measure_date index
+            db_session.execute(text(
+                "DROP INDEX ix_forecasts_city_measure_date"))
+            db_session.execute(text("ANALYZE"))
+            seconds, rows = measure(
+                lambda: previous_diffs(db_session, city_name), args.repeat)
+            print(f"previous: {seconds * 1000:9.1f} ms ({rows} diffs)")
+        engine.dispose()
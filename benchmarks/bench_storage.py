@@ -0,0 +1,144 @@
+"""
+Measures a mixed GET/POST /api/v1/forecasts load under each SQLite
+storage profile (see database.db.STORAGE_PROFILES), reporting throughput,
+latency percentiles and failed requests, e.g. "database is locked".
+Every profile runs in its own process, since the profile is selected
+when database.db is imported.
+
+    python -m benchmarks.bench_storage --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.stub_upstream import StubUpstream
+
+NUM_CITIES = 50
+
+
+async def run_load(args: argparse.Namespace) -> dict:
+    import httpx
+
+    from benchmarks.synthetic import fill_database
+    from database.db import configure_database, dispose_engines
+    from start_server import app
+
+    fill_database(os.environ["WAGA_DB_PATH"], args.rows,
+                  num_cities=NUM_CITIES)
+    configure_database()
+    app.state.http_client = httpx.AsyncClient(
+        timeout=None, limits=httpx.Limits(max_connections=None))
+
+    rng = random.Random(0)
+    today = datetime.date.today()
+    latencies = collections.defaultdict(list)
+    errors = collections.Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def request(client: httpx.AsyncClient, i: int) -> None:
+        if rng.random() < args.write_ratio:
+            kind, method, params = "POST", "POST", {
+                "city_name": f"Bench {i}",
+                "start_date": today,
+                "end_date": today + datetime.timedelta(days=6)}
+        else:
+            # Distinct date windows keep the responses out of the diff cache
+            start_date = datetime.date(2000, 1, 1) + \
+                datetime.timedelta(days=rng.randrange(365))
+            kind, method, params = "GET", "GET", {
+                "city_name": f"City {rng.randrange(NUM_CITIES)}",
+                "start_date": start_date,
+                "end_date": start_date + datetime.timedelta(days=30)}
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, "/api/v1/forecasts",
+                                                params=params)
+            except Exception as e:
+                message = str(e).splitlines()[0][:100]
+                errors[f"{kind} {type(e).__name__}: {message}"] += 1
+                return
+            latencies[kind].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[f"{kind} {response.status_code}: "
+                       f"{response.text[:80]}"] += 1
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench",
+                                 timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(request(client, i)
+                               for i in range(args.requests)))
+        seconds = time.perf_counter() - started
+
+    await app.state.http_client.aclose()
+    await dispose_engines()
+
+    return {"seconds": seconds,
+            "throughput": args.requests / seconds,
+            "latency": {kind: {"p50": float(np.percentile(values, 50)),
+                               "p99": float(np.percentile(values, 99))}
+                        for kind, values in latencies.items()},
+            "errors": dict(errors)}
+
+
+def run_profile(profile: str, stub: StubUpstream,
+                args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ,
+                   WAGA_STORAGE_PROFILE=profile,
+                   WAGA_DB_PATH=os.path.join(tmp_dir, "bench.db"),
+                   WAGA_GEOCODING_URL=stub.geocoding_url,
+                   WAGA_FORECAST_URL=stub.forecast_url)
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_storage", "--worker",
+             "--requests", str(args.requests),
+             "--concurrency", str(args.concurrency),
+             "--write-ratio", str(args.write_ratio),
+             "--rows", str(args.rows)],
+            env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(args: argparse.Namespace) -> None:
+    with StubUpstream(latency=args.latency) as stub:
+        for profile in args.profiles:
+            result = run_profile(profile, stub, args)
+            latency = ", ".join(
+                f"{kind} p50 {values['p50'] * 1000:.1f}ms "
+                f"p99 {values['p99'] * 1000:.1f}ms"
+                for kind, values in sorted(result["latency"].items()))
+            print(f"{profile:>10}: {result['throughput']:.1f} req/s, "
+                  f"{latency}, {sum(result['errors'].values())} errors")
+            for error, count in result["errors"].items():
+                print(f"{'':>12}{count} x {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--rows", type=int, default=200_000,
+                        help="Synthetic rows stored before the load starts.")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Upstream latency per request in seconds.")
+    parser.add_argument("--profiles", nargs="+",
+                        default=["default", "concurrent"])
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(run_load(args))))
+    else:
+        main(args)
@@ -0,0 +1,290 @@
+"""
+Runs the benchmark scenarios against a local stub upstream and synthetic
+data, and writes the results as JSON. If a baseline results file is
+passed, metrics which got worse by more than the threshold are reported
+and the exit code is 1.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --rows 10000 1000000 --baseline results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import numpy as np
+
+from benchmarks.stub_upstream import StubUpstream, forecast_payload
+from benchmarks.synthetic import fill_database
+
+NUM_CITIES = 50
+
+
+def metric(value: float, unit: str, higher_is_better: bool = False) -> dict:
+    return {"value": value, "unit": unit,
+            "higher_is_better": higher_is_better}
+
+
+def percentiles(timings: list[float], prefix: str) -> dict:
+    return {f"{prefix}.p50": metric(float(np.percentile(timings, 50)) * 1000,
+                                    "ms"),
+            f"{prefix}.p99": metric(float(np.percentile(timings, 99)) * 1000,
+                                    "ms")}
+
+
+def bench_parse(args: argparse.Namespace, _: StubUpstream) -> dict:
+    """
+    CPU time spent converting one open-meteo payload into forecast rows,
+    and into Forecast objects.
+    """
+    from utils.handlers import handle_open_meteo_data, handle_open_meteo_rows
+
+    start_date = datetime.date.today()
+    end_date = start_date + datetime.timedelta(days=args.payload_days - 1)
+    payload = forecast_payload(start_date, end_date,
+                               np.random.default_rng(0))
+    results = {}
+    for name, handler in (("rows", handle_open_meteo_rows),
+                          ("objects", handle_open_meteo_data)):
+        started = time.process_time()
+        for _ in range(args.repeat):
+            handler("City 0", payload)
+        results[f"parse.{name}.cpu"] = metric(
+            (time.process_time() - started) / args.repeat * 1000, "ms")
+    return results
+
+
+def bench_diffs(args: argparse.Namespace, _: StubUpstream) -> dict:
+    """
+    Latency of the forecast differences query, for every database size.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from models.forecast import Forecast
+
+    results = {}
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_rows in args.rows:
+            db_path = os.path.join(tmp_dir, f"diffs-{num_rows}.db")
+            fill_database(db_path, num_rows, num_cities=NUM_CITIES)
+            engine = create_engine(f"sqlite:///{db_path}")
+            timings = []
+            with Session(engine) as db_session:
+                for _ in range(args.repeat):
+                    query = Forecast.diff_query(
+                        f"City {rng.randrange(NUM_CITIES)}")
+                    started = time.perf_counter()
+                    db_session.execute(query).fetchall()
+                    timings.append(time.perf_counter() - started)
+            engine.dispose()
+            results.update(percentiles(timings, f"diffs.{num_rows}"))
+    return results
+
+
+def bench_serialize(args: argparse.Namespace, _: StubUpstream) -> dict:
+    """
+    Time spent serializing GET /forecasts responses, through the response
+    models and jsonable_encoder, and through diffs_to_json.
+    """
+    from fastapi.encoders import jsonable_encoder
+    from starlette.responses import JSONResponse
+
+    from schemas.forecasts import ForecastDiffResponse, diffs_to_json
+
+    def models(diffs: list[tuple]) -> bytes:
+        return JSONResponse(jsonable_encoder(
+            [ForecastDiffResponse("City 0", *diff) for diff in diffs])).body
+
+    results = {}
+    rng = np.random.default_rng(0)
+    first_day = datetime.date(2000, 1, 1)
+    for num_rows in args.diff_rows:
+        diffs = [(first_day + datetime.timedelta(days=i),
+                  *rng.normal(0, 3, 4).round(1).tolist())
+                 for i in range(num_rows)]
+        for name, serialize in (("models", models),
+                                ("fast", lambda rows: diffs_to_json(
+                                    "City 0", rows))):
+            timings = []
+            for _ in range(max(args.repeat // 20, 3)):
+                started = time.perf_counter()
+                serialize(diffs)
+                timings.append(time.perf_counter() - started)
+            results[f"serialize.{name}.{num_rows}.p50"] = metric(
+                float(np.percentile(timings, 50)) * 1000, "ms")
+    return results
+
+
+def bench_ingest(args: argparse.Namespace, stub: StubUpstream) -> dict:
+    """
+    Throughput of the batch ingestion of new cities, see ingest_cities.
+    """
+    from utils.ingestion import ingest_cities
+
+    start_date = datetime.date.today()
+    summary = ingest_cities(
+        [f"Ingest {i}" for i in range(args.cities)], start_date,
+        start_date + datetime.timedelta(days=args.payload_days - 1),
+        workers=args.workers)
+    if summary.failed:
+        raise RuntimeError(f"Ingestion failed: {summary.failed[0].error}")
+    return {"ingest.rows_per_second": metric(
+                summary.total_rows / summary.wall_time, "rows/s", True),
+            "ingest.cities_per_second": metric(
+                len(summary.succeeded) / summary.wall_time, "cities/s", True),
+            "ingest.upstream_requests": metric(stub.requests, "requests")}
+
+
+def bench_api(args: argparse.Namespace, _: StubUpstream) -> dict:
+    """
+    End-to-end mixed GET/POST load on the application,
+    see benchmarks.bench_storage.
+    """
+    from benchmarks.bench_storage import run_load
+
+    result = asyncio.run(run_load(argparse.Namespace(
+        requests=args.requests, concurrency=args.concurrency,
+        write_ratio=args.write_ratio, rows=min(args.rows))))
+    results = {"api.throughput": metric(result["throughput"], "req/s", True),
+               "api.errors": metric(sum(result["errors"].values()),
+                                    "requests")}
+    for kind, values in result["latency"].items():
+        for name, value in values.items():
+            results[f"api.{kind.lower()}.{name}"] = metric(value * 1000, "ms")
+    return results
+
+
+SCENARIOS: dict[str, Callable[[argparse.Namespace, StubUpstream], dict]] = {
+    "parse": bench_parse,
+    "diffs": bench_diffs,
+    "serialize": bench_serialize,
+    "ingest": bench_ingest,
+    "api": bench_api,
+}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": datetime.datetime.now().isoformat(
+                timespec="seconds")}
+
+
+def compare(metrics: dict, baseline: dict, threshold: float) \
+        -> list[tuple[str, float, float, float, bool]]:
+    """
+    Compares the metrics with the ones of a baseline run.
+
+    Args:
+        metrics (dict): metrics of the current run
+        baseline (dict): metrics of the baseline run
+        threshold (float): relative change above which a metric which got
+                           worse is considered a regression
+
+    Returns:
+        list of (name, baseline value, current value, relative change,
+                 regression flag) tuples, for metrics found in both runs
+    """
+    comparison = []
+    for name, current in metrics.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["value"], current["value"]
+        if before:
+            change = (after - before) / before
+        else:
+            change = 0.0 if after == before else float("inf")
+        worse = -change if current["higher_is_better"] else change
+        comparison.append((name, before, after, change, worse > threshold))
+    return comparison
+
+
+def main(args: argparse.Namespace, stub: StubUpstream) -> int:
+    metrics = {}
+    for name in args.scenarios:
+        started = time.perf_counter()
+        metrics.update(SCENARIOS[name](args, stub))
+        print(f"{name} finished in {time.perf_counter() - started:.1f}s.",
+              file=sys.stderr)
+
+    for name, value in metrics.items():
+        print(f"{name:<32} {value['value']:>12.2f} {value['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"environment": environment(),
+                       "parameters": {key: value
+                                      for key, value in vars(args).items()
+                                      if key not in ("output", "baseline")},
+                       "metrics": metrics}, output, indent=2)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)["metrics"]
+    comparison = compare(metrics, baseline, args.threshold)
+    print(f"\nCompared with {args.baseline}:")
+    for name, before, after, change, regressed in comparison:
+        print(f"{name:<32} {before:>12.2f} -> {after:>12.2f} "
+              f"({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return 1 if any(regressed for *_, regressed in comparison) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000,
+                                                                1_000_000],
+                        help="Synthetic database sizes for the diffs "
+                             "scenario; the smallest one is used by the "
+                             "api scenario.")
+    parser.add_argument("--diff-rows", type=int, nargs="+",
+                        default=[10_000, 100_000],
+                        help="Response sizes of the serialize scenario.")
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="Repetitions of the parse and diffs scenarios.")
+    parser.add_argument("--payload-days", type=int, default=16,
+                        help="Days in each upstream forecast payload.")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Upstream latency per request in seconds.")
+    parser.add_argument("--cities", type=int, default=200,
+                        help="Cities ingested by the ingest scenario.")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--output", help="JSON results file.")
+    parser.add_argument("--baseline", help="JSON results file of a "
+                                           "previous run to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change reported as a regression.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            StubUpstream(latency=args.latency) as stub:
+        # Must be set before the application modules are imported
+        os.environ["WAGA_DB_PATH"] = os.path.join(tmp_dir, "bench.db")
+        os.environ["WAGA_GEOCODING_URL"] = stub.geocoding_url
+        os.environ["WAGA_FORECAST_URL"] = stub.forecast_url
+        from database.db import configure_database
+        configure_database()
+        sys.exit(main(args, stub))
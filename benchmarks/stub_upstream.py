@@ -0,0 +1,157 @@
+"""
+Local stand-in for the open-meteo geocoding and forecast APIs, with
+configurable latency, so benchmarks do not depend on the real services.
+"""
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+DAILY_FIELDS = ("temperature_2m_min", "temperature_2m_max",
+                "precipitation_sum", "windspeed_10m_max")
+HOURS = 24
+
+
+def forecast_payload(start_date: datetime.date,
+                     end_date: datetime.date,
+                     rng: np.random.Generator,
+                     hourly_fields: tuple[str, ...] = ()) -> dict:
+    num_days = (end_date - start_date).days + 1
+    values = rng.uniform(0, 30, size=(len(DAILY_FIELDS), num_days)).round(1)
+    daily = {"time": [(start_date + datetime.timedelta(days=i)).isoformat()
+                      for i in range(num_days)]}
+    daily.update(zip(DAILY_FIELDS, values.tolist()))
+    if not hourly_fields:
+        return {"daily": daily}
+    values = rng.uniform(0, 30, size=(len(hourly_fields),
+                                      num_days * HOURS)).round(1)
+    hourly = {"time": [f"{day}T{hour:02d}:00" for day in daily["time"]
+                       for hour in range(HOURS)]}
+    hourly.update(zip(hourly_fields, values.tolist()))
+    return {"daily": daily, "hourly": hourly}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Listen backlog, large enough for bursts of concurrent connections
+    request_queue_size = 1024
+
+
+class StubUpstream:
+    """
+    Threaded HTTP server answering /search (geocoding) and /forecast
+    requests after the configured latency. The forecast payload covers
+    the requested date range, or num_days days if set, with hourly
+    values of the requested hourly fields.
+    """
+
+    def __init__(self, latency: float = 0.0, num_days: int | None = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.num_days = num_days
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                url = urlparse(self.path)
+                query = {key: values[0]
+                         for key, values in parse_qs(url.query).items()}
+                time.sleep(stub.latency)
+                if url.path.endswith("/search"):
+                    body = stub.geocode(query.get("name", ""))
+                elif url.path.endswith("/forecast"):
+                    body = stub.forecast(query)
+                else:
+                    self.send_error(404)
+                    return
+                content = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server((host, port), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def geocoding_url(self) -> str:
+        return f"{self.base_url}/v1/search"
+
+    @property
+    def forecast_url(self) -> str:
+        return f"{self.base_url}/v1/forecast"
+
+    def geocode(self, name: str) -> dict:
+        if not name.strip():
+            return {"generationtime_ms": 0.1}
+        # Stable, distinct coordinates per name
+        seed = sum(map(ord, name))
+        return {"results": [{"name": name,
+                             "latitude": round(-60 + seed % 120 + 0.5, 4),
+                             "longitude": round(-170 + seed % 340 + 0.5, 4)}]}
+
+    def forecast(self, query: dict) -> dict:
+        try:
+            start_date = datetime.date.fromisoformat(query["start_date"])
+            end_date = datetime.date.fromisoformat(query["end_date"])
+        except (KeyError, ValueError):
+            return {"error": True, "reason": "Invalid date"}
+        if self.num_days is not None:
+            end_date = start_date + datetime.timedelta(days=self.num_days - 1)
+        return forecast_payload(start_date, end_date,
+                                np.random.default_rng(hash(query["latitude"])
+                                                      % 2 ** 32),
+                                tuple(filter(None, query.get("hourly", "")
+                                             .split(","))))
+
+    def start(self) -> "StubUpstream":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "StubUpstream":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Serves the stub open-meteo APIs until interrupted.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Latency per request in seconds.")
+    parser.add_argument("--num-days", type=int,
+                        help="Fixed number of days in forecast payloads.")
+    args = parser.parse_args()
+
+    stub = StubUpstream(latency=args.latency, num_days=args.num_days,
+                        port=args.port)
+    print(f"WAGA_GEOCODING_URL={stub.geocoding_url}\n"
+          f"WAGA_FORECAST_URL={stub.forecast_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
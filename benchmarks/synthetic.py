@@ -0,0 +1,110 @@
+"""
+Synthetic forecast data used by the benchmarks.
+"""
+import datetime
+import sqlite3
+from typing import Iterator
+
+import numpy as np
+
+FORECAST_DAYS = 7
+
+
+def generate_rows(num_rows: int,
+                  num_cities: int = 50,
+                  forecast_days: int = FORECAST_DAYS,
+                  seed: int = 0) -> Iterator[tuple]:
+    """
+    Generates forecasts table rows the way daily fetches produce them:
+    for every city and request date, one measured row followed by
+    forecast_days forecasted rows.
+
+    Args:
+        num_rows (int): approximate number of rows to generate
+        num_cities (int): number of distinct cities
+        forecast_days (int): forecasts made per request date
+        seed (int): random generator seed
+
+    Returns:
+        Iterator[tuple] (rows without the primary key, in column order)
+    """
+    rng = np.random.default_rng(seed)
+    rows_per_day = forecast_days + 1
+    num_days = max(1, num_rows // (num_cities * rows_per_day))
+    first_day = datetime.date(2000, 1, 1)
+
+    for day in range(num_days):
+        request_date = first_day + datetime.timedelta(days=day)
+        values = rng.uniform(-10, 40, size=(num_cities, rows_per_day, 4))
+        for city in range(num_cities):
+            city_name = f"City {city}"
+            for lead in range(rows_per_day):
+                yield (city_name,
+                       request_date.isoformat(),
+                       (request_date +
+                        datetime.timedelta(days=lead)).isoformat(),
+                       *values[city, lead].round(1).tolist(),
+                       lead > 0,
+                       lead)
+
+
+def fill_database(db_path: str, num_rows: int, **kwargs) -> int:
+    """
+    Creates the schema in the database file and fills it with
+    synthetic rows.
+
+    Args:
+        db_path (str): path to the SQLite database file
+        num_rows (int): approximate number of rows to generate
+        kwargs: passed to generate_rows
+
+    Returns:
+        int (number of rows inserted)
+    """
+    from sqlalchemy import create_engine
+    from database.db import Base
+    from database.migrations import migrate
+    from models.forecast import Forecast  # noqa: F401
+    from models.geocode import Geocode  # noqa: F401
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    migrate(engine)
+    engine.dispose()
+
+    connection = sqlite3.connect(db_path)
+    with connection:
+        cursor = connection.executemany(
+            "INSERT INTO forecasts (city_name, request_date, measure_date, "
+            "temp_min, temp_max, precipitation_sum, windspeed_max, "
+            "is_forecast, lead_days) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            generate_rows(num_rows, **kwargs))
+    connection.execute("ANALYZE")
+    connection.close()
+    return cursor.rowcount
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Fills a database with synthetic forecasts.")
+    parser.add_argument("db_path", nargs="?",
+                        help="Database file, waga.db by default.")
+    parser.add_argument("--rows", type=int, default=1_000_000,
+                        help="Approximate number of rows, e.g. 10000 to "
+                             "10000000.")
+    parser.add_argument("--cities", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.db_path is None:
+        from database.db import path_to_db
+        args.db_path = path_to_db
+
+    started = time.perf_counter()
+    inserted = fill_database(args.db_path, args.rows,
+                             num_cities=args.cities, seed=args.seed)
+    print(f"Inserted {inserted} rows into {args.db_path} "
+          f"in {time.perf_counter() - started:.1f}s.")
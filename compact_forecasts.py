@@ -0,0 +1,57 @@
+import argparse
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deletes superseded "
+                                                 "forecasts according to the "
+                                                 "retention policy and "
+                                                 "releases the freed space. "
+                                                 "Measurements replaced by a "
+                                                 "later measurement of the "
+                                                 "same date are always "
+                                                 "deleted.")
+    parser.add_argument("-k",
+                        "--keep_latest",
+                        type=int,
+                        help="Number of forecasts kept per city and measure "
+                             "date, newest first. All are kept by default, "
+                             "or WAGA_RETENTION_KEEP_LATEST if set.")
+
+    parser.add_argument("-a",
+                        "--max_age_days",
+                        type=int,
+                        help="Delete everything measured more than this "
+                             "many days ago. Nothing is deleted by age by "
+                             "default, or WAGA_RETENTION_MAX_AGE_DAYS if set.")
+
+    parser.add_argument("-b",
+                        "--batch_size",
+                        type=int,
+                        default=500,
+                        help="Number of forecasts deleted per database "
+                             "transaction.")
+
+    parser.add_argument("--vacuum",
+                        action="store_true",
+                        help="Rebuild the database file with incremental "
+                             "auto vacuum enabled, needed once for "
+                             "databases created before it was the default. "
+                             "Locks the database during the rebuild.")
+    args = parser.parse_args()
+
+    from database.db import configure_database, engine
+    from utils.compaction import RetentionPolicy, compact, vacuum
+    from utils.utils import configure_logging
+
+    configure_logging()
+    configure_database()
+    policy = RetentionPolicy.from_env()
+    if args.keep_latest is not None:
+        policy.keep_latest = args.keep_latest
+    if args.max_age_days is not None:
+        policy.max_age_days = args.max_age_days
+
+    result = compact(policy, batch_size=args.batch_size)
+    print(result.format())
+    if args.vacuum:
+        vacuum(engine)
+        print("Rebuilt the database file with incremental auto vacuum.")
@@ -1,33 +1,258 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase, MappedAsDataclass
-from os import path
+from dataclasses import dataclass
+from typing import Callable, TypeVar
 
+from sqlalchemy import create_engine, event, Engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import (sessionmaker, DeclarativeBase, MappedAsDataclass,
+                            Session)
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from os import environ, path
 
+
+from database.writer import GroupCommitWriter
+from utils.metrics import DB_SECONDS, instrument_engine
+from utils.profiling import record_statements
 from utils.utils import LoggingCtxManager
 
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """
+    SQLite connection settings. Pragmas left as None keep the SQLite
+    defaults. With a read pool, queries are served by a pool of read-only
+    connections, and with group commit all writes go through a single
+    writer connection, see GroupCommitWriter.
+    """
+    # Only takes effect for new database files, whose freed pages can then
+    # be released by compaction, see utils.compaction
+    auto_vacuum: str | None = "INCREMENTAL"
+    journal_mode: str | None = None
+    synchronous: str | None = None
+    mmap_size: int | None = None
+    cache_size: int | None = None
+    busy_timeout: int | None = None
+    read_pool_size: int = 0
+    group_commit: bool = False
+
+    def pragmas(self, read_only: bool = False) -> dict[str, object]:
+        # auto_vacuum goes first, since switching to WAL creates the
+        # database file, after which it can no longer change
+        pragmas = {"auto_vacuum": self.auto_vacuum,
+                   "journal_mode": self.journal_mode,
+                   "synchronous": self.synchronous,
+                   "mmap_size": self.mmap_size,
+                   "cache_size": self.cache_size,
+                   "busy_timeout": self.busy_timeout}
+        if read_only:
+            # The journal mode is stored in the database file by the writer
+            del pragmas["auto_vacuum"], pragmas["journal_mode"], \
+                pragmas["synchronous"]
+        return {name: value for name, value in pragmas.items()
+                if value is not None}
+
+
+STORAGE_PROFILES = {
+    "default": StorageProfile(),
+    "concurrent": StorageProfile(journal_mode="WAL",
+                                 synchronous="NORMAL",
+                                 mmap_size=256 * 1024 * 1024,
+                                 cache_size=-64 * 1024,
+                                 busy_timeout=5000,
+                                 read_pool_size=8,
+                                 group_commit=True),
+}
+
+
+def get_storage_profile(name: str) -> StorageProfile:
+    """
+    Returns the storage profile with the given name.
+
+    Args:
+        name (str): name of the profile, see STORAGE_PROFILES
+
+    Returns:
+        StorageProfile
+    """
+    try:
+        return STORAGE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown storage profile {name!r}, expected one "
+                         f"of: {', '.join(STORAGE_PROFILES)}.") from None
+
+
+storage_profile = get_storage_profile(environ.get("WAGA_STORAGE_PROFILE",
+                                                  "default"))
+
 module_dir = path.dirname(__file__)
-path_to_db = f"{path.abspath(path.join(module_dir, '..', 'waga.db'))}"
+path_to_db = environ.get(
+    "WAGA_DB_PATH",
+    f"{path.abspath(path.join(module_dir, '..', 'waga.db'))}")
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{path_to_db}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{path_to_db}"
+READ_ONLY_URL_SUFFIX = "?mode=ro&uri=true"
+
+
+def apply_storage_profile(bind: Engine, read_only: bool = False) -> None:
+    """
+    Registers event listeners which configure every new connection
+    of the engine according to the storage profile.
+
+    Args:
+        bind (Engine): engine whose connections are configured
+        read_only (bool): flag which indicates read-only connections
+
+    Returns:
+        None
+    """
+    pragmas = storage_profile.pragmas(read_only)
+
+    @event.listens_for(bind, "connect")
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+        if storage_profile.group_commit and not read_only:
+            # Transactions are started explicitly below, which also makes
+            # savepoints work with pysqlite
+            dbapi_connection.isolation_level = None
+
+    if storage_profile.group_commit and not read_only:
+        @event.listens_for(bind, "begin")
+        def begin_immediate(connection):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL,
-                       connect_args={"check_same_thread": False})
+                       connect_args={"check_same_thread": False},
+                       **({"poolclass": QueuePool,
+                           "pool_size": 1,
+                           "max_overflow": 0}
+                          if storage_profile.group_commit else {}))
+apply_storage_profile(engine)
+instrument_engine(engine)
+record_statements(engine)
 
 DBSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+apply_storage_profile(async_engine.sync_engine)
+instrument_engine(async_engine.sync_engine)
+record_statements(async_engine.sync_engine)
+
+AsyncDBSession = async_sessionmaker(autoflush=False,
+                                    expire_on_commit=False,
+                                    bind=async_engine)
+
+if storage_profile.read_pool_size:
+    read_engine = create_engine(
+        f"sqlite:///file:{path_to_db}{READ_ONLY_URL_SUFFIX}",
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=storage_profile.read_pool_size)
+    apply_storage_profile(read_engine, read_only=True)
+    instrument_engine(read_engine)
+    record_statements(read_engine)
+    async_read_engine = create_async_engine(
+        f"sqlite+aiosqlite:///file:{path_to_db}{READ_ONLY_URL_SUFFIX}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=storage_profile.read_pool_size)
+    apply_storage_profile(async_read_engine.sync_engine, read_only=True)
+    instrument_engine(async_read_engine.sync_engine)
+    record_statements(async_read_engine.sync_engine)
+
+    ReadDBSession = sessionmaker(autoflush=False, bind=read_engine)
+    AsyncReadDBSession = async_sessionmaker(autoflush=False,
+                                            expire_on_commit=False,
+                                            bind=async_read_engine)
+else:
+    ReadDBSession = DBSession
+    AsyncReadDBSession = AsyncDBSession
+
+writer = GroupCommitWriter(lambda: DBSession()) \
+    if storage_profile.group_commit else None
+
 
 class Base(DeclarativeBase, MappedAsDataclass):
     ...
 
 
+def run_write(fn: Callable[[Session], T]) -> T:
+    """
+    Runs the writes done by fn and commits them, through the group commit
+    writer if the storage profile uses one.
+
+    Args:
+        fn (Callable): function executing the writes through the
+                       passed session, without committing them
+
+    Returns:
+        the value returned by fn
+    """
+    if writer is not None:
+        with DB_SECONDS.time(operation="write"):
+            return writer.run(fn)
+    with DBSession() as db_session, DB_SECONDS.time(operation="write"):
+        result = fn(db_session)
+        db_session.commit()
+        return result
+
+
+async def run_write_async(fn: Callable[[Session], T]) -> T:
+    """
+    Asynchronous variant of run_write.
+
+    Args:
+        fn (Callable): function executing the writes through the
+                       passed (sync) session, without committing them
+
+    Returns:
+        the value returned by fn
+    """
+    with DB_SECONDS.time(operation="write"):
+        if writer is not None:
+            return await writer.run_async(fn)
+        async with AsyncDBSession() as db_session:
+            result = await db_session.run_sync(fn)
+            await db_session.commit()
+            return result
+
+
+async def dispose_engines() -> None:
+    if writer is not None:
+        writer.close()
+    await async_engine.dispose()
+    if storage_profile.read_pool_size:
+        await async_read_engine.dispose()
+        read_engine.dispose()
+    engine.dispose()
+
+
 def configure_database() -> None:
     from models.forecast import Forecast
+    from models.geocode import Geocode  # noqa: F401 - registers the table
+    from models.hourly_forecast import HourlyForecast  # noqa: F401
+    from models.ingestion_job import IngestionJob  # noqa: F401
+    from models.location_alias import LocationAlias  # noqa: F401
+    from models.scheduled_city import ScheduledCity  # noqa: F401
+    from database.migrations import (SCHEMA_VERSION, get_schema_version,
+                                     migrate)
     """
     Creates the database tables according to
-    the metadata found in the specified classes.
+    the metadata found in the specified classes,
+    and applies pending schema migrations. Both are skipped when the
+    stored schema version is already the current one, which keeps the
+    startup of short-lived processes cheap.
 
     Returns:
         None
     """
     with LoggingCtxManager():
-        Forecast.metadata.create_all(bind=engine)
-
+        with engine.connect() as connection:
+            if get_schema_version(connection) == SCHEMA_VERSION:
+                return
+        with engine.begin() as connection:
+            Forecast.metadata.create_all(bind=connection)
+        migrate(engine)
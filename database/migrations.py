@@ -0,0 +1,164 @@
+"""
+Schema migrations for existing databases.
+
+Each migration is applied once, in order, and the number of applied
+migrations is stored in the SQLite user_version pragma. Migrations are run
+by configure_database, or manually against any database file with:
+
+    python -m database.migrations [path/to/waga.db]
+
+configure_database skips table creation for databases whose schema version
+is current, so tables added to the models need a migration creating them.
+"""
+import argparse
+from typing import Callable
+
+from sqlalchemy import Connection, Engine, create_engine, text
+
+
+def _deduplicate_forecasts(connection: Connection) -> None:
+    """
+    Removes forecasts stored more than once under the same
+    (city_name, request_date, measure_date) key, keeping the most recently
+    inserted row, and adds the unique index on that key.
+    """
+    connection.execute(text(
+        "DELETE FROM forecasts WHERE id NOT IN "
+        "(SELECT max(id) FROM forecasts "
+        "GROUP BY city_name, request_date, measure_date)"))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_forecasts_natural_key "
+        "ON forecasts (city_name, request_date, measure_date)"))
+
+
+def _add_forecast_diff_index(connection: Connection) -> None:
+    """
+    Adds the composite index used by the forecast differences query.
+    """
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_forecasts_city_measure_date "
+        "ON forecasts (city_name, measure_date, is_forecast, request_date)"))
+    connection.execute(text("ANALYZE forecasts"))
+
+
+def _build_forecast_accuracy(connection: Connection) -> None:
+    """
+    Creates the forecast accuracy summary table and fills it from the
+    stored forecasts.
+    """
+    from sqlalchemy.orm import Session
+    from models.accuracy import ForecastAccuracy
+
+    ForecastAccuracy.__table__.create(connection, checkfirst=True)
+    ForecastAccuracy.rebuild(Session(bind=connection))
+
+
+def _add_ingestion_scheduling(connection: Connection) -> None:
+    """
+    Creates the scheduled cities and ingestion job queue tables.
+    """
+    from models.ingestion_job import IngestionJob
+    from models.scheduled_city import ScheduledCity
+
+    ScheduledCity.__table__.create(connection, checkfirst=True)
+    IngestionJob.__table__.create(connection, checkfirst=True)
+
+
+def _add_forecast_lead_days(connection: Connection) -> None:
+    """
+    Adds the indexed lead_days column to the forecasts, filled from the
+    request and measure dates, and builds the accuracy by lead time table.
+    """
+    from sqlalchemy.orm import Session
+    from models.accuracy import ForecastLeadAccuracy
+
+    columns = [row[1] for row in
+               connection.execute(text("PRAGMA table_info(forecasts)"))]
+    if "lead_days" not in columns:
+        connection.execute(text(
+            "ALTER TABLE forecasts "
+            "ADD COLUMN lead_days INTEGER NOT NULL DEFAULT 0"))
+        connection.execute(text(
+            "UPDATE forecasts SET lead_days = CAST(round("
+            "julianday(measure_date) - julianday(request_date)) AS INTEGER)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_forecasts_city_lead_days "
+        "ON forecasts (city_name, lead_days, measure_date)"))
+    ForecastLeadAccuracy.__table__.create(connection, checkfirst=True)
+    ForecastLeadAccuracy.rebuild(Session(bind=connection))
+
+
+def _add_location_aliases(connection: Connection) -> None:
+    """
+    Creates the table mapping city names to the grid cell their
+    forecasts are stored under.
+    """
+    from models.location_alias import LocationAlias
+
+    LocationAlias.__table__.create(connection, checkfirst=True)
+
+
+def _add_hourly_forecasts(connection: Connection) -> None:
+    """
+    Creates the table holding the packed hourly values of the forecasts.
+    """
+    from models.hourly_forecast import HourlyForecast
+
+    HourlyForecast.__table__.create(connection, checkfirst=True)
+
+
+MIGRATIONS: list[Callable[[Connection], None]] = [
+    _deduplicate_forecasts,
+    _add_forecast_diff_index,
+    _build_forecast_accuracy,
+    _add_ingestion_scheduling,
+    _add_forecast_lead_days,
+    _add_location_aliases,
+    _add_hourly_forecasts,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(connection: Connection) -> int:
+    return connection.execute(text("PRAGMA user_version")).scalar_one()
+
+
+def migrate(engine: Engine) -> list[str]:
+    """
+    Applies all migrations which have not been applied to the database yet.
+    Every migration runs in its own transaction, together with the
+    schema version update.
+
+    Args:
+        engine (Engine): engine bound to the database being migrated
+
+    Returns:
+        list[str] (names of the applied migrations)
+    """
+    applied = []
+    with engine.connect() as connection:
+        version = get_schema_version(connection)
+    for number, migration in enumerate(MIGRATIONS[version:],
+                                       start=version + 1):
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(text(f"PRAGMA user_version = {number}"))
+        applied.append(migration.__name__.lstrip("_"))
+    return applied
+
+
+if __name__ == "__main__":
+    from database.db import path_to_db
+
+    parser = argparse.ArgumentParser(description="Applies pending schema "
+                                                 "migrations to a forecast "
+                                                 "database file.")
+    parser.add_argument("db_path",
+                        nargs="?",
+                        default=path_to_db,
+                        help="Path to the SQLite database file.")
+    args = parser.parse_args()
+
+    applied = migrate(create_engine(f"sqlite:///{args.db_path}"))
+    print(f"Applied {len(applied)} migration(s) to {args.db_path}"
+          + (f": {', '.join(applied)}." if applied else "."))
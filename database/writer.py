@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, TypeVar
+
+from sqlalchemy.orm import Session
+
+T = TypeVar("T")
+
+
+class GroupCommitWriter:
+    """
+    Serializes all database writes through one thread, which owns the only
+    write connection. Jobs queued while a commit is in progress are
+    executed together and committed at once, so concurrent writers share
+    a single fsync instead of contending for the database lock.
+    Every job runs inside its own savepoint, so a failing job does not
+    affect the rest of its group.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session],
+                 max_group_size: int = 64,
+                 max_delay: float = 0.002):
+        self.session_factory = session_factory
+        self.max_group_size = max_group_size
+        self.max_delay = max_delay
+        self.commits = 0
+        self.jobs = 0
+        self.logger = logging.getLogger("forecast")
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[[Session], T]) -> "Future[T]":
+        """
+        Queues a write job. The returned future is resolved with the job's
+        return value once its group has been committed.
+
+        Args:
+            fn (Callable): function executing the writes through the
+                           passed session, without committing them
+
+        Returns:
+            Future
+        """
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="db-writer",
+                                                daemon=True)
+                self._thread.start()
+            self._queue.put((fn, future))
+        return future
+
+    def run(self, fn: Callable[[Session], T]) -> T:
+        return self.submit(fn).result()
+
+    async def run_async(self, fn: Callable[[Session], T]) -> T:
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def close(self) -> None:
+        """
+        Stops the writer thread after the queued jobs are committed.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def _next_group(self) -> list | None:
+        job = self._queue.get()
+        if job is None:
+            return None
+        group = [job]
+        while len(group) < self.max_group_size:
+            try:
+                job = self._queue.get(timeout=self.max_delay)
+            except queue.Empty:
+                break
+            if job is None:
+                # Stop after this group has been committed
+                self._queue.put(None)
+                break
+            group.append(job)
+        return group
+
+    def _run(self) -> None:
+        while (group := self._next_group()) is not None:
+            results = []
+            try:
+                with self.session_factory() as db_session:
+                    for fn, future in group:
+                        savepoint = db_session.begin_nested()
+                        try:
+                            results.append((future, fn(db_session), None))
+                            savepoint.commit()
+                        except Exception as e:
+                            savepoint.rollback()
+                            results.append((future, None, e))
+                    db_session.commit()
+            except Exception as e:
+                self.logger.exception("Group commit failed.")
+                for _, future in group:
+                    future.set_exception(e)
+                continue
+
+            self.commits += 1
+            self.jobs += len(group)
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
@@ -1,28 +1,28 @@
 from argparse import Namespace
-
-from database.db import configure_database
-from models.forecast import Forecast
-from utils.utils import generate_open_meteo_config
 import argparse
 from datetime import date
 
 if __name__ == "__main__":
-    # Sets up the database if it is not initialized
-    configure_database()
-
     parser = argparse.ArgumentParser(description="Fetches and stores new "
                                                  "weather forecast data "
                                                  "for the specified town or "
                                                  "city and within the "
                                                  "specified start and end "
                                                  "dates.")
-    parser.add_argument("-c",
+    cities = parser.add_mutually_exclusive_group(required=True)
+    cities.add_argument("-c",
                         "--city_name",
                         type=str,
                         help="City or town name whose weather forecast is "
                              "being retrieved. Please use double quotation "
-                             "marks if the name contains multiple words.",
-                        required=True)
+                             "marks if the name contains multiple words.")
+
+    cities.add_argument("-f",
+                        "--cities_file",
+                        type=argparse.FileType("r", encoding="utf-8"),
+                        help="File containing one city or town name per "
+                             "line, whose forecasts are fetched concurrently. "
+                             "Use - to read the names from stdin.")
 
     parser.add_argument("-s",
                         "--start_date",
@@ -35,12 +35,69 @@ if __name__ == "__main__":
                         type=date.fromisoformat,
                         help="Ending date used for forecast retrieval.",
                         required=True)
-    # Contains .city_name, .start_date, .end_date attrs
+
+    parser.add_argument("-r",
+                        "--refresh",
+                        action="store_true",
+                        help="Fetch all days again, including the ones "
+                             "which were already stored today.")
+
+    parser.add_argument("--hourly",
+                        action="store_true",
+                        help="Also fetch and store the hourly temperature, "
+                             "precipitation and wind speed.")
+
+    parser.add_argument("-w",
+                        "--workers",
+                        type=int,
+                        default=8,
+                        help="Maximum number of cities fetched concurrently "
+                             "in batch mode.")
+
+    parser.add_argument("-b",
+                        "--batch_size",
+                        type=int,
+                        default=5000,
+                        help="Number of forecasts committed per database "
+                             "transaction in batch mode.")
+    # Contains .city_name or .cities_file, .start_date, .end_date attrs
     args: Namespace = parser.parse_args()
 
+    # Imported once the arguments are valid, so usage errors and --help
+    # do not pay for loading SQLAlchemy and the HTTP clients
+    from database.db import configure_database, run_write
+    from models.forecast import Forecast
+    from models.location_alias import LocationAlias
+    from utils.ingestion import ingest_cities, read_city_names
+    from utils.utils import configure_logging, generate_open_meteo_config
+
+    configure_logging()
+    # Sets up the database if it is not initialized
+    configure_database()
+
+    if args.cities_file is not None:
+        with args.cities_file:
+            city_names = read_city_names(args.cities_file)
+        summary = ingest_cities(city_names, args.start_date, args.end_date,
+                                workers=args.workers,
+                                batch_size=args.batch_size,
+                                incremental=not args.refresh,
+                                hourly=args.hourly)
+        print(summary.format())
+        raise SystemExit(1 if summary.failed else 0)
+
     client_config = generate_open_meteo_config(vars(args))
+    run_write(lambda db_session: LocationAlias.register(
+        args.city_name, client_config.location_key, db_session))
 
-    forecasts = Forecast.get_forecast(args.city_name, config=client_config)
-    print(f"Succesfully fetched {len(forecasts)} forecasts between "
+    result = Forecast.get_forecast(client_config.location_key,
+                                   config=client_config,
+                                   incremental=not args.refresh)
+    print(f"Succesfully fetched {len(result)} forecasts between "
           f"{args.start_date} and {args.end_date} for the city "
-          f"of {args.city_name}.")
+          f"of {args.city_name} ({result.inserted} inserted, "
+          f"{result.updated} updated, {result.unchanged} unchanged). "
+          f"{result.stored_days} day(s) were already stored, "
+          f"{result.fetched_days} day(s) were fetched."
+          + (f" Stored the hourly values of {result.hourly_days} day(s)."
+             if result.hourly_days else ""))
@@ -0,0 +1,332 @@
+import datetime
+import math
+from dataclasses import dataclass
+from typing import Hashable, Iterable, Sequence
+
+from sqlalchemy import Float, Integer, Select, String, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+from database.db import Base
+
+# Compared quantities, in the order of Forecast.diff_query's difference columns
+METRICS = ("temp_min", "temp_max", "precipitation", "windspeed_max")
+# Running sums kept per metric
+SUMS = ("err_sum", "abs_err_sum", "sq_err_sum")
+# Period under which the all-time totals are stored
+ALL_TIME = ""
+
+
+def period_of(measure_date: datetime.date) -> str:
+    return measure_date.strftime("%Y-%m")
+
+
+def sum_columns() -> tuple[str, ...]:
+    return ("count",) + tuple(f"{metric}_{name}"
+                              for metric in METRICS for name in SUMS)
+
+
+def accumulate(deltas: dict[Hashable, list[float]], key: Hashable,
+               sign: int, errors: Sequence[float]) -> None:
+    """
+    Adds (sign 1) or subtracts (sign -1) one forecast/measurement pair to
+    the sum deltas stored under the key, in sum_columns order.
+    """
+    delta = deltas.get(key)
+    if delta is None:
+        delta = deltas[key] = [0] + [0.0] * (len(METRICS) * len(SUMS))
+    delta[0] += sign
+    for i, error in enumerate(errors):
+        delta[1 + 3 * i] += sign * error
+        delta[2 + 3 * i] += sign * abs(error)
+        delta[3 + 3 * i] += sign * error * error
+
+
+def upsert_sums(table, key_columns: Sequence[str], rows: list[dict],
+                db_session: Session) -> None:
+    """
+    Adds the sum deltas of the rows to the stored sums, creating the
+    missing rows. Committing is left to the caller.
+    """
+    if not rows:
+        return
+    stmt = insert(table)
+    db_session.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c[name] for name in key_columns],
+        set_={name: table.c[name] + stmt.excluded[name]
+              for name in sum_columns()}), rows)
+
+
+def clear_sums(table, city_names: Iterable[str] | None,
+               db_session: Session) -> list[str]:
+    """
+    Deletes the stored sums of the cities, all by default, before they
+    are rebuilt. Committing is left to the caller.
+
+    Returns:
+        list[str] (names of the cities to be rebuilt)
+    """
+    from models.forecast import Forecast
+
+    if city_names is None:
+        db_session.execute(table.delete())
+        return db_session.scalars(
+            select(Forecast.city_name).distinct()).all()
+    city_names = list(city_names)
+    db_session.execute(table.delete().where(
+        table.c.city_name.in_(city_names)))
+    return city_names
+
+
+def error_statistics(sums) -> dict[str, dict[str, float | None]]:
+    """
+    Returns the mean absolute error, bias (mean error) and root mean
+    squared error of every metric, None if there are no pairs.
+
+    Args:
+        sums: object holding the sum_columns as attributes
+
+    Returns:
+        dict
+    """
+    count = sums.count
+    stats = {}
+    for metric in METRICS:
+        err_sum, abs_err_sum, sq_err_sum = (
+            getattr(sums, f"{metric}_{name}") for name in SUMS)
+        stats[metric] = {
+            "mae": abs_err_sum / count if count else None,
+            "bias": err_sum / count if count else None,
+            # Running sums may drift slightly below zero
+            "rmse": math.sqrt(max(sq_err_sum, 0.0) / count)
+            if count else None}
+    return stats
+
+
+@dataclass
+class ForecastAccuracy(Base):
+    """
+    ForecastAccuracy class used for ORM purposes. Holds running sums of the
+    forecast errors (forecasted minus measured value) of a city, per
+    measure month ("YYYY-MM") and for all time, so accuracy statistics are
+    read from a single row. Kept up to date by Forecast.upsert.
+    """
+
+    __tablename__ = "forecast_accuracy"
+
+    city_name: Mapped[str] = mapped_column(String, primary_key=True)
+    period: Mapped[str] = mapped_column(String, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    temp_min_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_min_abs_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_min_sq_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_max_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_max_abs_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_max_sq_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    precipitation_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    precipitation_abs_err_sum: Mapped[float] = \
+        mapped_column(Float, default=0.0)
+    precipitation_sq_err_sum: Mapped[float] = \
+        mapped_column(Float, default=0.0)
+    windspeed_max_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    windspeed_max_abs_err_sum: Mapped[float] = \
+        mapped_column(Float, default=0.0)
+    windspeed_max_sq_err_sum: Mapped[float] = \
+        mapped_column(Float, default=0.0)
+
+    @staticmethod
+    def apply(city_name: str,
+              removed: Iterable[Sequence],
+              added: Iterable[Sequence],
+              db_session: Session) -> None:
+        """
+        Updates the running sums of the city, subtracting the removed
+        forecast/measurement pairs and adding the new ones.
+        Committing is left to the caller.
+
+        Args:
+            city_name (str): name of the city the pairs belong to
+            removed (Iterable): (measure_date, *diffs) rows no longer valid
+            added (Iterable): (measure_date, *diffs) rows to be counted
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            None
+        """
+        deltas: dict[str, list[float]] = {}
+        for sign, diffs in ((-1, removed), (1, added)):
+            for measure_date, *errors in diffs:
+                for period in (ALL_TIME, period_of(measure_date)):
+                    accumulate(deltas, period, sign, errors)
+
+        upsert_sums(ForecastAccuracy.__table__, ("city_name", "period"),
+                    [{"city_name": city_name, "period": period,
+                      **dict(zip(sum_columns(), delta))}
+                     for period, delta in deltas.items() if any(delta)],
+                    db_session)
+
+    @staticmethod
+    def rebuild(db_session: Session,
+                city_names: Iterable[str] | None = None) -> int:
+        """
+        Recomputes the running sums of the cities, all by default, from the
+        stored forecasts, e.g. after rows were written without going
+        through Forecast.upsert. Committing is left to the caller.
+
+        Args:
+            db_session (Session): session used for executing the statements
+            city_names (Iterable[str]): optional subset of the cities
+
+        Returns:
+            int (number of cities)
+        """
+        from models.forecast import Forecast
+
+        city_names = clear_sums(ForecastAccuracy.__table__, city_names,
+                                db_session)
+        for city_name in city_names:
+            ForecastAccuracy.apply(
+                city_name, (), db_session.execute(
+                    Forecast.diff_query(city_name)), db_session)
+        return len(city_names)
+
+    @staticmethod
+    async def get_async(city_name: str, period: str,
+                        db_session: AsyncSession) \
+            -> "ForecastAccuracy | None":
+        return (await db_session.execute(
+            ForecastAccuracy._query(city_name, period))).scalar_one_or_none()
+
+    @staticmethod
+    def _query(city_name: str, period: str) -> Select:
+        return select(ForecastAccuracy).where(
+            ForecastAccuracy.city_name == city_name,
+            ForecastAccuracy.period == period)
+
+    def statistics(self) -> dict[str, dict[str, float | None]]:
+        """
+        Returns the error statistics of every metric, see error_statistics.
+
+        Returns:
+            dict
+        """
+        return error_statistics(self)
+
+
+@dataclass
+class ForecastLeadAccuracy(Base):
+    """
+    ForecastLeadAccuracy class used for ORM purposes. Holds running sums of
+    the forecast errors of a city per lead time, i.e. the number of days
+    the forecast was made ahead of the measure date. Unlike
+    ForecastAccuracy, every stored forecast of a measured date is counted,
+    not only the latest one. Kept up to date by Forecast.upsert.
+    """
+
+    __tablename__ = "forecast_accuracy_by_lead"
+
+    city_name: Mapped[str] = mapped_column(String, primary_key=True)
+    lead_days: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    temp_min_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_min_abs_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_min_sq_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_max_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_max_abs_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_max_sq_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    precipitation_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    precipitation_abs_err_sum: Mapped[float] = \
+        mapped_column(Float, default=0.0)
+    precipitation_sq_err_sum: Mapped[float] = \
+        mapped_column(Float, default=0.0)
+    windspeed_max_err_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    windspeed_max_abs_err_sum: Mapped[float] = \
+        mapped_column(Float, default=0.0)
+    windspeed_max_sq_err_sum: Mapped[float] = \
+        mapped_column(Float, default=0.0)
+
+    @staticmethod
+    def apply(city_name: str,
+              removed: Iterable[Sequence],
+              added: Iterable[Sequence],
+              db_session: Session) -> None:
+        """
+        Updates the running sums of the city, subtracting the removed
+        forecast/measurement pairs and adding the new ones.
+        Committing is left to the caller.
+
+        Args:
+            city_name (str): name of the city the pairs belong to
+            removed (Iterable): (measure_date, lead_days, *diffs) rows
+                                no longer valid
+            added (Iterable): (measure_date, lead_days, *diffs) rows
+                              to be counted
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            None
+        """
+        deltas: dict[int, list[float]] = {}
+        for sign, diffs in ((-1, removed), (1, added)):
+            for _, lead_days, *errors in diffs:
+                accumulate(deltas, lead_days, sign, errors)
+
+        upsert_sums(ForecastLeadAccuracy.__table__,
+                    ("city_name", "lead_days"),
+                    [{"city_name": city_name, "lead_days": lead_days,
+                      **dict(zip(sum_columns(), delta))}
+                     for lead_days, delta in deltas.items() if any(delta)],
+                    db_session)
+
+    @staticmethod
+    def rebuild(db_session: Session,
+                city_names: Iterable[str] | None = None) -> int:
+        """
+        Recomputes the running sums of the cities, all by default, from the
+        stored forecasts. Committing is left to the caller.
+
+        Args:
+            db_session (Session): session used for executing the statements
+            city_names (Iterable[str]): optional subset of the cities
+
+        Returns:
+            int (number of cities)
+        """
+        from models.forecast import Forecast
+
+        city_names = clear_sums(ForecastLeadAccuracy.__table__, city_names,
+                                db_session)
+        for city_name in city_names:
+            ForecastLeadAccuracy.apply(
+                city_name, (), db_session.execute(
+                    Forecast.lead_diff_query(city_name)), db_session)
+        return len(city_names)
+
+    @staticmethod
+    async def get_all_async(city_name: str,
+                            db_session: AsyncSession,
+                            max_lead_days: int | None = None) \
+            -> list["ForecastLeadAccuracy"]:
+        """
+        Returns the sums of the city ordered by lead time.
+
+        Args:
+            city_name (str): name of the city
+            db_session (AsyncSession): session used for executing the query
+            max_lead_days (int): optional maximum lead time
+
+        Returns:
+            list[ForecastLeadAccuracy]
+        """
+        query = select(ForecastLeadAccuracy).where(
+            ForecastLeadAccuracy.city_name == city_name,
+            ForecastLeadAccuracy.count > 0)
+        if max_lead_days is not None:
+            query = query.where(
+                ForecastLeadAccuracy.lead_days <= max_lead_days)
+        return list(await db_session.scalars(
+            query.order_by(ForecastLeadAccuracy.lead_days)))
+
+    def statistics(self) -> dict[str, dict[str, float | None]]:
+        return error_statistics(self)
@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from typing import Iterable
+
+from sqlalchemy import Column, String, Integer, Select, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, Session
+
+from database.db import Base
+
+
+@dataclass
+class DataVersion(Base):
+    """
+    DataVersion class used for ORM purposes. Holds a per-city counter
+    which is incremented whenever the city's stored forecasts change,
+    so cached responses can be validated with a primary key lookup.
+    """
+
+    __tablename__ = "data_versions"
+
+    city_name: Mapped[str] = Column(String, primary_key=True)
+    version: Mapped[int] = Column(Integer, nullable=False, default=0)
+
+    @staticmethod
+    def bump(city_names: Iterable[str], db_session: Session) -> None:
+        """
+        Increments the data versions of the cities.
+        Committing is left to the caller.
+
+        Args:
+            city_names (Iterable[str]): names of the cities whose data changed
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            None
+        """
+        rows = [{"city_name": city_name, "version": 1}
+                for city_name in city_names]
+        if not rows:
+            return
+        stmt = insert(DataVersion.__table__)
+        db_session.execute(stmt.on_conflict_do_update(
+            index_elements=[DataVersion.city_name],
+            set_={"version": DataVersion.version + 1}), rows)
+
+    @staticmethod
+    def current(city_name: str, db_session: Session) -> int:
+        """
+        Returns the data version of the city, 0 if it has no stored data.
+
+        Args:
+            city_name (str): name of the city
+            db_session (Session): session used for executing the query
+
+        Returns:
+            int
+        """
+        return db_session.scalar(DataVersion._query(city_name)) or 0
+
+    @staticmethod
+    async def current_async(city_name: str, db_session: AsyncSession) -> int:
+        """
+        Asynchronous variant of DataVersion.current.
+
+        Args:
+            city_name (str): name of the city
+            db_session (AsyncSession): session used for executing the query
+
+        Returns:
+            int
+        """
+        return await db_session.scalar(DataVersion._query(city_name)) or 0
+
+    @staticmethod
+    def _query(city_name: str) -> Select:
+        return select(DataVersion.version) \
+            .where(DataVersion.city_name == city_name)
@@ -1,14 +1,69 @@
+import asyncio
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterable, TypeVar
 
 import requests
-from sqlalchemy import Column, String, Date, Float
-from sqlalchemy.orm import Mapped, mapped_column, aliased
-from sqlalchemy import select
+from sqlalchemy import (Alias, Column, ColumnElement, String, Date, Float,
+                        Index, Integer, Row, Select)
+from sqlalchemy import and_, false, func, or_, select, true, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Mapped, Session, mapped_column
 
-from database.db import Base, DBSession
-from utils.utils import ClientConfig, LoggingCtxManager
+from database.db import (AsyncReadDBSession, Base, ReadDBSession,
+                         run_write, run_write_async)
+from models.accuracy import ForecastAccuracy, ForecastLeadAccuracy
+from models.data_version import DataVersion
+from utils.metrics import (DB_SECONDS, PARSE_SECONDS, ROWS_INGESTED,
+                           UPSTREAM_SECONDS)
+from utils.planning import FetchPlan, as_date, plan_fetch
+from utils.utils import ClientConfig, LoggingCtxManager, diff_cache
+
+if TYPE_CHECKING:
+    import httpx
+
+T = TypeVar("T")
+
+NATURAL_KEY = ("city_name", "request_date", "measure_date")
+VALUE_COLUMNS = ("temp_min", "temp_max", "precipitation_sum", "windspeed_max")
+DIFF_COLUMNS = ("temp_min_diff", "temp_max_diff",
+                "precipitation_diff", "windspeed_max_diff")
+# Upstream requests made at once for the date ranges of one fetch
+MAX_PARALLEL_CHUNKS = 8
+
+
+@dataclass
+class IngestionResult:
+    """
+    Outcome of a forecast ingestion. Its length is the number of
+    forecast rows received, while the counters describe how they were stored.
+    """
+    rows: list[dict] = field(default_factory=list)
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # Requested days served from storage and fetched from upstream
+    stored_days: int = 0
+    fetched_days: int = 0
+    # Days whose hourly values were stored, see HourlyForecast
+    hourly_days: int = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def to_dict(self) -> dict:
+        # Days served from storage count towards the requested total
+        result = {"total_new": len(self) + self.stored_days,
+                  "inserted": self.inserted,
+                  "updated": self.updated,
+                  "unchanged": self.unchanged,
+                  "days_from_storage": self.stored_days,
+                  "days_fetched": self.fetched_days}
+        if self.hourly_days:
+            result["hourly_days"] = self.hourly_days
+        return result
 
 
 @dataclass
@@ -18,6 +73,15 @@ class Forecast(Base):
     """
 
     __tablename__ = "forecasts"
+    __table_args__ = (Index("uq_forecasts_natural_key", *NATURAL_KEY,
+                            unique=True),
+                      # request_date makes the index covering for the
+                      # latest forecast lookups done by diff_query
+                      Index("ix_forecasts_city_measure_date",
+                            "city_name", "measure_date", "is_forecast",
+                            "request_date"),
+                      Index("ix_forecasts_city_lead_days",
+                            "city_name", "lead_days", "measure_date"))
 
     id: Mapped[int] = mapped_column(init=False, primary_key=True, index=True)
     city_name: Mapped[str] = Column(String, nullable=False)
@@ -29,61 +93,689 @@ class Forecast(Base):
         Column(Float(precision=4), nullable=False)
     windspeed_max: Mapped[float] = Column(Float(precision=4), nullable=False)
     is_forecast: Mapped[bool] = mapped_column(init=False)
+    # Days between the request and the measure date, negative for
+    # measurements of past days
+    lead_days: Mapped[int] = mapped_column(Integer, init=False)
 
     def __post_init__(self):
         self.is_forecast = self.measure_date > self.request_date
+        self.lead_days = (self.measure_date - self.request_date).days
 
     @staticmethod
     def get_forecast(city_name: str,
                      config: ClientConfig,
-                     save_to_db: bool = True) -> list["Forecast"]:
+                     save_to_db: bool = True,
+                     session: requests.Session | None = None,
+                     incremental: bool = True) -> IngestionResult:
         """
         Fetches data from the remote service based on the city name and
-        passed configuration object, and by default saves it to the project
-        specified database.
+        passed configuration object, and by default upserts it into the
+        project specified database.
+        In incremental mode, only the days which were not stored today yet
+        are requested, see Forecast.plan_fetch. Date ranges are fetched
+        in parallel and merged before they are stored.
+
+        Args:
+            city_name (str): name of the city whose weather forecast will be fetched
+            config (ClientConfig): configuration object which contains the url,
+                                   parameters and response data handler function
+            save_to_db (bool): flag which indicates if the data should be
+                               saved to a database
+            session (requests.Session): optional session whose connection
+                                        pool is reused for the request
+            incremental (bool): flag which indicates if days already stored
+                                today should be skipped
+
+        Returns:
+            IngestionResult
+        """
+        session = session or requests.Session()
+
+        with ReadDBSession() as db_session, \
+                DB_SECONDS.time(operation="plan"):
+            plan = Forecast.plan_fetch(city_name, config, db_session,
+                                       incremental)
+
+        def fetch(range_config: ClientConfig) -> list[dict]:
+            request = requests.Request(method="GET",
+                                       url=range_config.api_url,
+                                       params=range_config.params)
+            with LoggingCtxManager(), \
+                    UPSTREAM_SECONDS.time(service="forecast"):
+                response = session.send(session.prepare_request(request))
+            with PARSE_SECONDS.time():
+                return range_config.handler_fn(city_name, response.json())
+
+        range_configs = [config.for_range(*date_range)
+                         for date_range in plan.ranges]
+        if len(range_configs) > 1:
+            with ThreadPoolExecutor(max_workers=min(
+                    len(range_configs), MAX_PARALLEL_CHUNKS)) as pool:
+                chunks = list(pool.map(fetch, range_configs))
+        else:
+            chunks = [fetch(range_config) for range_config in range_configs]
+        rows = Forecast.merge_rows(chunks)
+
+        result = IngestionResult(rows)
+        if save_to_db and rows:
+            with LoggingCtxManager():
+                result = run_write(
+                    lambda db_session: Forecast.upsert(rows, db_session))
+
+        return Forecast._finish(city_name, result, rows, plan)
+
+    @staticmethod
+    async def get_forecast_async(city_name: str,
+                                 config: ClientConfig,
+                                 client: "httpx.AsyncClient",
+                                 save_to_db: bool = True,
+                                 incremental: bool = True) \
+            -> IngestionResult:
+        """
+        Asynchronous variant of get_forecast, which fetches the data with
+        the passed client and stores it through an async database session.
 
         Args:
             city_name (str): name of the city whose weather forecast will be fetched
             config (ClientConfig): configuration object which contains the url,
                                    parameters and response data handler function
+            client (httpx.AsyncClient): client used for the request
             save_to_db (bool): flag which indicates if the data should be
                                saved to a database
+            incremental (bool): flag which indicates if days already stored
+                                today should be skipped
 
         Returns:
-            list[Forecast]
+            IngestionResult
         """
-        session = requests.Session()
-        request = requests.Request(method="GET",
-                                   url=config.api_url,
-                                   params=config.params)
+        async with AsyncReadDBSession() as db_session:
+            with DB_SECONDS.time(operation="plan"):
+                plan = await db_session.run_sync(
+                    lambda sync_session: Forecast.plan_fetch(
+                        city_name, config, sync_session, incremental))
+
+        parallel_chunks = asyncio.Semaphore(MAX_PARALLEL_CHUNKS)
 
-        with LoggingCtxManager():
-            response = session.send(session.prepare_request(request))
+        async def fetch(range_config: ClientConfig) -> list[dict]:
+            async with parallel_chunks:
+                with LoggingCtxManager(), \
+                        UPSTREAM_SECONDS.time(service="forecast"):
+                    response = await client.get(range_config.api_url,
+                                                params=range_config.params)
+            with PARSE_SECONDS.time():
+                return range_config.handler_fn(city_name, response.json())
 
-        forecasts = config.handler_fn(city_name, response.json())
+        chunks = await asyncio.gather(*(
+            fetch(config.for_range(*date_range))
+            for date_range in plan.ranges))
+        rows = Forecast.merge_rows(chunks)
 
-        if save_to_db:
+        result = IngestionResult(rows)
+        if save_to_db and rows:
             with LoggingCtxManager():
-                with DBSession() as db_session:
-                    db_session.add_all(forecasts)
-                    db_session.commit()
-
-        return forecasts
-
-    @staticmethod
-    def get_forecast_diffs(city_name: str):
-        a = aliased(Forecast, name="a")
-        b = aliased(Forecast, name="b")
-        with DBSession() as db:
-            forecasts = \
-                db.execute(select(a, b).where(
-                    a.city_name == city_name,
-                    b.city_name == city_name,
-                    a.measure_date == b.measure_date,
-                    a.is_forecast != b.is_forecast)
-                           .group_by(a.measure_date)
-                           .order_by(a.measure_date)).fetchall()
-            return forecasts
+                result = await run_write_async(
+                    lambda db_session: Forecast.upsert(rows, db_session))
+
+        return Forecast._finish(city_name, result, rows, plan)
+
+    @staticmethod
+    def plan_fetch(city_name: str,
+                   config: ClientConfig,
+                   db_session: Session,
+                   incremental: bool = True) -> FetchPlan:
+        """
+        Plans the upstream requests for the date range in the passed
+        configuration. In incremental mode, days which were already stored
+        for the city today are left out; if the configuration requests
+        hourly values, the days whose hourly values were stored today.
+
+        Args:
+            city_name (str): name of the city whose weather forecast will be fetched
+            config (ClientConfig): configuration object containing the
+                                   start_date and end_date parameters
+            db_session (Session): session used for querying stored days
+            incremental (bool): flag which indicates if stored days
+                                should be skipped
+
+        Returns:
+            FetchPlan
+        """
+        start_date = as_date(config.params["start_date"])
+        end_date = as_date(config.params["end_date"])
+        stored_dates = []
+        if incremental:
+            from models.hourly_forecast import HourlyForecast
+
+            table = HourlyForecast.__table__ if config.params.get("hourly") \
+                else Forecast.__table__
+            stored_dates = db_session.scalars(
+                select(table.c.measure_date).where(
+                    table.c.city_name == city_name,
+                    table.c.request_date == date.today(),
+                    table.c.measure_date.between(start_date, end_date)))
+        return plan_fetch(start_date, end_date, stored_dates,
+                          config.max_days)
+
+    @staticmethod
+    def merge_rows(chunks: list[list[dict]]) -> list[dict]:
+        return sorted((row for rows in chunks for row in rows),
+                      key=lambda row: row["measure_date"])
+
+    @staticmethod
+    def _finish(city_name: str, result: IngestionResult, rows: list[dict],
+                plan: FetchPlan) -> IngestionResult:
+        if result.inserted or result.updated:
+            diff_cache.invalidate(city_name)
+        result.rows = rows
+        result.stored_days = plan.stored_days
+        result.fetched_days = plan.fetched_days
+        return result
+
+    @staticmethod
+    def upsert(rows: list[dict],
+               db_session: Session,
+               batch_size: int = 500) -> IngestionResult:
+        """
+        Inserts the rows, updating the ones whose natural key
+        (city_name, request_date, measure_date) is already stored.
+        Rows are written with executemany batches of an
+        INSERT ... ON CONFLICT DO UPDATE statement, which leaves rows
+        holding identical values untouched. The data versions of cities
+        whose forecasts changed are incremented, and their accuracy sums
+        (overall and per lead time) updated with the forecast/measurement
+        pairs of the changed measure dates, in the same transaction.
+        Hourly values attached to the rows under the "hourly" key, see
+        handle_open_meteo_rows, are stored with HourlyForecast.upsert.
+        Committing is left to the caller.
+
+        Args:
+            rows (list[dict]): forecast rows, see Forecast.as_row
+            db_session (Session): session used for executing the statements
+            batch_size (int): number of rows written per statement
+
+        Returns:
+            IngestionResult
+        """
+        table = Forecast.__table__
+        key_columns = [table.c[name] for name in NATURAL_KEY]
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={name: stmt.excluded[name]
+                  for name in VALUE_COLUMNS + ("is_forecast",)},
+            where=or_(*(table.c[name] != stmt.excluded[name]
+                        for name in VALUE_COLUMNS)))
+
+        # The last row wins if the same natural key is passed more than once
+        rows = list({tuple(row[name] for name in NATURAL_KEY): row
+                     for row in rows}.values())
+        hourly_rows = [{**{name: row[name]
+                           for name in NATURAL_KEY + ("is_forecast",
+                                                      "lead_days")},
+                        **row["hourly"]}
+                       for row in rows if "hourly" in row]
+        if hourly_rows:
+            rows = [{name: value for name, value in row.items()
+                     if name != "hourly"} for row in rows]
+        result = IngestionResult()
+        changed_dates: dict[str, set[date]] = {}
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            stored = {tuple(row[:len(NATURAL_KEY)]): row[len(NATURAL_KEY):]
+                      for row in db_session.execute(
+                          select(*key_columns,
+                                 *(table.c[name] for name in VALUE_COLUMNS))
+                          .where(tuple_(*key_columns).in_(
+                              [tuple(row[name] for name in NATURAL_KEY)
+                               for row in batch])))}
+            for row in batch:
+                values = stored.get(tuple(row[name] for name in NATURAL_KEY))
+                if values is None:
+                    result.inserted += 1
+                elif tuple(values) == tuple(row[name]
+                                            for name in VALUE_COLUMNS):
+                    result.unchanged += 1
+                    continue
+                else:
+                    result.updated += 1
+                changed_dates.setdefault(row["city_name"], set()) \
+                    .add(row["measure_date"])
+
+        def write():
+            for i in range(0, len(rows), batch_size):
+                db_session.execute(stmt, rows[i:i + batch_size])
+
+        Forecast._track_changes(changed_dates, write, db_session)
+        if hourly_rows:
+            from models.hourly_forecast import HourlyForecast
+
+            result.hourly_days = HourlyForecast.upsert(hourly_rows,
+                                                       db_session)
+        for outcome in ("inserted", "updated", "unchanged"):
+            ROWS_INGESTED.inc(getattr(result, outcome), outcome=outcome)
+
+        return result
+
+    @staticmethod
+    def delete(ids: list[int], db_session: Session) -> int:
+        """
+        Deletes the forecasts with the given ids, updating the data
+        versions and accuracy sums of the affected cities in the same
+        transaction, see Forecast.upsert. Committing is left to the caller.
+
+        Args:
+            ids (list[int]): primary keys of the deleted forecasts
+            db_session (Session): session used for executing the statements
+
+        Returns:
+            int (number of deleted rows)
+        """
+        table = Forecast.__table__
+        changed_dates: dict[str, set[date]] = {}
+        for city_name, measure_date in db_session.execute(
+                select(table.c.city_name, table.c.measure_date)
+                .where(table.c.id.in_(ids))):
+            changed_dates.setdefault(city_name, set()).add(measure_date)
+
+        return Forecast._track_changes(
+            changed_dates,
+            lambda: db_session.execute(
+                table.delete().where(table.c.id.in_(ids))).rowcount,
+            db_session)
+
+    @staticmethod
+    def rename(city_name: str, new_name: str, db_session: Session) -> int:
+        """
+        Moves the forecasts of a city to another name, e.g. its location
+        key, see LocationAlias.register. Rows whose natural key is already
+        stored under the new name are dropped in favour of the stored ones.
+        Data versions and accuracy sums of both names are updated in the
+        same transaction, see Forecast.upsert.
+        Committing is left to the caller.
+
+        Args:
+            city_name (str): name the forecasts are stored under
+            new_name (str): name the forecasts are moved to
+            db_session (Session): session used for executing the statements
+
+        Returns:
+            int (number of moved rows)
+        """
+        table = Forecast.__table__
+        measure_dates = set(db_session.scalars(
+            select(table.c.measure_date).distinct()
+            .where(table.c.city_name == city_name)))
+        if not measure_dates:
+            return 0
+        stored = table.alias("stored")
+        conflicting = select(stored.c.id).where(
+            stored.c.city_name == new_name,
+            stored.c.request_date == table.c.request_date,
+            stored.c.measure_date == table.c.measure_date).exists()
+
+        def write() -> int:
+            db_session.execute(table.delete().where(
+                table.c.city_name == city_name, conflicting))
+            return db_session.execute(
+                table.update().where(table.c.city_name == city_name)
+                .values(city_name=new_name)).rowcount
+
+        return Forecast._track_changes({city_name: measure_dates,
+                                        new_name: measure_dates},
+                                       write, db_session)
+
+    @staticmethod
+    def _track_changes(changed_dates: dict[str, set[date]],
+                       write: Callable[[], T],
+                       db_session: Session) -> T:
+        # Forecast/measurement pairs replaced by the written rows
+        previous_diffs = {
+            city_name: (Forecast.pair_diffs(city_name, measure_dates,
+                                            db_session),
+                        Forecast.pair_diffs(city_name, measure_dates,
+                                            db_session, each_lead=True))
+            for city_name, measure_dates in changed_dates.items()}
+        result = write()
+        for city_name, measure_dates in changed_dates.items():
+            latest, each_lead = previous_diffs[city_name]
+            ForecastAccuracy.apply(
+                city_name, latest,
+                Forecast.pair_diffs(city_name, measure_dates, db_session),
+                db_session)
+            ForecastLeadAccuracy.apply(
+                city_name, each_lead,
+                Forecast.pair_diffs(city_name, measure_dates, db_session,
+                                    each_lead=True),
+                db_session)
+        DataVersion.bump(changed_dates, db_session)
+        return result
+
+    @staticmethod
+    def superseded_query(keep_latest: int | None = None,
+                         before: date | None = None) -> Select:
+        """
+        Builds the query which selects the ids of the forecasts a retention
+        policy removes: measurements replaced by a later measurement of the
+        same date, forecasts beyond the keep_latest most recent ones of
+        their measure date, and everything measured before the given date.
+        The latest forecast and measurement of a date, which are the ones
+        compared by Forecast.diff_query, are kept unless the date is older.
+
+        Args:
+            keep_latest (int): optional number of forecasts kept per city
+                               and measure date, newest request dates first
+            before (date): optional first measure date which is kept
+
+        Returns:
+            Select (id, ordered by city and measure date)
+        """
+        table = Forecast.__table__
+        ranked = select(
+            table.c.id, table.c.city_name, table.c.measure_date,
+            table.c.is_forecast,
+            func.row_number().over(
+                partition_by=(table.c.city_name, table.c.measure_date,
+                              table.c.is_forecast),
+                order_by=table.c.request_date.desc()).label("newer")
+        ).subquery()
+        conditions = [and_(ranked.c.is_forecast == false(),
+                           ranked.c.newer > 1)]
+        if keep_latest is not None:
+            conditions.append(and_(ranked.c.is_forecast == true(),
+                                   ranked.c.newer > keep_latest))
+        if before is not None:
+            conditions.append(ranked.c.measure_date < before)
+        # Batches of consecutive ids then touch few cities and dates
+        return select(ranked.c.id).where(or_(*conditions)).order_by(
+            ranked.c.city_name, ranked.c.measure_date, ranked.c.id)
+
+    def as_row(self) -> dict:
+        """
+        Returns the column values of the forecast, without the primary key.
+
+        Returns:
+            dict
+        """
+        return {name: getattr(self, name)
+                for name in NATURAL_KEY + VALUE_COLUMNS +
+                ("is_forecast", "lead_days")}
+
+    @staticmethod
+    def diff_query(city_name: str,
+                   start_date: date | None = None,
+                   end_date: date | None = None,
+                   after: date | None = None,
+                   limit: int | None = None,
+                   measure_dates: Iterable[date] | None = None,
+                   lead_days: int | None = None) -> Select:
+        """
+        Builds the query which computes the differences between forecasted
+        and measured values of a city, one row per measure date.
+        Each measurement is compared with the latest forecast made for
+        its date, i.e. the one with the latest request date before the
+        measure date, or with the forecast made lead_days before it if set.
+        If a date was measured more than once, the latest measurement is
+        used.
+
+        Args:
+            city_name (str): name of the city whose differences are queried
+            start_date (date): optional first measure date (inclusive)
+            end_date (date): optional last measure date (inclusive)
+            after (date): optional keyset pagination cursor, only measure
+                          dates after it are returned
+            limit (int): optional maximum number of returned rows
+            measure_dates (Iterable[date]): optional measure dates the rows
+                                            are restricted to
+            lead_days (int): optional lead time of the compared forecasts
+
+        Returns:
+            Select (measure_date followed by the DIFF_COLUMNS)
+        """
+        measured = Forecast.__table__.alias("m")
+        return Forecast._diffs(
+            measured, measured.c.city_name == city_name, start_date,
+            end_date, after, measure_dates, lead_days
+        ).order_by(measured.c.measure_date).limit(limit)
+
+    @staticmethod
+    def lead_diff_query(city_name: str,
+                        measure_dates: Iterable[date] | None = None) \
+            -> Select:
+        """
+        Builds the query which compares every forecast of a city with the
+        measurement of its date, not only the latest one,
+        see Forecast.diff_query.
+
+        Args:
+            city_name (str): name of the city whose differences are queried
+            measure_dates (Iterable[date]): optional measure dates the rows
+                                            are restricted to
+
+        Returns:
+            Select (measure_date, lead_days and the DIFF_COLUMNS)
+        """
+        measured = Forecast.__table__.alias("m")
+        return Forecast._diffs(measured, measured.c.city_name == city_name,
+                               measure_dates=measure_dates, each_lead=True)
+
+    @staticmethod
+    def batch_diff_query(city_names: Iterable[str],
+                         start_date: date | None = None,
+                         end_date: date | None = None) -> Select:
+        """
+        Builds the query which computes the differences of multiple cities
+        at once, ordered by city and measure date, see Forecast.diff_query.
+
+        Args:
+            city_names (Iterable[str]): names of the cities whose
+                                        differences are queried
+            start_date (date): optional first measure date (inclusive)
+            end_date (date): optional last measure date (inclusive)
+
+        Returns:
+            Select (city_name, measure_date and the DIFF_COLUMNS)
+        """
+        measured = Forecast.__table__.alias("m")
+        query = Forecast._diffs(measured,
+                                measured.c.city_name.in_(list(city_names)),
+                                start_date, end_date)
+        return query.with_only_columns(
+            measured.c.city_name, *query.selected_columns
+        ).order_by(measured.c.city_name, measured.c.measure_date)
+
+    @staticmethod
+    def _diffs(measured: Alias,
+               city_condition: ColumnElement[bool],
+               start_date: date | None = None,
+               end_date: date | None = None,
+               after: date | None = None,
+               measure_dates: Iterable[date] | None = None,
+               lead_days: int | None = None,
+               each_lead: bool = False) -> Select:
+        forecasted = Forecast.__table__.alias("f")
+        return Forecast.pairs_query(
+            measured, forecasted, city_condition, start_date, end_date,
+            after, measure_dates, lead_days, each_lead
+        ).add_columns(
+            *((forecasted.c.lead_days,) if each_lead else ()),
+            *((forecasted.c[name] - measured.c[name]).label(diff_name)
+              for name, diff_name in zip(VALUE_COLUMNS, DIFF_COLUMNS)))
+
+    @staticmethod
+    def pairs_query(measured: Alias,
+                    forecasted: Alias,
+                    city_condition: ColumnElement[bool],
+                    start_date: date | None = None,
+                    end_date: date | None = None,
+                    after: date | None = None,
+                    measure_dates: Iterable[date] | None = None,
+                    lead_days: int | None = None,
+                    each_lead: bool = False) -> Select:
+        """
+        Builds the query joining the latest measurement of every measure
+        date with the forecasts it is compared with, see
+        Forecast.diff_query. measured and forecasted are aliases of the
+        same table, which is also used by HourlyForecast. Only the measure
+        date is selected, the compared columns are added by the caller.
+
+        Returns:
+            Select (measure_date)
+        """
+        def latest_request_date(table, is_forecast: bool):
+            latest = table.element.alias()
+            return select(func.max(latest.c.request_date)).where(
+                latest.c.city_name == table.c.city_name,
+                latest.c.measure_date == table.c.measure_date,
+                latest.c.is_forecast == is_forecast).scalar_subquery()
+
+        if lead_days is not None:
+            compared = forecasted.c.lead_days == lead_days
+        elif each_lead:
+            compared = true()
+        else:
+            compared = forecasted.c.request_date == \
+                latest_request_date(forecasted, True)
+
+        query = select(measured.c.measure_date).join_from(
+            measured, forecasted,
+            and_(forecasted.c.city_name == measured.c.city_name,
+                 forecasted.c.measure_date == measured.c.measure_date,
+                 forecasted.c.is_forecast == true(),
+                 compared)
+        ).where(
+            city_condition,
+            measured.c.is_forecast == false(),
+            measured.c.request_date == latest_request_date(measured, False)
+        )
+
+        if start_date is not None:
+            query = query.where(measured.c.measure_date >= start_date)
+        if end_date is not None:
+            query = query.where(measured.c.measure_date <= end_date)
+        if after is not None:
+            query = query.where(measured.c.measure_date > after)
+        if measure_dates is not None:
+            query = query.where(measured.c.measure_date.in_(measure_dates))
+        return query
+
+    @staticmethod
+    def pair_diffs(city_name: str,
+                   measure_dates: Iterable[date],
+                   db_session: Session,
+                   batch_size: int = 500,
+                   each_lead: bool = False) -> list[Row]:
+        """
+        Retrieves the differences of the city for the given measure dates
+        only, see Forecast.diff_query and Forecast.lead_diff_query.
+
+        Args:
+            city_name (str): name of the city whose differences are queried
+            measure_dates (Iterable[date]): measure dates of interest
+            db_session (Session): session used for executing the queries
+            batch_size (int): number of measure dates queried per statement
+            each_lead (bool): flag which indicates if every forecast is
+                              compared, instead of the latest one
+
+        Returns:
+            list[Row] (measure_date, lead_days if each_lead is set,
+                       and the DIFF_COLUMNS)
+        """
+        query = Forecast.lead_diff_query if each_lead else \
+            Forecast.diff_query
+        measure_dates = sorted(measure_dates)
+        return [diff for i in range(0, len(measure_dates), batch_size)
+                for diff in db_session.execute(query(
+                    city_name,
+                    measure_dates=measure_dates[i:i + batch_size]))]
+
+    @staticmethod
+    def get_forecast_diffs(city_name: str, **filters) -> list[Row]:
+        """
+        Retrieves the differences between forecasted and measured values
+        of a city, computed by the database, see Forecast.diff_query.
+
+        Args:
+            city_name (str): name of the city whose differences are queried
+            filters: date filters and pagination, see Forecast.diff_query
+
+        Returns:
+            list[Row] (measure_date followed by the DIFF_COLUMNS)
+        """
+        with ReadDBSession() as db, DB_SECONDS.time(operation="diffs"):
+            return db.execute(
+                Forecast.diff_query(city_name, **filters)).fetchall()
+
+    @staticmethod
+    async def get_forecast_diffs_async(city_name: str, **filters) \
+            -> list[Row]:
+        """
+        Asynchronous variant of get_forecast_diffs.
+
+        Args:
+            city_name (str): name of the city whose differences are queried
+            filters: date filters and pagination, see Forecast.diff_query
+
+        Returns:
+            list[Row] (measure_date followed by the DIFF_COLUMNS)
+        """
+        async with AsyncReadDBSession() as db:
+            with DB_SECONDS.time(operation="diffs"):
+                return (await db.execute(
+                    Forecast.diff_query(city_name, **filters))).all()
+
+    @staticmethod
+    async def get_batch_diffs_async(city_names: list[str],
+                                    start_date: date | None = None,
+                                    end_date: date | None = None) \
+            -> dict[str, list[tuple]]:
+        """
+        Retrieves the differences of multiple cities through a single
+        query, see Forecast.batch_diff_query.
+
+        Args:
+            city_names (list[str]): names of the cities whose differences
+                                    are queried
+            start_date (date): optional first measure date (inclusive)
+            end_date (date): optional last measure date (inclusive)
+
+        Returns:
+            dict[str, list[tuple]] ((measure_date, *diffs) rows by city name,
+                                    for the cities with stored forecasts)
+        """
+        async with AsyncReadDBSession() as db:
+            with DB_SECONDS.time(operation="batch_diffs"):
+                diffs = {city_name: [] for city_name in await db.scalars(
+                    select(Forecast.city_name).distinct()
+                    .where(Forecast.city_name.in_(city_names)))}
+                for city_name, *diff in await db.execute(
+                        Forecast.batch_diff_query(city_names, start_date,
+                                                  end_date)):
+                    diffs[city_name].append(diff)
+        return diffs
+
+    @staticmethod
+    async def stream_forecast_diffs(city_name: str,
+                                    batch_size: int = 1000,
+                                    **filters) -> AsyncIterator[list[Row]]:
+        """
+        Streams the differences from a server-side cursor, in batches of
+        at most batch_size rows, so they never have to be held in memory
+        at once.
+
+        Args:
+            city_name (str): name of the city whose differences are queried
+            batch_size (int): number of rows fetched per batch
+            filters: date filters, see Forecast.diff_query
+
+        Returns:
+            AsyncIterator[list[Row]]
+        """
+        async with AsyncReadDBSession() as db:
+            result = await db.stream(
+                Forecast.diff_query(city_name, **filters)
+                .execution_options(yield_per=batch_size))
+            async for batch in result.partitions():
+                yield batch
 
     def __sub__(self, other: "Forecast"):
         """
@@ -0,0 +1,29 @@
+import datetime
+from dataclasses import dataclass
+
+from sqlalchemy import Column, String, Float, DateTime
+from sqlalchemy.orm import Mapped
+
+from database.db import Base
+
+
+@dataclass
+class Geocode(Base):
+    """
+    Geocode class used for ORM purposes. Persists the geocoding cache,
+    keyed by the normalized city name. Cities which could not be found
+    are stored without coordinates.
+    """
+
+    __tablename__ = "geocodes"
+
+    name: Mapped[str] = Column(String, primary_key=True)
+    latitude: Mapped[float | None] = Column(Float, nullable=True)
+    longitude: Mapped[float | None] = Column(Float, nullable=True)
+    expires_at: Mapped[datetime.datetime] = Column(DateTime, nullable=False)
+
+    @property
+    def coordinates(self) -> tuple[float, float] | None:
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self.latitude, self.longitude
@@ -0,0 +1,229 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Sequence
+
+import numpy as np
+from sqlalchemy import Column, Date, Index, Integer, LargeBinary, Row, \
+    Select, String
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+from database.db import AsyncReadDBSession, Base
+from models.forecast import NATURAL_KEY, Forecast
+from utils.metrics import DB_SECONDS
+
+HOURS = 24
+# Hourly values are stored as HOURS little-endian float32 values per day
+HOURLY_DTYPE = np.dtype("<f4")
+HOURLY_COLUMNS = ("temperature", "precipitation", "windspeed")
+HOURLY_DIFF_COLUMNS = ("temperature_diff", "precipitation_diff",
+                       "windspeed_diff")
+
+
+def pack_hours(values: Sequence[float] | np.ndarray) -> bytes:
+    """
+    Packs the HOURS values of a day into the stored binary format.
+
+    Args:
+        values (Sequence[float] | np.ndarray): values of the day, NaN
+                                               for missing hours
+
+    Returns:
+        bytes
+    """
+    values = np.asarray(values, dtype=HOURLY_DTYPE)
+    if values.shape != (HOURS,):
+        raise ValueError(f"Expected {HOURS} hourly values, "
+                         f"got {values.shape}.")
+    return values.tobytes()
+
+
+def unpack_hours(blobs: Sequence[bytes]) -> np.ndarray:
+    """
+    Decodes packed days into one (days, HOURS) float32 array, with a
+    single np.frombuffer call over their concatenation.
+
+    Args:
+        blobs (Sequence[bytes]): days packed by pack_hours
+
+    Returns:
+        np.ndarray
+    """
+    data = b"".join(blobs)
+    if len(data) != len(blobs) * HOURS * HOURLY_DTYPE.itemsize:
+        raise ValueError("Packed hourly values have an invalid length.")
+    return np.frombuffer(data, dtype=HOURLY_DTYPE).reshape(-1, HOURS)
+
+
+@dataclass
+class HourlyForecast(Base):
+    """
+    HourlyForecast class used for ORM purposes. Holds the hourly values
+    of one forecasted or measured day, keyed like Forecast, with each
+    column packing the HOURS values of the day, see pack_hours.
+    """
+
+    __tablename__ = "hourly_forecasts"
+    __table_args__ = (Index("uq_hourly_forecasts_natural_key", *NATURAL_KEY,
+                            unique=True),
+                      Index("ix_hourly_forecasts_city_measure_date",
+                            "city_name", "measure_date", "is_forecast",
+                            "request_date"))
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    city_name: Mapped[str] = Column(String, nullable=False)
+    request_date: Mapped[date] = Column(Date, nullable=False)
+    measure_date: Mapped[date] = Column(Date, nullable=False)
+    temperature: Mapped[bytes] = Column(LargeBinary, nullable=False)
+    precipitation: Mapped[bytes] = Column(LargeBinary, nullable=False)
+    windspeed: Mapped[bytes] = Column(LargeBinary, nullable=False)
+    is_forecast: Mapped[bool] = mapped_column(init=False)
+    lead_days: Mapped[int] = mapped_column(Integer, init=False)
+
+    def __post_init__(self):
+        self.is_forecast = self.measure_date > self.request_date
+        self.lead_days = (self.measure_date - self.request_date).days
+
+    def as_row(self) -> dict:
+        """
+        Returns the column values of the forecast, without the primary key.
+
+        Returns:
+            dict
+        """
+        return {name: getattr(self, name)
+                for name in NATURAL_KEY + HOURLY_COLUMNS +
+                ("is_forecast", "lead_days")}
+
+    @staticmethod
+    def upsert(rows: list[dict],
+               db_session: Session,
+               batch_size: int = 500) -> int:
+        """
+        Inserts the rows, updating the ones whose natural key is already
+        stored, see Forecast.upsert. Committing is left to the caller.
+
+        Args:
+            rows (list[dict]): hourly forecast rows, see
+                               HourlyForecast.as_row
+            db_session (Session): session used for executing the statements
+            batch_size (int): number of rows written per statement
+
+        Returns:
+            int (number of written days)
+        """
+        table = HourlyForecast.__table__
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[name] for name in NATURAL_KEY],
+            set_={name: stmt.excluded[name]
+                  for name in HOURLY_COLUMNS + ("is_forecast",)},
+            where=or_(*(table.c[name] != stmt.excluded[name]
+                        for name in HOURLY_COLUMNS)))
+
+        # The last row wins if the same natural key is passed more than once
+        rows = list({tuple(row[name] for name in NATURAL_KEY): row
+                     for row in rows}.values())
+        for i in range(0, len(rows), batch_size):
+            db_session.execute(stmt, rows[i:i + batch_size])
+        return len(rows)
+
+    @staticmethod
+    def rename(city_name: str, new_name: str, db_session: Session) -> int:
+        """
+        Moves the hourly forecasts of a city to another name, see
+        Forecast.rename. Committing is left to the caller.
+
+        Args:
+            city_name (str): name the forecasts are stored under
+            new_name (str): name the forecasts are moved to
+            db_session (Session): session used for executing the statements
+
+        Returns:
+            int (number of moved rows)
+        """
+        table = HourlyForecast.__table__
+        stored = table.alias("stored")
+        db_session.execute(table.delete().where(
+            table.c.city_name == city_name,
+            select(stored.c.id).where(
+                stored.c.city_name == new_name,
+                stored.c.request_date == table.c.request_date,
+                stored.c.measure_date == table.c.measure_date).exists()))
+        return db_session.execute(
+            table.update().where(table.c.city_name == city_name)
+            .values(city_name=new_name)).rowcount
+
+    @staticmethod
+    def diff_query(city_name: str,
+                   start_date: date | None = None,
+                   end_date: date | None = None,
+                   lead_days: int | None = None) -> Select:
+        """
+        Builds the query which pairs the latest hourly measurement of each
+        measure date of a city with its latest hourly forecast, or with the
+        forecast made lead_days before it if set, see Forecast.diff_query.
+        The packed values are returned as stored, see HourlyForecast.diffs.
+
+        Args:
+            city_name (str): name of the city whose differences are queried
+            start_date (date): optional first measure date (inclusive)
+            end_date (date): optional last measure date (inclusive)
+            lead_days (int): optional lead time of the compared forecasts
+
+        Returns:
+            Select (measure_date, then the forecasted and measured values
+                    of each of the HOURLY_COLUMNS)
+        """
+        table = HourlyForecast.__table__
+        measured, forecasted = table.alias("m"), table.alias("f")
+        return Forecast.pairs_query(
+            measured, forecasted, measured.c.city_name == city_name,
+            start_date, end_date, lead_days=lead_days
+        ).add_columns(
+            *(alias.c[name] for name in HOURLY_COLUMNS
+              for alias in (forecasted, measured))
+        ).order_by(measured.c.measure_date)
+
+    @staticmethod
+    def diffs(rows: Sequence[Row]) -> tuple[list[date], dict[str, np.ndarray]]:
+        """
+        Decodes the rows of HourlyForecast.diff_query and subtracts the
+        measured from the forecasted values, one array operation per column
+        over all days. Hours missing on either side are NaN.
+
+        Args:
+            rows (Sequence[Row]): rows returned by HourlyForecast.diff_query
+
+        Returns:
+            tuple (measure dates, and a (days, HOURS) float32 array per
+                   name of the HOURLY_DIFF_COLUMNS)
+        """
+        columns = list(zip(*rows)) or [()] * (1 + 2 * len(HOURLY_COLUMNS))
+        return list(columns[0]), {
+            diff_name: unpack_hours(columns[1 + 2 * i]) -
+            unpack_hours(columns[2 + 2 * i])
+            for i, diff_name in enumerate(HOURLY_DIFF_COLUMNS)}
+
+    @staticmethod
+    async def get_hourly_diffs_async(city_name: str, **filters) \
+            -> tuple[list[date], dict[str, np.ndarray]]:
+        """
+        Retrieves the hourly differences between forecasted and measured
+        values of a city, see HourlyForecast.diff_query and
+        HourlyForecast.diffs.
+
+        Args:
+            city_name (str): name of the city whose differences are queried
+            filters: date filters and lead time, see
+                     HourlyForecast.diff_query
+
+        Returns:
+            tuple (measure dates, and the differences by column)
+        """
+        async with AsyncReadDBSession() as db:
+            with DB_SECONDS.time(operation="hourly_diffs"):
+                rows = (await db.execute(
+                    HourlyForecast.diff_query(city_name, **filters))).all()
+        return HourlyForecast.diffs(rows)
@@ -0,0 +1,182 @@
+import datetime
+from dataclasses import dataclass
+
+from sqlalchemy import (Column, Date, DateTime, Index, Integer, Row, String,
+                        delete, func, select, text, update)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+from database.db import Base
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class IngestionJob(Base):
+    """
+    IngestionJob class used for ORM purposes. A persistent queue entry
+    for the refresh of a city's forecasts, processed by the Scheduler.
+    A city has at most one queued or running job at a time.
+    """
+
+    __tablename__ = "ingestion_jobs"
+    __table_args__ = (Index("uq_ingestion_jobs_active_city", "city_name",
+                            unique=True,
+                            sqlite_where=text(
+                                f"status IN ('{QUEUED}', '{RUNNING}')")),
+                      Index("ix_ingestion_jobs_status_run_after",
+                            "status", "run_after"))
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    city_name: Mapped[str] = Column(String, nullable=False)
+    start_date: Mapped[datetime.date] = Column(Date, nullable=False)
+    end_date: Mapped[datetime.date] = Column(Date, nullable=False)
+    enqueued_at: Mapped[datetime.datetime] = Column(DateTime, nullable=False)
+    run_after: Mapped[datetime.datetime] = Column(DateTime, nullable=False)
+    status: Mapped[str] = Column(String, nullable=False, default=QUEUED)
+    attempts: Mapped[int] = Column(Integer, nullable=False, default=0)
+    started_at: Mapped[datetime.datetime | None] = \
+        Column(DateTime, nullable=True)
+    finished_at: Mapped[datetime.datetime | None] = \
+        Column(DateTime, nullable=True)
+    error: Mapped[str | None] = Column(String, nullable=True)
+
+    @staticmethod
+    def enqueue(city_name: str,
+                start_date: datetime.date,
+                end_date: datetime.date,
+                now: datetime.datetime,
+                db_session: Session) -> bool:
+        """
+        Queues a refresh of the city, unless one is already queued or
+        running. Committing is left to the caller.
+
+        Args:
+            city_name (str): name of the city to be refreshed
+            start_date (date): starting date used for forecast retrieval
+            end_date (date): ending date used for forecast retrieval
+            now (datetime): current UTC time
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            bool (False if the job was deduplicated)
+        """
+        return db_session.execute(
+            insert(IngestionJob.__table__).on_conflict_do_nothing(),
+            {"city_name": city_name, "start_date": start_date,
+             "end_date": end_date, "enqueued_at": now, "run_after": now,
+             "status": QUEUED, "attempts": 0}).rowcount == 1
+
+    @staticmethod
+    def claim(now: datetime.datetime, db_session: Session) -> Row | None:
+        """
+        Marks the queued job which is due first as running, within a single
+        statement, so concurrent workers never claim the same job.
+        Committing is left to the caller.
+
+        Args:
+            now (datetime): current UTC time
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            Row (id, city_name, start_date, end_date, enqueued_at and
+                 attempts of the claimed job) or None if no job is due
+        """
+        table = IngestionJob.__table__
+        next_job = select(table.c.id).where(
+            table.c.status == QUEUED, table.c.run_after <= now
+        ).order_by(table.c.run_after, table.c.id).limit(1).scalar_subquery()
+        return db_session.execute(
+            update(table).where(table.c.id == next_job)
+            .values(status=RUNNING, started_at=now,
+                    attempts=table.c.attempts + 1)
+            .returning(table.c.id, table.c.city_name, table.c.start_date,
+                       table.c.end_date, table.c.enqueued_at,
+                       table.c.attempts)).first()
+
+    @staticmethod
+    def finish(job_id: int,
+               now: datetime.datetime,
+               db_session: Session,
+               error: str | None = None,
+               retry_at: datetime.datetime | None = None) -> None:
+        """
+        Records the outcome of a claimed job: done without an error,
+        queued again at retry_at if set, failed otherwise.
+        Committing is left to the caller.
+
+        Args:
+            job_id (int): id of the claimed job
+            now (datetime): current UTC time
+            db_session (Session): session used for executing the statement
+            error (str): error message of a failed attempt
+            retry_at (datetime): time of the next attempt
+
+        Returns:
+            None
+        """
+        if error is None:
+            values = {"status": DONE, "finished_at": now, "error": None}
+        elif retry_at is not None:
+            values = {"status": QUEUED, "run_after": retry_at,
+                      "error": error}
+        else:
+            values = {"status": FAILED, "finished_at": now, "error": error}
+        db_session.execute(update(IngestionJob.__table__)
+                           .where(IngestionJob.__table__.c.id == job_id)
+                           .values(**values))
+
+    @staticmethod
+    def requeue_running(db_session: Session) -> int:
+        """
+        Queues jobs left running by a stopped process again.
+        Committing is left to the caller.
+
+        Args:
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            int (number of jobs queued again)
+        """
+        return db_session.execute(
+            update(IngestionJob.__table__)
+            .where(IngestionJob.__table__.c.status == RUNNING)
+            .values(status=QUEUED)).rowcount
+
+    @staticmethod
+    def prune(before: datetime.datetime, db_session: Session) -> int:
+        """
+        Deletes the done and failed jobs which finished before the given
+        time. Committing is left to the caller.
+
+        Args:
+            before (datetime): jobs finished earlier are deleted
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            int (number of deleted jobs)
+        """
+        table = IngestionJob.__table__
+        return db_session.execute(
+            delete(table).where(table.c.status.in_((DONE, FAILED)),
+                                table.c.finished_at < before)).rowcount
+
+    @staticmethod
+    def depth(db_session: Session) -> dict[str, int]:
+        """
+        Returns the number of jobs per status.
+
+        Args:
+            db_session (Session): session used for executing the query
+
+        Returns:
+            dict[str, int]
+        """
+        counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED), 0)
+        counts.update(db_session.execute(
+            select(IngestionJob.status, func.count())
+            .group_by(IngestionJob.status)).all())
+        return counts
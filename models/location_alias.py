@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from typing import Iterable
+
+from sqlalchemy import Column, Select, String, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, Session
+
+from database.db import AsyncReadDBSession, Base, run_write_async
+from utils.cache import SingleFlight, normalize_city_name
+
+# Concurrent registrations of the same alias
+alias_registrations = SingleFlight()
+
+
+@dataclass
+class LocationAlias(Base):
+    """
+    LocationAlias class used for ORM purposes. Maps normalized city names
+    to the location key their forecasts are stored under, the grid cell
+    of the geocoded coordinates, so every name within a cell shares the
+    same forecasts. Names without an alias are their own location key.
+    """
+
+    __tablename__ = "location_aliases"
+
+    name: Mapped[str] = Column(String, primary_key=True)
+    location_key: Mapped[str] = Column(String, nullable=False, index=True)
+
+    @staticmethod
+    def register(city_name: str,
+                 location_key: str,
+                 db_session: Session) -> bool:
+        """
+        Points the city name at the location key. Forecasts stored under
+        the name itself before it had an alias are moved to the location,
+        see Forecast.rename and HourlyForecast.rename. Committing is left
+        to the caller.
+
+        Args:
+            city_name (str): name of the city
+            location_key (str): key the city's forecasts are stored under
+            db_session (Session): session used for executing the statements
+
+        Returns:
+            bool (True if the alias was added or changed)
+        """
+        from models.forecast import Forecast
+        from models.hourly_forecast import HourlyForecast
+
+        name = normalize_city_name(city_name)
+        previous = db_session.scalar(select(LocationAlias.location_key)
+                                     .where(LocationAlias.name == name))
+        if previous == location_key:
+            return False
+        stmt = insert(LocationAlias.__table__)
+        db_session.execute(stmt.on_conflict_do_update(
+            index_elements=[LocationAlias.name],
+            set_={"location_key": stmt.excluded.location_key}),
+            {"name": name, "location_key": location_key})
+        if previous is None and city_name != location_key:
+            Forecast.rename(city_name, location_key, db_session)
+            HourlyForecast.rename(city_name, location_key, db_session)
+        return True
+
+    @staticmethod
+    async def register_async(city_name: str, location_key: str) -> bool:
+        """
+        Asynchronous variant of LocationAlias.register, which only opens a
+        write transaction if the alias is missing or points elsewhere.
+        Concurrent registrations of the same alias share one lookup and
+        write, and their result.
+
+        Args:
+            city_name (str): name of the city
+            location_key (str): key the city's forecasts are stored under
+
+        Returns:
+            bool (True if the alias was added or changed)
+        """
+        async def register() -> bool:
+            async with AsyncReadDBSession() as db_session:
+                location_keys = await LocationAlias.resolve_async(
+                    [city_name], db_session)
+            if location_keys[city_name] == location_key:
+                return False
+            return await run_write_async(
+                lambda db_session: LocationAlias.register(
+                    city_name, location_key, db_session))
+
+        return await alias_registrations.do((city_name, location_key),
+                                            register)
+
+    @staticmethod
+    def resolve(city_names: Iterable[str],
+                db_session: Session) -> dict[str, str]:
+        """
+        Returns the location keys of the cities, by city name.
+
+        Args:
+            city_names (Iterable[str]): names of the cities
+            db_session (Session): session used for executing the query
+
+        Returns:
+            dict[str, str]
+        """
+        city_names = list(city_names)
+        return LocationAlias._keys(city_names, db_session.execute(
+            LocationAlias._query(map(normalize_city_name, city_names))))
+
+    @staticmethod
+    async def resolve_async(city_names: Iterable[str],
+                            db_session: AsyncSession) -> dict[str, str]:
+        """
+        Asynchronous variant of LocationAlias.resolve.
+
+        Args:
+            city_names (Iterable[str]): names of the cities
+            db_session (AsyncSession): session used for executing the query
+
+        Returns:
+            dict[str, str]
+        """
+        city_names = list(city_names)
+        return LocationAlias._keys(city_names, await db_session.execute(
+            LocationAlias._query(map(normalize_city_name, city_names))))
+
+    @staticmethod
+    def _query(names: Iterable[str]) -> Select:
+        return select(LocationAlias.name, LocationAlias.location_key) \
+            .where(LocationAlias.name.in_(list(names)))
+
+    @staticmethod
+    def _keys(city_names: list[str], rows) -> dict[str, str]:
+        location_keys = dict(rows.all())
+        return {city_name: location_keys.get(normalize_city_name(city_name),
+                                             city_name)
+                for city_name in city_names}
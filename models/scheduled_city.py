@@ -0,0 +1,97 @@
+import datetime
+from dataclasses import dataclass
+
+from sqlalchemy import Column, DateTime, Integer, Row, String, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Mapped, Session
+
+from database.db import Base
+
+
+@dataclass
+class ScheduledCity(Base):
+    """
+    ScheduledCity class used for ORM purposes. A city whose forecasts
+    the Scheduler refreshes every interval seconds, for the next
+    forecast_days days.
+    """
+
+    __tablename__ = "scheduled_cities"
+
+    city_name: Mapped[str] = Column(String, primary_key=True)
+    interval: Mapped[int] = Column(Integer, nullable=False)
+    forecast_days: Mapped[int] = Column(Integer, nullable=False)
+    next_run_at: Mapped[datetime.datetime] = Column(DateTime, nullable=False,
+                                                    index=True)
+
+    @staticmethod
+    def register(city_name: str,
+                 interval: int,
+                 forecast_days: int,
+                 now: datetime.datetime,
+                 db_session: Session) -> None:
+        """
+        Adds the city to the schedule, or updates its settings.
+        Newly added cities are due immediately.
+        Committing is left to the caller.
+
+        Args:
+            city_name (str): name of the city
+            interval (int): seconds between refreshes
+            forecast_days (int): number of days fetched, starting today
+            now (datetime): current UTC time
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            None
+        """
+        stmt = insert(ScheduledCity.__table__)
+        db_session.execute(stmt.on_conflict_do_update(
+            index_elements=[ScheduledCity.city_name],
+            set_={"interval": stmt.excluded.interval,
+                  "forecast_days": stmt.excluded.forecast_days}),
+            {"city_name": city_name, "interval": interval,
+             "forecast_days": forecast_days, "next_run_at": now})
+
+    @staticmethod
+    def unregister(city_name: str, db_session: Session) -> bool:
+        """
+        Removes the city from the schedule. Committing is left to the caller.
+
+        Args:
+            city_name (str): name of the city
+            db_session (Session): session used for executing the statement
+
+        Returns:
+            bool (False if the city was not scheduled)
+        """
+        return db_session.execute(
+            ScheduledCity.__table__.delete()
+            .where(ScheduledCity.__table__.c.city_name == city_name)
+        ).rowcount == 1
+
+    @staticmethod
+    def due(now: datetime.datetime, db_session: Session) -> list[Row]:
+        """
+        Returns the cities whose next refresh is due.
+
+        Args:
+            now (datetime): current UTC time
+            db_session (Session): session used for executing the query
+
+        Returns:
+            list[Row] (city_name, interval and forecast_days)
+        """
+        return db_session.execute(
+            select(ScheduledCity.city_name, ScheduledCity.interval,
+                   ScheduledCity.forecast_days)
+            .where(ScheduledCity.next_run_at <= now)).all()
+
+    @staticmethod
+    def reschedule(city_name: str,
+                   next_run_at: datetime.datetime,
+                   db_session: Session) -> None:
+        db_session.execute(
+            update(ScheduledCity.__table__)
+            .where(ScheduledCity.__table__.c.city_name == city_name)
+            .values(next_run_at=next_run_at))
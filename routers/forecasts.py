@@ -1,51 +1,317 @@
+import csv
 import datetime
+import io
+import json
+import os
+from typing import Literal
 
+import httpx
+from fastapi import Depends, Query
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
-from starlette.responses import JSONResponse
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
-from utils.utils import generate_open_meteo_config
+from database.db import AsyncReadDBSession
+from models.accuracy import ALL_TIME, ForecastAccuracy, ForecastLeadAccuracy
+from models.data_version import DataVersion
+from models.hourly_forecast import HourlyForecast
+from models.location_alias import LocationAlias
+from utils.utils import (decode_cursor, diff_cache, encode_cursor,
+                         forecast_fetches, generate_open_meteo_config_async)
 from models.forecast import Forecast
 from fastapi import APIRouter
 
-from schemas.forecasts import ForecastDiffResponse
+from schemas.forecasts import (DIFF_FIELDS, ForecastAccuracyResponse,
+                               ForecastDiffResponse,
+                               ForecastLeadAccuracyResponse,
+                               HourlyForecastDiffResponse,
+                               LeadAccuracyStatistics, diff_to_dict,
+                               diffs_to_json, hourly_diffs_to_dicts)
 from utils.utils import ForecastRetrievalException
 
+MAX_PAGE_SIZE = 10000
+MAX_BATCH_CITIES = 100
+# Serializes differences straight from the rows, see diffs_to_json
+FAST_JSON = os.environ.get("WAGA_FAST_JSON", "0") == "1"
+
 forecast_router = APIRouter(
     prefix="/forecasts",
     tags=["forecasts"]
 )
 
 
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """
+    Returns the HTTP client shared through the application lifespan.
+    """
+    return request.app.state.http_client
+
+
+async def resolve_location(city_name: str,
+                           db_session: AsyncSession) -> str:
+    """
+    Returns the location key the city's forecasts are stored under.
+    """
+    return (await LocationAlias.resolve_async([city_name],
+                                              db_session))[city_name]
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    return if_none_match.strip() == "*" or \
+        etag in (tag.strip() for tag in if_none_match.split(","))
+
+
 @forecast_router.get("", name="Forecast vs measurement endpoint",
                      description="Retrieves the differences between the "
                                  "forecasted and measured weather data "
-                                 "for the specified city.")
-def get_forecasts_diff(city_name: str):
-    forecast_pairs = Forecast.get_forecast_diffs(city_name=city_name)
+                                 "for the specified city. Responses carry "
+                                 "an ETag, so unchanged data can be polled "
+                                 "with If-None-Match. When a limit is set, "
+                                 "the cursor of the next page is returned "
+                                 "in the X-Next-Cursor header. Measurements "
+                                 "are compared with the latest forecast, or "
+                                 "with the one made lead_days ahead.")
+async def get_forecasts_diff(city_name: str,
+                             request: Request,
+                             start_date: datetime.date | None = None,
+                             end_date: datetime.date | None = None,
+                             cursor: str | None = None,
+                             limit: int | None = Query(None, ge=1,
+                                                       le=MAX_PAGE_SIZE),
+                             lead_days: int | None = Query(None, ge=1)):
+    try:
+        after = decode_cursor(cursor) if cursor is not None else None
+    except ForecastRetrievalException as e:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content=jsonable_encoder({"detail": e.to_dict()}),
+        )
+
+    async with AsyncReadDBSession() as db_session:
+        location_key = await resolve_location(city_name, db_session)
+        version = await DataVersion.current_async(location_key, db_session)
+
+    etag = f'"{version}"'
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers={"ETag": etag})
+
+    # Entries are invalidated by location, and hold the requested name
+    cache_key = (location_key, city_name, start_date, end_date, after, limit,
+                 lead_days)
+    cached = diff_cache.get(cache_key, version)
+    if cached is None:
+        diffs = await Forecast.get_forecast_diffs_async(
+            city_name=location_key, start_date=start_date, end_date=end_date,
+            after=after, limit=limit, lead_days=lead_days)
+        next_cursor = encode_cursor(diffs[-1][0]) \
+            if limit is not None and len(diffs) == limit else None
+        if FAST_JSON:
+            content = diffs_to_json(city_name, diffs)
+        else:
+            content = JSONResponse(jsonable_encoder(
+                [ForecastDiffResponse(city_name, *diff)
+                 for diff in diffs])).body
+        cached = content, next_cursor
+        diff_cache.set(cache_key, cached, version)
+
+    content, next_cursor = cached
+    headers = {"ETag": etag}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=content,
+                    media_type="application/json",
+                    headers=headers)
+
+
+@forecast_router.get("/batch", name="Multi-city forecast vs measurement "
+                                    "endpoint",
+                     description="Retrieves the differences between the "
+                                 "forecasted and measured weather data of "
+                                 "multiple cities, passed as repeated "
+                                 "city_name parameters, keyed by city. "
+                                 "Cities which cannot be served are "
+                                 "reported with an error entry instead of "
+                                 "failing the whole request.")
+async def get_batch_forecasts_diff(city_name: list[str] =
+                                   Query(..., min_items=1,
+                                         max_items=MAX_BATCH_CITIES),
+                                   start_date: datetime.date | None = None,
+                                   end_date: datetime.date | None = None):
+    if start_date is not None and end_date is not None and \
+            start_date > end_date:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content=jsonable_encoder({"detail": ForecastRetrievalException(
+                ForecastRetrievalException.INVALID_DATE).to_dict()}),
+        )
+
+    city_names = list(dict.fromkeys(city_name))
+    async with AsyncReadDBSession() as db_session:
+        location_keys = await LocationAlias.resolve_async(
+            [name for name in city_names if name.strip()], db_session)
+    diffs = await Forecast.get_batch_diffs_async(
+        list(set(location_keys.values())), start_date, end_date)
+
+    results = {}
+    for name in city_names:
+        if location_keys.get(name) in diffs:
+            results[name] = {"diffs": [
+                diff_to_dict(name, diff)
+                for diff in diffs[location_keys[name]]]}
+            continue
+        error = ForecastRetrievalException.NO_FORECASTS if name.strip() \
+            else ForecastRetrievalException.INVALID_CITY
+        results[name] = {"error": ForecastRetrievalException(error).to_dict()}
+    return JSONResponse(results)
+
+
+@forecast_router.get("/hourly", name="Hourly forecast vs measurement "
+                                     "endpoint",
+                     description="Retrieves the hourly differences between "
+                                 "the forecasted and measured weather data "
+                                 "for the specified city, one list of 24 "
+                                 "values per measure date and field. Only "
+                                 "days fetched with hourly set are "
+                                 "included. Measurements are compared with "
+                                 "the latest forecast, or with the one made "
+                                 "lead_days ahead.",
+                     response_model=list[HourlyForecastDiffResponse])
+async def get_hourly_forecasts_diff(city_name: str,
+                                    start_date: datetime.date | None = None,
+                                    end_date: datetime.date | None = None,
+                                    lead_days: int | None = Query(None,
+                                                                  ge=1)):
+    async with AsyncReadDBSession() as db_session:
+        location_key = await resolve_location(city_name, db_session)
+    measure_dates, diffs = await HourlyForecast.get_hourly_diffs_async(
+        location_key, start_date=start_date, end_date=end_date,
+        lead_days=lead_days)
+    return JSONResponse(hourly_diffs_to_dicts(city_name, measure_dates,
+                                              diffs))
+
+
+@forecast_router.get("/export", name="Forecast vs measurement export endpoint",
+                     description="Streams the differences between the "
+                                 "forecasted and measured weather data "
+                                 "for the specified city as NDJSON or CSV.")
+async def export_forecasts_diff(city_name: str,
+                                start_date: datetime.date | None = None,
+                                end_date: datetime.date | None = None,
+                                export_format: Literal["ndjson", "csv"] =
+                                Query("ndjson", alias="format")):
+    async with AsyncReadDBSession() as db_session:
+        location_key = await resolve_location(city_name, db_session)
+
+    async def ndjson_lines():
+        async for diffs in Forecast.stream_forecast_diffs(
+                location_key, start_date=start_date, end_date=end_date):
+            yield "".join(json.dumps(diff_to_dict(city_name, diff),
+                                     separators=(",", ":")) + "\n"
+                          for diff in diffs)
+
+    async def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(DIFF_FIELDS)
+        async for diffs in Forecast.stream_forecast_diffs(
+                location_key, start_date=start_date, end_date=end_date):
+            writer.writerows((city_name, *diff) for diff in diffs)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    if export_format == "csv":
+        return StreamingResponse(csv_lines(), media_type="text/csv")
+    return StreamingResponse(ndjson_lines(),
+                             media_type="application/x-ndjson")
+
+
+@forecast_router.get("/stats", name="Forecast accuracy endpoint",
+                     description="Returns the mean absolute error, bias and "
+                                 "root mean squared error of the forecasts "
+                                 "made for the specified city, for all time "
+                                 "or for the measurements of one month "
+                                 "(YYYY-MM).",
+                     response_model=ForecastAccuracyResponse)
+async def get_forecast_accuracy(city_name: str,
+                                month: str | None =
+                                Query(None, regex=r"^\d{4}-(0[1-9]|1[0-2])$")):
+    async with AsyncReadDBSession() as db_session:
+        location_key = await resolve_location(city_name, db_session)
+        accuracy = await ForecastAccuracy.get_async(
+            location_key, month or ALL_TIME, db_session)
+    if accuracy is None:
+        accuracy = ForecastAccuracy(city_name, month or ALL_TIME)
+    return ForecastAccuracyResponse(city_name=city_name,
+                                    month=month,
+                                    count=accuracy.count,
+                                    **accuracy.statistics())
+
 
-    return [ForecastDiffResponse(city_name, **fp[0] - fp[1])
-            for fp in forecast_pairs]
+@forecast_router.get("/stats/lead", name="Forecast accuracy by lead time "
+                                         "endpoint",
+                     description="Returns the mean absolute error, bias and "
+                                 "root mean squared error of the forecasts "
+                                 "made for the specified city, per number "
+                                 "of days they were made ahead of the "
+                                 "measure date. Every stored forecast of a "
+                                 "measured date is counted.",
+                     response_model=ForecastLeadAccuracyResponse)
+async def get_forecast_lead_accuracy(city_name: str,
+                                     max_lead_days: int | None =
+                                     Query(None, ge=1)):
+    async with AsyncReadDBSession() as db_session:
+        location_key = await resolve_location(city_name, db_session)
+        accuracies = await ForecastLeadAccuracy.get_all_async(
+            location_key, db_session, max_lead_days)
+    return ForecastLeadAccuracyResponse(
+        city_name=city_name,
+        leads=[LeadAccuracyStatistics(lead_days=accuracy.lead_days,
+                                      count=accuracy.count,
+                                      **accuracy.statistics())
+               for accuracy in accuracies])
 
 
 @forecast_router.post("", name="Fetch new forecast data endpoint",
                       description="Stores new weather forecast data for "
-                                  "the specified city.")
-def get_new_forecast(city_name: str,
-                     start_date: datetime.date,
-                     end_date: datetime.date):
+                                  "the specified city. Days already stored "
+                                  "today are not fetched again, unless "
+                                  "refresh is set. Concurrent requests for "
+                                  "the same dates and grid cell share one "
+                                  "upstream fetch. With hourly set, the "
+                                  "hourly values are stored as well.")
+async def get_new_forecast(city_name: str,
+                           start_date: datetime.date,
+                           end_date: datetime.date,
+                           refresh: bool = False,
+                           hourly: bool = False,
+                           client: httpx.AsyncClient =
+                           Depends(get_http_client)):
 
     try:
-        forecasts = Forecast.get_forecast(city_name,
-                                          generate_open_meteo_config(
-                                              {"city_name": city_name,
-                                               "start_date": start_date,
-                                               "end_date": end_date}))
+        config = await generate_open_meteo_config_async(
+            {"city_name": city_name,
+             "start_date": start_date,
+             "end_date": end_date,
+             "hourly": hourly}, client)
+        location_key = config.location_key
+        await LocationAlias.register_async(city_name, location_key)
+        # Every city within the same grid cell shares the fetch
+        result = await forecast_fetches.do(
+            (location_key, start_date, end_date, refresh, hourly),
+            lambda: Forecast.get_forecast_async(location_key, config, client,
+                                                incremental=not refresh))
     except ForecastRetrievalException as e:
         return JSONResponse(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             content=jsonable_encoder({"detail": e.to_dict()}),
         )
     return JSONResponse(status_code=status.HTTP_201_CREATED,
-                        content=jsonable_encoder({"total_new": len(forecasts)})
-                        )
+                        content=jsonable_encoder(result.to_dict()))
@@ -0,0 +1,83 @@
+import time
+
+from fastapi import APIRouter
+from starlette.requests import Request
+from starlette.responses import Response
+
+from database import db
+from utils.metrics import (CallbackMetric, HTTP_DB_SECONDS, HTTP_SECONDS,
+                           registry, request_db_time)
+from utils.scheduler import queue_depth
+from utils.utils import diff_cache, forecast_fetches, geocode_cache
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics_router = APIRouter(tags=["metrics"])
+
+CallbackMetric(
+    "waga_cache_hits_total", "Cache hits.", "counter",
+    lambda: {("geocode_memory",): geocode_cache.memory.hits,
+             ("geocode_persistent",): geocode_cache.persistent_hits,
+             ("diff",): diff_cache.hits},
+    ("cache",))
+CallbackMetric(
+    "waga_cache_misses_total", "Cache misses.", "counter",
+    lambda: {("geocode",): geocode_cache.upstream_lookups,
+             ("diff",): diff_cache.misses},
+    ("cache",))
+CallbackMetric(
+    "waga_cache_entries", "Entries held in memory.", "gauge",
+    lambda: {("geocode",): len(geocode_cache.memory),
+             ("diff",): len(diff_cache)},
+    ("cache",))
+CallbackMetric(
+    "waga_forecast_fetches_total",
+    "Forecast fetch requests, by whether they joined an identical request "
+    "already in flight.", "counter",
+    lambda: {("false",): forecast_fetches.calls - forecast_fetches.coalesced,
+             ("true",): forecast_fetches.coalesced},
+    ("coalesced",))
+CallbackMetric(
+    "waga_db_group_commits_total",
+    "Commits made by the group commit writer.", "counter",
+    lambda: {(): db.writer.commits} if db.writer is not None else {})
+CallbackMetric(
+    "waga_db_group_commit_jobs_total",
+    "Writes committed by the group commit writer.", "counter",
+    lambda: {(): db.writer.jobs} if db.writer is not None else {})
+CallbackMetric(
+    "waga_ingestion_queue_depth",
+    "Scheduled ingestion jobs per status, as of the last scheduler tick.",
+    "gauge", lambda: {(status,): count
+                      for status, count in queue_depth.items()},
+    ("status",))
+
+
+async def record_request_metrics(request: Request, call_next) -> Response:
+    """
+    HTTP middleware observing the duration of every request and the time
+    its SQL statements took, labelled with the route path template.
+    """
+    db_time = [0.0]
+    token = request_db_time.set(db_time)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_db_time.reset(token)
+    route = request.scope.get("route")
+    # Unmatched paths share one label, to keep the number of series bounded
+    path = route.path if route is not None else "unmatched"
+    HTTP_SECONDS.observe(time.perf_counter() - started,
+                         method=request.method, route=path,
+                         status=response.status_code)
+    HTTP_DB_SECONDS.observe(db_time[0], method=request.method, route=path)
+    return response
+
+
+@metrics_router.get("/metrics", name="Metrics endpoint",
+                    description="Exposes the application metrics in the "
+                                "Prometheus text format.")
+async def get_metrics():
+    return Response(content=registry.render(),
+                    media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,137 @@
+import asyncio
+import cProfile
+import logging
+import random
+import time
+
+from fastapi import APIRouter, Query
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response
+
+from utils import profiling
+
+profiling_router = APIRouter(
+    prefix="/profiles",
+    tags=["profiling"]
+)
+
+
+async def profile_request(request: Request, call_next) -> Response:
+    """
+    HTTP middleware profiling sampled requests and requests carrying the
+    profiling token, keeping the profiles of those slower than the
+    threshold and of all requested ones, see utils.profiling. Since
+    cProfile hooks the event loop's thread, a profile also contains
+    whatever other requests ran in the meantime, and work done in worker
+    threads shows up as waiting.
+    """
+    config = profiling.config
+    # Reading the profiles would otherwise evict them from the ring
+    if request.url.path.startswith(profiling_router.prefix):
+        return await call_next(request)
+    requested = config.authorized(
+        request.headers.get(profiling.PROFILE_HEADER))
+    if not (requested or random.random() < config.sample_rate) \
+            or not profiling.profiler_lock.acquire(blocking=False):
+        return await call_next(request)
+
+    statements = []
+    token = profiling.request_statements.set(statements)
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.disable()
+        profiling.request_statements.reset(token)
+        profiling.profiler_lock.release()
+    duration = time.perf_counter() - started
+    if not requested and duration < config.threshold:
+        return response
+
+    route = request.scope.get("route")
+    info = {"method": request.method,
+            "path": request.url.path,
+            "query": request.url.query,
+            "route": route.path if route is not None else None,
+            "status": response.status_code,
+            "requested": requested,
+            "duration_ms": round(duration * 1000, 3),
+            "sql_ms": round(sum(seconds for _, seconds in statements) * 1000,
+                            3),
+            "sql_count": len(statements),
+            "statements": [{"statement": statement,
+                            "ms": round(seconds * 1000, 3)}
+                           for statement, seconds in statements]}
+    profile_id = await asyncio.to_thread(profiling.store.save, profiler, info)
+    response.headers[profiling.PROFILE_ID_HEADER] = profile_id
+    slowest = sorted(statements, key=lambda item: item[1],
+                     reverse=True)[:profiling.LOGGED_STATEMENTS]
+    logging.getLogger("forecast").warning(
+        "Profiled %s %s in %.1f ms, %d SQL statement(s) in %.1f ms, "
+        "profile %s. Slowest statements:\n%s\n", info["method"],
+        info["path"], info["duration_ms"], info["sql_count"],
+        info["sql_ms"], profile_id,
+        "\n".join(f"{seconds * 1000:9.3f} ms  {statement}"
+                  for statement, seconds in slowest))
+    return response
+
+
+def forbidden(request: Request) -> JSONResponse | None:
+    # Profiles reveal queries and code paths, so the token is required if
+    # one is configured
+    config = profiling.config
+    if config.token is None or config.authorized(
+            request.headers.get(profiling.PROFILE_HEADER)):
+        return None
+    return JSONResponse(status_code=status.HTTP_403_FORBIDDEN,
+                        content={"detail": f"Missing or invalid "
+                                           f"{profiling.PROFILE_HEADER} "
+                                           f"header"})
+
+
+def not_found() -> JSONResponse:
+    return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                        content={"detail": "Profile not found"})
+
+
+@profiling_router.get("", name="Profiles endpoint",
+                      description="Lists the captured request profiles, "
+                                  "newest first.")
+async def list_profiles(request: Request):
+    if (response := forbidden(request)) is not None:
+        return response
+    return await asyncio.to_thread(profiling.store.profiles)
+
+
+@profiling_router.get("/{profile_id}", name="Profile endpoint",
+                      description="Returns the details of the profiled "
+                                  "request, its SQL statements with their "
+                                  "timings and the functions with the "
+                                  "highest cumulative time.")
+async def get_profile(request: Request, profile_id: str,
+                      limit: int = Query(30, ge=1, le=500)):
+    if (response := forbidden(request)) is not None:
+        return response
+    info = await asyncio.to_thread(profiling.store.info, profile_id)
+    stats = await asyncio.to_thread(profiling.store.stats, profile_id, limit)
+    if info is None or stats is None:
+        return not_found()
+    return {**info, "stats": stats}
+
+
+@profiling_router.get("/{profile_id}/download",
+                      name="Profile download endpoint",
+                      description="Downloads the profile as a pstats file, "
+                                  "e.g. for snakeviz or pstats.Stats.",
+                      response_class=Response)
+async def download_profile(request: Request, profile_id: str):
+    if (response := forbidden(request)) is not None:
+        return response
+    path = profiling.store.path(profile_id)
+    if path is None:
+        return not_found()
+    return FileResponse(path, media_type="application/octet-stream",
+                        filename=f"{profile_id}.prof")
@@ -0,0 +1,70 @@
+import datetime
+
+from fastapi import APIRouter, Query
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, select
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from database.db import AsyncReadDBSession, run_write_async
+from models.ingestion_job import IngestionJob
+from models.scheduled_city import ScheduledCity
+from utils.utils import ForecastRetrievalException, OPEN_METEO_MAX_DAYS
+
+scheduler_router = APIRouter(
+    prefix="/scheduler",
+    tags=["scheduler"]
+)
+
+
+@scheduler_router.get("", name="Scheduler status endpoint",
+                      description="Returns whether the background scheduler "
+                                  "is running, the number of scheduled "
+                                  "cities and the number of ingestion jobs "
+                                  "per status.")
+async def get_scheduler_status(request: Request):
+    async with AsyncReadDBSession() as db_session:
+        queue = await db_session.run_sync(IngestionJob.depth)
+        cities = await db_session.scalar(
+            select(func.count()).select_from(ScheduledCity))
+    return {"running": getattr(request.app.state, "scheduler", None)
+            is not None,
+            "scheduled_cities": cities,
+            "queue": queue}
+
+
+@scheduler_router.put("/cities", name="Schedule city endpoint",
+                      description="Adds the city to the cities whose "
+                                  "forecasts are refreshed in the "
+                                  "background, or updates its settings.")
+async def schedule_city(city_name: str,
+                        interval_minutes: int = Query(60, ge=1),
+                        forecast_days: int = Query(7, ge=1,
+                                                   le=OPEN_METEO_MAX_DAYS)):
+    city_name = city_name.strip()
+    if not city_name:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content=jsonable_encoder({"detail": ForecastRetrievalException(
+                ForecastRetrievalException.INVALID_CITY).to_dict()}),
+        )
+    now = datetime.datetime.utcnow()
+    await run_write_async(lambda db_session: ScheduledCity.register(
+        city_name, interval_minutes * 60, forecast_days, now, db_session))
+    return {"city_name": city_name,
+            "interval_minutes": interval_minutes,
+            "forecast_days": forecast_days}
+
+
+@scheduler_router.delete("/cities", name="Unschedule city endpoint",
+                         description="Stops the background refreshes of "
+                                     "the city.",
+                         status_code=status.HTTP_204_NO_CONTENT)
+async def unschedule_city(city_name: str):
+    removed = await run_write_async(
+        lambda db_session: ScheduledCity.unregister(city_name.strip(),
+                                                    db_session))
+    if not removed:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"detail": "City is not scheduled"})
@@ -1,6 +1,22 @@
 import datetime
+import json
+import re
+from typing import Sequence
+
+import numpy as np
 from pydantic.dataclasses import dataclass
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson writes nonzero floats below 1e-4 or from 1e16 in magnitude
+# differently than the json module, either with a differently formatted
+# exponent ("1e16", "1e-7") or without one ("0.00001"), and non-finite
+# ones as null
+_ORJSON_EXPONENT = re.compile(rb"e[\d-]")
+
 
 @dataclass
 class ForecastDiffResponse:
@@ -10,3 +26,142 @@ class ForecastDiffResponse:
     temp_max_diff: float
     precipitation_diff: float
     windspeed_max_diff: float
+
+
+@dataclass
+class HourlyForecastDiffResponse:
+    city_name: str
+    measure_date: datetime.date
+    # One value per hour of the day, None where either side is missing
+    temperature_diff: list[float | None]
+    precipitation_diff: list[float | None]
+    windspeed_diff: list[float | None]
+
+
+@dataclass
+class AccuracyStatistics:
+    mae: float | None
+    bias: float | None
+    rmse: float | None
+
+
+@dataclass
+class ForecastAccuracyResponse:
+    city_name: str
+    month: str | None
+    count: int
+    temp_min: AccuracyStatistics
+    temp_max: AccuracyStatistics
+    precipitation: AccuracyStatistics
+    windspeed_max: AccuracyStatistics
+
+
+@dataclass
+class LeadAccuracyStatistics:
+    lead_days: int
+    count: int
+    temp_min: AccuracyStatistics
+    temp_max: AccuracyStatistics
+    precipitation: AccuracyStatistics
+    windspeed_max: AccuracyStatistics
+
+
+@dataclass
+class ForecastLeadAccuracyResponse:
+    city_name: str
+    leads: list[LeadAccuracyStatistics]
+
+
+DIFF_FIELDS = tuple(ForecastDiffResponse.__dataclass_fields__)
+HOURLY_DIFF_FIELDS = tuple(HourlyForecastDiffResponse.__dataclass_fields__)
+# Hourly values are stored as float32, whose representation error is
+# hidden by rounding the differences
+HOURLY_DECIMALS = 4
+
+
+def diff_to_dict(city_name: str, diff: tuple) -> dict:
+    """
+    Converts a (measure_date, *diffs) database row into the JSON compatible
+    representation of a ForecastDiffResponse, without model validation.
+
+    Args:
+        city_name (str): name of the city the row belongs to
+        diff (tuple): row returned by Forecast.diff_query
+
+    Returns:
+        dict
+    """
+    measure_date, *diffs = diff
+    return dict(zip(DIFF_FIELDS,
+                    (city_name, measure_date.isoformat(), *diffs)))
+
+
+def diffs_to_json(city_name: str, diffs: Sequence[tuple]) -> bytes:
+    """
+    Serializes (measure_date, *diffs) database rows into the same bytes
+    as a JSONResponse of the jsonable_encoder'd ForecastDiffResponse
+    list, without building a model per row. orjson is used if installed,
+    except for rows holding floats it writes differently, which are
+    written by the json module.
+
+    Args:
+        city_name (str): name of the city the rows belong to
+        diffs (Sequence[tuple]): rows returned by Forecast.diff_query
+
+    Returns:
+        bytes
+    """
+    if orjson is None:
+        return dumps([diff_to_dict(city_name, diff) for diff in diffs])
+    rows = [dict(zip(DIFF_FIELDS, (city_name, *diff))) for diff in diffs]
+    try:
+        content = orjson.dumps(rows)
+    except orjson.JSONEncodeError:
+        return dumps([diff_to_dict(city_name, diff) for diff in diffs])
+    # Such floats are rare, so rows are only checked if the output
+    # contains a candidate
+    if _ORJSON_EXPONENT.search(content) is None and \
+            b"0.0000" not in content and b"null" not in content:
+        return content
+
+    parts = []
+    start = 0
+    for i, diff in enumerate(diffs):
+        if any(value != 0 and not 1e-4 <= abs(value) < 1e16
+               for value in diff[1:]):
+            parts.append(orjson.dumps(rows[start:i])[1:-1])
+            parts.append(dumps(diff_to_dict(city_name, diff)))
+            start = i + 1
+    parts.append(orjson.dumps(rows[start:])[1:-1])
+    return b"[" + b",".join(part for part in parts if part) + b"]"
+
+
+def dumps(content) -> bytes:
+    # Same settings as JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def hourly_diffs_to_dicts(city_name: str,
+                          measure_dates: Sequence[datetime.date],
+                          diffs: dict[str, np.ndarray]) -> list[dict]:
+    """
+    Converts the hourly differences returned by HourlyForecast.diffs into
+    the JSON compatible representation of HourlyForecastDiffResponse
+    objects, rounding and replacing NaN with None per column array.
+
+    Args:
+        city_name (str): name of the city the differences belong to
+        measure_dates (Sequence[date]): measure date of every day
+        diffs (dict[str, np.ndarray]): (days, 24) differences by column
+
+    Returns:
+        list[dict]
+    """
+    columns = []
+    for values in diffs.values():
+        values = values.astype(np.float64).round(HOURLY_DECIMALS)
+        columns.append(np.where(np.isnan(values), None, values).tolist())
+    return [dict(zip(HOURLY_DIFF_FIELDS,
+                     (city_name, measure_date.isoformat(), *day)))
+            for measure_date, *day in zip(measure_dates, *columns)]
@@ -1,13 +1,46 @@
+from contextlib import asynccontextmanager
+
+import httpx
 from fastapi import FastAPI
 
-from database.db import configure_database
+from database.db import configure_database, dispose_engines
 from routers.forecasts import forecast_router
+from routers.metrics import metrics_router, record_request_metrics
+from routers.scheduler import scheduler_router
+from utils import profiling
+from utils.metrics import registry
+from utils.scheduler import Scheduler, SchedulerConfig
+from utils.utils import configure_logging
 
-app = FastAPI(title="WagaLabs Assignment")
 
-app.include_router(forecast_router, prefix="/api/v1")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    configure_database()
+    scheduler_config = SchedulerConfig.from_env()
+    app.state.scheduler = Scheduler(scheduler_config) \
+        if scheduler_config.enabled else None
+    if app.state.scheduler is not None:
+        await app.state.scheduler.start()
+    # One pooled client is shared by all requests to the upstream services
+    async with httpx.AsyncClient(timeout=30.0) as http_client:
+        app.state.http_client = http_client
+        yield
+    if app.state.scheduler is not None:
+        await app.state.scheduler.stop()
+    await dispose_engines()
 
 
-@app.on_event("startup")
-def server_startup():
-    configure_database()
+app = FastAPI(title="WagaLabs Assignment", lifespan=lifespan)
+
+app.include_router(forecast_router, prefix="/api/v1")
+app.include_router(scheduler_router, prefix="/api/v1")
+app.include_router(metrics_router)
+if registry.enabled:
+    app.middleware("http")(record_request_metrics)
+if profiling.config.enabled:
+    from routers.profiling import profile_request, profiling_router
+
+    app.include_router(profiling_router)
+    # Added last, so it runs first and its profile covers the metrics too
+    app.middleware("http")(profile_request)
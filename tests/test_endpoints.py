@@ -9,7 +9,8 @@ from start_server import app
 
 @pytest.fixture(scope="module")
 def client():
-    return TestClient(app)
+    with TestClient(app) as client:
+        yield client
 
 
 def test_get_forecast_diffs(client):
@@ -39,6 +40,13 @@ def test_get_forecast_diffs(client):
         assert isinstance(diff["precipitation_diff"], float)
         assert isinstance(diff["windspeed_max_diff"], float)
 
+    etag = response.headers["ETag"]
+    response = client.get(url=base_url,
+                          params=params,
+                          headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
     city_name = "Some place that definitely doesn't exist on planet Earth"
     params = {"city_name": city_name}
     response = client.get(url=base_url,
@@ -49,6 +57,20 @@ def test_get_forecast_diffs(client):
     assert len(response_json) == 0
 
 
+def test_get_forecast_diffs_fast_json(client, monkeypatch):
+    from utils.utils import diff_cache
+
+    bodies = []
+    for fast_json in (False, True):
+        monkeypatch.setattr("routers.forecasts.FAST_JSON", fast_json)
+        diff_cache.invalidate("Novi Sad")
+        response = client.get(url="/api/v1/forecasts",
+                               params={"city_name": "Novi Sad"})
+        assert response.status_code == requests.codes["OK"]
+        bodies.append(response.content)
+    assert bodies[0] != b"[]" and bodies[1] == bodies[0]
+
+
 @pytest.mark.parametrize("params, expected_errs", [
     ({"city_name": None,
       "start_date": "2023-05-01",
@@ -127,3 +149,210 @@ def test_fetch_new_forecasts(client, params):
     assert response.status_code == status.HTTP_201_CREATED
     response_json = response.json()
     assert response_json["total_new"] == 5
+
+
+def test_get_forecast_diffs_pages(client):
+    base_url = "/api/v1/forecasts"
+    params = {"city_name": "Novi Sad"}
+    all_diffs = client.get(url=base_url, params=params).json()
+
+    pages, cursor = [], None
+    while True:
+        response = client.get(url=base_url,
+                              params={**params, "limit": 2,
+                                      **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == requests.codes["OK"]
+        pages += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert pages == all_diffs
+
+    if all_diffs:
+        measure_date = all_diffs[-1]["measure_date"]
+        response = client.get(url=base_url,
+                              params={**params, "start_date": measure_date,
+                                      "end_date": measure_date})
+        assert response.json() == all_diffs[-1:]
+
+    response = client.get(url=base_url, params={**params, "cursor": "???"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.json()["detail"][0]["loc"] == ["query", "cursor"]
+
+
+def test_export_forecast_diffs(client):
+    import json
+
+    params = {"city_name": "Novi Sad"}
+    all_diffs = client.get(url="/api/v1/forecasts", params=params).json()
+
+    response = client.get(url="/api/v1/forecasts/export", params=params)
+    assert response.status_code == requests.codes["OK"]
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == \
+           all_diffs
+
+    response = client.get(url="/api/v1/forecasts/export",
+                          params={**params, "format": "csv"})
+    lines = response.text.splitlines()
+    assert lines[0] == "city_name,measure_date,temp_min_diff,temp_max_diff," \
+                       "precipitation_diff,windspeed_max_diff"
+    assert len(lines) == len(all_diffs) + 1
+
+
+def test_get_metrics(client):
+    client.get(url="/api/v1/forecasts", params={"city_name": "Novi Sad"})
+
+    response = client.get(url="/metrics")
+    assert response.status_code == requests.codes["OK"]
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert "# TYPE waga_http_request_seconds histogram" in lines
+    assert any(line.startswith('waga_http_request_seconds_count{method="GET",'
+                               'route="/api/v1/forecasts",status="200"}')
+               for line in lines)
+    assert any(line.startswith('waga_db_seconds_count{operation="diffs"}')
+               for line in lines)
+    assert any(line.startswith('waga_cache_misses_total{cache="diff"}')
+               for line in lines)
+
+
+def test_get_forecast_accuracy(client):
+    city_name = "Novi Sad"
+    diffs = client.get(url="/api/v1/forecasts",
+                       params={"city_name": city_name}).json()
+
+    response = client.get(url="/api/v1/forecasts/stats",
+                          params={"city_name": city_name})
+    assert response.status_code == requests.codes["OK"]
+    stats = response.json()
+    assert stats["count"] == len(diffs)
+    if diffs:
+        errors = [diff["temp_max_diff"] for diff in diffs]
+        assert stats["temp_max"]["bias"] == \
+               pytest.approx(sum(errors) / len(errors))
+        assert stats["temp_max"]["mae"] == \
+               pytest.approx(sum(map(abs, errors)) / len(errors))
+
+    response = client.get(url="/api/v1/forecasts/stats",
+                          params={"city_name": city_name, "month": "2023-13"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_get_forecast_lead_accuracy(client):
+    city_name = "Novi Sad"
+    response = client.get(url="/api/v1/forecasts/stats/lead",
+                          params={"city_name": city_name})
+    assert response.status_code == requests.codes["OK"]
+    leads = response.json()["leads"]
+    assert [lead["lead_days"] for lead in leads] == \
+           sorted(lead["lead_days"] for lead in leads)
+    assert all(lead["lead_days"] >= 1 and lead["count"] > 0
+               for lead in leads)
+
+    for lead in leads[:1]:
+        diffs = client.get(url="/api/v1/forecasts",
+                           params={"city_name": city_name,
+                                   "lead_days": lead["lead_days"]}).json()
+        assert len(diffs) == lead["count"]
+
+    response = client.get(url="/api/v1/forecasts/stats/lead",
+                          params={"city_name": city_name,
+                                  "max_lead_days": 0})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_get_batch_forecast_diffs(client):
+    city_name = "Novi Sad"
+    diffs = client.get(url="/api/v1/forecasts",
+                       params={"city_name": city_name}).json()
+
+    response = client.get(url="/api/v1/forecasts/batch",
+                          params={"city_name": [city_name, "Atlantis", " "]})
+    assert response.status_code == requests.codes["OK"]
+    results = response.json()
+    assert results[city_name] == {"diffs": diffs}
+    assert results["Atlantis"]["error"][0]["loc"] == ["query", "city_name"]
+    assert results[" "]["error"][0]["msg"] == "invalid city"
+
+    response = client.get(url="/api/v1/forecasts/batch",
+                          params={"city_name": city_name,
+                                  "start_date": "2023-05-02",
+                                  "end_date": "2023-05-01"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_get_hourly_forecast_diffs(client):
+    response = client.get(url="/api/v1/forecasts/hourly",
+                          params={"city_name": "Novi Sad"})
+    assert response.status_code == requests.codes["OK"]
+    for diff in response.json():
+        assert list(diff.keys()) == ["city_name", "measure_date",
+                                     "temperature_diff", "precipitation_diff",
+                                     "windspeed_diff"]
+        assert len(diff["temperature_diff"]) == 24
+
+    response = client.get(url="/api/v1/forecasts/hourly",
+                          params={"city_name": "Novi Sad", "lead_days": 0})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_profile_requests(tmp_path, monkeypatch):
+    import pstats
+    from fastapi import FastAPI
+    from sqlalchemy import create_engine
+    from routers.profiling import profile_request, profiling_router
+    from utils import profiling
+
+    monkeypatch.setattr(profiling, "config", profiling.ProfilingConfig(
+        enabled=True, token="secret", threshold=60.0))
+    monkeypatch.setattr(profiling, "store",
+                        profiling.ProfileStore(str(tmp_path), 2))
+    engine = create_engine("sqlite://")
+    profiling.record_statements(engine)
+
+    app = FastAPI()
+
+    @app.get("/query")
+    async def query():
+        with engine.connect() as connection:
+            connection.exec_driver_sql("SELECT 1")
+        return {}
+
+    app.include_router(profiling_router)
+    app.middleware("http")(profile_request)
+    headers = {profiling.PROFILE_HEADER: "secret"}
+    with TestClient(app) as profiled_client:
+        # Neither requested nor above the threshold
+        response = profiled_client.get("/query")
+        assert profiling.PROFILE_ID_HEADER not in response.headers
+        assert profiled_client.get("/profiles").status_code == \
+               status.HTTP_403_FORBIDDEN
+
+        profile_ids = [profiled_client.get("/query", headers=headers)
+                       .headers[profiling.PROFILE_ID_HEADER]
+                       for _ in range(3)]
+        profiles = profiled_client.get("/profiles", headers=headers).json()
+        # The oldest profile was evicted
+        assert [profile["id"] for profile in profiles] == \
+               profile_ids[:0:-1]
+        assert profiled_client.get(f"/profiles/{profile_ids[0]}",
+                                   headers=headers).status_code == \
+               status.HTTP_404_NOT_FOUND
+
+        profile = profiled_client.get(f"/profiles/{profile_ids[-1]}",
+                                      headers=headers).json()
+        assert profile["route"] == "/query"
+        assert profile["requested"] and profile["status"] == 200
+        assert profile["sql_count"] == 1
+        assert profile["statements"][0]["statement"] == "SELECT 1"
+        assert "function calls" in profile["stats"]
+
+        response = profiled_client.get(
+            f"/profiles/{profile_ids[-1]}/download", headers=headers)
+        assert response.status_code == requests.codes["OK"]
+        (tmp_path / "download.prof").write_bytes(response.content)
+        assert pstats.Stats(str(tmp_path / "download.prof")).total_calls
+        assert profiled_client.get("/profiles/..%2Fwaga/download",
+                                   headers=headers).status_code == \
+               status.HTTP_404_NOT_FOUND
@@ -1,4 +1,5 @@
 import datetime
+import os
 
 import pytest
 import numpy as np
@@ -92,3 +93,798 @@ def test_get_city_lat_long():
 
     with pytest.raises(ForecastRetrievalException):
         get_city_lat_long(city_name="")
+
+
+@pytest.fixture
+def memory_session_factory():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from database.db import Base
+    from models.forecast import Forecast  # noqa: F401
+    from models.geocode import Geocode  # noqa: F401
+    from models.hourly_forecast import HourlyForecast  # noqa: F401
+    from models.ingestion_job import IngestionJob  # noqa: F401
+    from models.location_alias import LocationAlias  # noqa: F401
+
+    engine = create_engine("sqlite://",
+                           connect_args={"check_same_thread": False},
+                           poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autoflush=False, bind=engine)
+
+
+def test_geocode_cache(memory_session_factory):
+    import asyncio
+    from utils.cache import GeocodeCache
+
+    calls = []
+
+    def fetch(city_name):
+        calls.append(city_name)
+        if city_name.startswith("Atlantis"):
+            raise ForecastRetrievalException(
+                ForecastRetrievalException.INVALID_CITY)
+        return 45.25, 19.84
+
+    cache = GeocodeCache(session_factory=memory_session_factory)
+    assert cache.lookup("Novi Sad", fetch) == (45.25, 19.84)
+    assert cache.lookup("  novi   SAD ", fetch) == (45.25, 19.84)
+    assert calls == ["Novi Sad"]
+
+    for _ in range(2):
+        with pytest.raises(ForecastRetrievalException):
+            cache.lookup("Atlantis", fetch)
+    assert calls == ["Novi Sad", "Atlantis"]
+
+    # A fresh process only has the persistent cache available
+    cache = GeocodeCache(session_factory=memory_session_factory)
+    assert cache.lookup("NOVI SAD", fetch) == (45.25, 19.84)
+    assert len(calls) == 2
+    assert cache.stats()["persistent_hits"] == 1
+
+    with pytest.raises(ForecastRetrievalException):
+        cache.lookup(" ", fetch)
+
+    async def fetch_async(city_name):
+        await asyncio.sleep(0.01)
+        return fetch(city_name)
+
+    async def lookup_concurrently(city_name):
+        return await asyncio.gather(
+            *(cache.lookup_async(name, fetch_async)
+              for name in (city_name, city_name.upper(), city_name)),
+            return_exceptions=True)
+
+    # Concurrent lookups of an uncached city make one upstream request
+    cache = GeocodeCache(session_factory=memory_session_factory)
+    assert asyncio.run(lookup_concurrently("Niš")) == [(45.25, 19.84)] * 3
+    assert calls[2:] == ["Niš"]
+    results = asyncio.run(lookup_concurrently("Atlantis II"))
+    assert all(isinstance(result, ForecastRetrievalException)
+               for result in results)
+    assert calls[3:] == ["Atlantis II"]
+
+
+def test_read_city_names():
+    from utils.ingestion import read_city_names
+
+    lines = ["Novi Sad\n", "# nightly list\n", "\n",
+             "  novi  sad \n", "Beograd # capital\n"]
+    assert read_city_names(lines) == ["Novi Sad", "Beograd"]
+
+
+def test_forecast_upsert(memory_session_factory, openmeteo_data):
+    from models.data_version import DataVersion
+    from models.forecast import Forecast
+    from utils.handlers import handle_open_meteo_data
+
+    rows = [forecast.as_row() for forecast in
+            handle_open_meteo_data("Novi Sad", openmeteo_data)]
+    with memory_session_factory() as db_session:
+        result = Forecast.upsert(rows, db_session)
+        assert (result.inserted, result.updated, result.unchanged) == \
+               (len(rows), 0, 0)
+
+        rows[0] = {**rows[0], "temp_min": rows[0]["temp_min"] + 1}
+        result = Forecast.upsert(rows, db_session, batch_size=3)
+        assert (result.inserted, result.updated, result.unchanged) == \
+               (0, 1, len(rows) - 1)
+        assert DataVersion.current("Novi Sad", db_session) == 2
+
+        Forecast.upsert(rows, db_session)
+        assert DataVersion.current("Novi Sad", db_session) == 2
+        db_session.commit()
+
+        stored = db_session.query(Forecast).order_by(Forecast.measure_date)
+        assert stored.count() == len(rows)
+        assert stored.first().temp_min == rows[0]["temp_min"]
+
+
+def test_forecast_diff_query(memory_session_factory):
+    from models.forecast import Forecast
+
+    day = datetime.date(2023, 5, 10)
+    one_day = datetime.timedelta(days=1)
+    rows = [Forecast("Novi Sad", day - 2 * one_day, day, 1, 2, 3, 4),
+            Forecast("Novi Sad", day - one_day, day, 5, 6, 7, 8),
+            Forecast("Novi Sad", day, day, 4, 4, 4, 4),
+            Forecast("Novi Sad", day, day + one_day, 1, 1, 1, 1),
+            Forecast("Beograd", day - one_day, day, 0, 0, 0, 0)]
+    with memory_session_factory() as db_session:
+        Forecast.upsert([row.as_row() for row in rows], db_session)
+        diffs = db_session.execute(Forecast.diff_query("Novi Sad")).all()
+
+    # Only the latest forecast is compared with the measurement
+    assert [tuple(diff) for diff in diffs] == [(day, 1.0, 2.0, 3.0, 4.0)]
+
+
+def test_forecast_accuracy(memory_session_factory):
+    from models.accuracy import ForecastAccuracy
+    from models.forecast import Forecast
+
+    day = datetime.date(2023, 5, 31)
+    one_day = datetime.timedelta(days=1)
+    rows = [Forecast("Novi Sad", day - one_day, day, 1, 2, 3, 4),
+            Forecast("Novi Sad", day, day, 2, 2, 2, 2),
+            Forecast("Novi Sad", day, day + one_day, 5, 5, 5, 5)]
+    with memory_session_factory() as db_session:
+        Forecast.upsert([row.as_row() for row in rows], db_session)
+        # A newer forecast replaces the compared pair, a measurement adds one
+        Forecast.upsert([
+            Forecast("Novi Sad", day - one_day, day, 3, 3, 3, 3).as_row(),
+            Forecast("Novi Sad", day + one_day, day + one_day,
+                     4, 4, 4, 4).as_row()], db_session)
+
+        def statistics(period):
+            return db_session.get(ForecastAccuracy,
+                                  ("Novi Sad", period)).statistics()
+
+        all_time = db_session.get(ForecastAccuracy, ("Novi Sad", ""))
+        assert all_time.count == 2
+        assert all_time.statistics()["temp_min"] == \
+               {"mae": 1.0, "bias": 1.0, "rmse": 1.0}
+        assert statistics("2023-06")["temp_min"] == \
+               {"mae": 1.0, "bias": 1.0, "rmse": 1.0}
+        assert statistics("2023-05")["precipitation"] == \
+               {"mae": 1.0, "bias": 1.0, "rmse": 1.0}
+
+        incremental = [row.statistics() for row in
+                       db_session.query(ForecastAccuracy)
+                       .order_by(ForecastAccuracy.period)]
+        assert ForecastAccuracy.rebuild(db_session) == 1
+        assert [row.statistics() for row in
+                db_session.query(ForecastAccuracy)
+                .order_by(ForecastAccuracy.period)] == incremental
+
+
+def test_forecast_lead_accuracy(memory_session_factory):
+    from models.accuracy import ForecastLeadAccuracy
+    from models.forecast import Forecast
+
+    day = datetime.date(2023, 5, 10)
+    one_day = datetime.timedelta(days=1)
+    rows = [Forecast("Novi Sad", day - 2 * one_day, day, 1, 2, 3, 4),
+            Forecast("Novi Sad", day - one_day, day, 5, 6, 7, 8),
+            Forecast("Novi Sad", day, day, 4, 4, 4, 4)]
+    assert [row.lead_days for row in rows] == [2, 1, 0]
+    with memory_session_factory() as db_session:
+        Forecast.upsert([row.as_row() for row in rows], db_session)
+        diffs = db_session.execute(
+            Forecast.diff_query("Novi Sad", lead_days=2)).all()
+        assert [tuple(diff) for diff in diffs] == \
+               [(day, -3.0, -2.0, -1.0, 0.0)]
+
+        # A new measurement changes the errors of every lead time
+        Forecast.upsert([Forecast("Novi Sad", day + one_day, day,
+                                  3, 3, 3, 3).as_row()], db_session)
+
+        def statistics():
+            return {accuracy.lead_days: (accuracy.count,
+                                         accuracy.statistics()["temp_min"])
+                    for accuracy in db_session.query(ForecastLeadAccuracy)}
+
+        incremental = statistics()
+        assert incremental == {
+            1: (1, {"mae": 2.0, "bias": 2.0, "rmse": 2.0}),
+            2: (1, {"mae": 2.0, "bias": -2.0, "rmse": 2.0})}
+        assert ForecastLeadAccuracy.rebuild(db_session) == 1
+        assert statistics() == incremental
+
+
+def test_location_aliases(memory_session_factory):
+    from models.accuracy import ForecastAccuracy
+    from models.data_version import DataVersion
+    from models.forecast import Forecast
+    from models.location_alias import LocationAlias
+    from utils.utils import grid_cell
+
+    location_key, latitude, longitude = grid_cell(44.787, 20.457, 0.1)
+    assert (location_key, latitude, longitude) == \
+           ("44.7500,20.4500", 44.75, 20.45)
+    assert grid_cell(44.71, 20.41, 0.1)[0] == location_key
+    assert grid_cell(44.81, 20.41, 0.1)[0] != location_key
+    assert grid_cell(-0.05, -0.05, 0.1)[0] == "-0.0500,-0.0500"
+
+    day = datetime.date(2023, 5, 10)
+    one_day = datetime.timedelta(days=1)
+    rows = [Forecast("Belgrade", day - one_day, day, 1, 1, 1, 1),
+            Forecast("Belgrade", day, day, 2, 2, 2, 2),
+            Forecast(location_key, day - one_day, day, 5, 5, 5, 5),
+            Forecast("Beograd", day - one_day, day, 9, 9, 9, 9),
+            Forecast("Beograd", day + one_day, day + one_day, 3, 3, 3, 3)]
+    with memory_session_factory() as db_session:
+        Forecast.upsert([row.as_row() for row in rows], db_session)
+        assert LocationAlias.register("Belgrade", location_key, db_session)
+        assert not LocationAlias.register("belgrade", location_key,
+                                          db_session)
+        assert LocationAlias.register("Beograd", location_key, db_session)
+
+        # Rows stored under the names are moved, the stored ones are kept
+        stored = db_session.query(Forecast.city_name,
+                                  Forecast.temp_min).all()
+        assert sorted(stored) == [(location_key, 2.0), (location_key, 3.0),
+                                  (location_key, 5.0)]
+        assert DataVersion.current("Beograd", db_session) == 2
+        assert db_session.get(ForecastAccuracy,
+                              ("Belgrade", "")).count == 0
+        accuracy = db_session.get(ForecastAccuracy, (location_key, ""))
+        assert (accuracy.count, accuracy.statistics()["temp_min"]["bias"]) \
+               == (1, 3.0)
+
+        assert LocationAlias.resolve(["BELGRADE ", "Beograd", "Novi Sad"],
+                                     db_session) == \
+               {"BELGRADE ": location_key, "Beograd": location_key,
+                "Novi Sad": "Novi Sad"}
+
+
+def test_forecast_compaction(memory_session_factory, monkeypatch):
+    from models.accuracy import ForecastAccuracy, ForecastLeadAccuracy
+    from models.forecast import Forecast
+    from utils.compaction import RetentionPolicy, compact
+
+    monkeypatch.setattr("database.db.ReadDBSession", memory_session_factory)
+    monkeypatch.setattr("database.db.DBSession", memory_session_factory)
+    day = datetime.date(2023, 5, 10)
+    one_day = datetime.timedelta(days=1)
+    rows = [Forecast("Novi Sad", day - 3 * one_day, day, 1, 1, 1, 1),
+            Forecast("Novi Sad", day - 2 * one_day, day, 2, 2, 2, 2),
+            Forecast("Novi Sad", day - one_day, day, 3, 3, 3, 3),
+            Forecast("Novi Sad", day, day, 4, 4, 4, 4),
+            Forecast("Novi Sad", day + one_day, day, 5, 5, 5, 5),
+            Forecast("Novi Sad", day - one_day, day - one_day, 0, 0, 0, 0)]
+    with memory_session_factory() as db_session:
+        Forecast.upsert([row.as_row() for row in rows], db_session)
+        db_session.commit()
+
+    def stored():
+        with memory_session_factory() as db_session:
+            return [(row.request_date, row.measure_date) for row in
+                    db_session.query(Forecast).order_by(Forecast.id)]
+
+    def diffs():
+        with memory_session_factory() as db_session:
+            return db_session.execute(Forecast.diff_query("Novi Sad")).all()
+
+    expected = diffs()
+    # The superseded measurement is removed, all forecasts are kept
+    result = compact(RetentionPolicy(), batch_size=1, pause=0)
+    assert (result.rows_removed, result.batches) == (1, 1)
+    assert (day, day) not in stored() and diffs() == expected
+
+    result = compact(RetentionPolicy(keep_latest=2), batch_size=1, pause=0)
+    assert result.rows_removed == 1 and len(stored()) == 4
+    assert diffs() == expected
+    with memory_session_factory() as db_session:
+        assert sorted(accuracy.lead_days for accuracy in
+                      db_session.query(ForecastLeadAccuracy)
+                      if accuracy.count) == [1, 2]
+        assert db_session.get(ForecastAccuracy,
+                              ("Novi Sad", "")).count == 1
+
+    result = compact(RetentionPolicy(max_age_days=10),
+                     today=day + 11 * one_day)
+    assert result.rows_removed == 4 and stored() == []
+    with memory_session_factory() as db_session:
+        assert db_session.get(ForecastAccuracy,
+                              ("Novi Sad", "")).count == 0
+
+
+@pytest.mark.parametrize("profile", ["default", "concurrent"])
+def test_storage_profile_auto_vacuum(profile, tmp_path, monkeypatch):
+    from sqlalchemy import create_engine, text
+    from database import db
+
+    monkeypatch.setattr(db, "storage_profile", db.STORAGE_PROFILES[profile])
+    engine = create_engine(f"sqlite:///{tmp_path / 'waga.db'}")
+    db.apply_storage_profile(engine)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (x INTEGER)"))
+    with engine.connect() as connection:
+        # 2 is INCREMENTAL, which has to be set before switching to WAL
+        assert connection.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == \
+               ("wal" if profile == "concurrent" else "delete")
+    engine.dispose()
+
+    with pytest.raises(ValueError, match="expected one of: default, "
+                                         "concurrent"):
+        db.get_storage_profile("wal")
+
+
+def test_forecast_archive(memory_session_factory, tmp_path):
+    from models.forecast import Forecast
+    from utils.archive import ForecastArchive
+
+    day = datetime.date(2023, 4, 30)
+    one_day = datetime.timedelta(days=1)
+    rows = [Forecast("Novi Sad", day - one_day, day, 1, 2, 3, 4),
+            Forecast("Novi Sad", day, day, 2, 2, 2, 2),
+            Forecast("Novi Sad", day, day + one_day, 5, 5, 5, 5),
+            Forecast("Beograd", day, day, 0, 0, 0, 0)]
+    archive = ForecastArchive(str(tmp_path))
+    with memory_session_factory() as db_session:
+        Forecast.upsert([row.as_row() for row in rows], db_session)
+        summary = archive.update(db_session, today=day + one_day)
+        assert (summary.cities, summary.partitions, summary.rows,
+                summary.through) == (2, 2, 3, "2023-04")
+
+        columns = archive.partition("Novi Sad", "2023-04")
+        assert isinstance(columns["temp_min"], np.memmap)
+        assert columns["temp_min"].tolist() == [1.0, 2.0]
+        assert columns["lead_days"].tolist() == [1, 0]
+
+        # Only the months ended since the last run are appended
+        Forecast.upsert([Forecast("Novi Sad", day, day - one_day,
+                                  9, 9, 9, 9).as_row()], db_session)
+        summary = archive.update(db_session, today=day + 32 * one_day)
+        assert (summary.partitions, summary.rows) == (1, 1)
+        assert archive.months("Novi Sad") == ["2023-04", "2023-05"]
+        assert len(ForecastArchive(str(tmp_path))
+                   .partition("Novi Sad", "2023-04")["measure_date"]) == 2
+
+        summary = archive.update(db_session, incremental=False,
+                                 today=day + 32 * one_day)
+        assert (summary.partitions, summary.rows) == (3, 5)
+        assert [(city_name, month, len(columns["temp_min"]))
+                for city_name, month, columns in archive.scan(
+                    ["temp_min"], start_month="2023-04",
+                    end_month="2023-04")] == \
+               [("Beograd", "2023-04", 1), ("Novi Sad", "2023-04", 3)]
+
+
+def import_times(*args: str) -> dict[str, tuple[float, bool]]:
+    """
+    Runs python -X importtime in a fresh interpreter and returns the
+    cumulative import time in seconds of every imported module, together
+    with a flag which indicates top level imports.
+    """
+    import subprocess
+    import sys
+
+    stderr = subprocess.run([sys.executable, "-X", "importtime", *args],
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(__file__))
+                            ).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = (int(cumulative) / 1e6,
+                               not name[1:].startswith(" "))
+    return times
+
+
+# Cold start budgets in seconds, a few times the measured import times
+HELP_STARTUP_BUDGET = 0.5
+CLI_STARTUP_BUDGET = 2.5
+
+
+def test_forecast_transfer(memory_session_factory, monkeypatch):
+    import io
+    from models.accuracy import ForecastAccuracy
+    from models.data_version import DataVersion
+    from models.forecast import Forecast
+    from models.location_alias import LocationAlias
+    from utils.transfer import export_forecasts, import_forecasts
+
+    monkeypatch.setattr("database.db.ReadDBSession", memory_session_factory)
+    monkeypatch.setattr("database.db.DBSession", memory_session_factory)
+    day = datetime.date(2023, 5, 10)
+    one_day = datetime.timedelta(days=1)
+    location_key = "44.7500,20.4500"
+    with memory_session_factory() as db_session:
+        LocationAlias.register("Beograd", location_key, db_session)
+        db_session.commit()
+    source = io.StringIO(
+        "lead_days,city_name,request_date,measure_date,temp_min,temp_max,"
+        "precipitation_sum,windspeed_max\n"
+        f"9,Novi Sad,{day - one_day},{day},1.5,2,3,4\n"
+        f"0,Novi Sad,{day},{day},0.1,0.2,0.3,0.4\n"
+        "\n"
+        f"0,Beograd,{day},{day + one_day},1,1,1,1\n")
+    summary = import_forecasts(source, batch_size=2, drop_indexes=True)
+    assert (summary.rows, summary.cities) == (3, 2)
+
+    with memory_session_factory() as db_session:
+        stored = db_session.query(Forecast).order_by(Forecast.id).all()
+        assert [(row.lead_days, row.is_forecast) for row in stored] == \
+               [(1, True), (0, False), (1, True)]
+        # Aliased cities are stored under their location key
+        assert stored[2].city_name == location_key
+        assert db_session.get(ForecastAccuracy, ("Novi Sad", "")).count == 1
+        assert DataVersion.current(location_key, db_session) == 1
+        indexes = db_session.connection().exec_driver_sql(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = 'forecasts'").scalar_one()
+        assert indexes == len(Forecast.__table__.indexes)
+
+    output = io.StringIO()
+    summary = export_forecasts(output, ["Novi Sad"], start_date=day)
+    assert (summary.rows, summary.cities) == (2, 1)
+    exported = output.getvalue()
+    assert exported.splitlines()[1] == \
+           f"Novi Sad,{day - one_day},{day},1.5,2.0,3.0,4.0"
+
+    # Importing the export again leaves the stored values unchanged
+    summary = import_forecasts(io.StringIO(exported))
+    assert summary.rows == 2
+    with memory_session_factory() as db_session:
+        assert db_session.query(Forecast).count() == 3
+
+    with pytest.raises(ValueError, match="line 2"):
+        import_forecasts(io.StringIO(
+            exported.splitlines()[0] + "\nNovi Sad,2023-05-10,x,1,1,1,1\n"))
+    with pytest.raises(ValueError, match="Missing CSV column"):
+        import_forecasts(io.StringIO("city_name\nNovi Sad\n"))
+
+
+def test_cli_startup_time():
+    times = import_times("fetch_forecasts.py", "--help")
+    assert not [name for name in times if name.split(".")[0] in
+                ("sqlalchemy", "requests", "httpx", "numpy")]
+    assert sum(cumulative for cumulative, top_level in times.values()
+               if top_level) < HELP_STARTUP_BUDGET
+
+    times = import_times("-c", "import models.forecast, utils.ingestion")
+    assert "httpx" not in times
+    assert sum(cumulative for cumulative, top_level in times.values()
+               if top_level) < CLI_STARTUP_BUDGET
+
+
+def test_single_flight():
+    import asyncio
+
+    from utils.cache import SingleFlight
+
+    calls = []
+
+    async def fetch():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        if len(calls) > 1:
+            raise ForecastRetrievalException(
+                ForecastRetrievalException.INVALID_CITY)
+        return len(calls)
+
+    async def run():
+        single_flight = SingleFlight()
+        results = await asyncio.gather(
+            *(single_flight.do("Novi Sad", fetch) for _ in range(5)))
+        assert results == [1] * 5
+        assert (single_flight.calls, single_flight.coalesced) == (5, 4)
+        assert len(single_flight) == 0
+
+        # Errors reach every waiter
+        results = await asyncio.gather(
+            *(single_flight.do("Novi Sad", fetch) for _ in range(3)),
+            return_exceptions=True)
+        assert all(isinstance(result, ForecastRetrievalException)
+                   for result in results)
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+def test_token_bucket():
+    from utils.scheduler import TokenBucket, backoff_delay
+
+    now = [0.0]
+    bucket = TokenBucket(rate=2.0, capacity=2, timer=lambda: now[0])
+    assert bucket.try_acquire() == 0 and bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.try_acquire() == 0
+
+    assert all(0 <= backoff_delay(attempt, 30, 3600) <= min(3600, 30 * 2 **
+                                                             (attempt - 1))
+               for attempt in range(1, 10))
+
+
+def test_ingestion_job_queue(memory_session_factory):
+    from models.ingestion_job import IngestionJob
+
+    now = datetime.datetime(2023, 5, 10, 12)
+    day = now.date()
+    with memory_session_factory() as db_session:
+        assert IngestionJob.enqueue("Novi Sad", day, day, now, db_session)
+        # A city is queued only once
+        assert not IngestionJob.enqueue("Novi Sad", day, day, now,
+                                        db_session)
+
+        job = IngestionJob.claim(now, db_session)
+        assert (job.city_name, job.attempts) == ("Novi Sad", 1)
+        assert IngestionJob.claim(now, db_session) is None
+        assert not IngestionJob.enqueue("Novi Sad", day, day, now,
+                                        db_session)
+
+        retry_at = now + datetime.timedelta(minutes=1)
+        IngestionJob.finish(job.id, now, db_session, "Timeout", retry_at)
+        assert IngestionJob.claim(now, db_session) is None
+        job = IngestionJob.claim(retry_at, db_session)
+        assert job.attempts == 2
+
+        IngestionJob.finish(job.id, retry_at, db_session)
+        assert IngestionJob.enqueue("Novi Sad", day, day, now, db_session)
+        assert IngestionJob.depth(db_session) == \
+               {"queued": 1, "running": 0, "done": 1, "failed": 0}
+
+        # Only finished jobs are pruned
+        assert IngestionJob.prune(retry_at, db_session) == 0
+        assert IngestionJob.prune(retry_at + datetime.timedelta(seconds=1),
+                                  db_session) == 1
+        assert IngestionJob.depth(db_session) == \
+               {"queued": 1, "running": 0, "done": 0, "failed": 0}
+
+
+def test_diffs_to_json(monkeypatch):
+    from fastapi.encoders import jsonable_encoder
+    from starlette.responses import JSONResponse
+    from schemas.forecasts import ForecastDiffResponse, diffs_to_json
+
+    day = datetime.date(2023, 5, 10)
+    rng = np.random.default_rng(0)
+    diffs = [(day + datetime.timedelta(days=i), *rng.normal(0, 5, 4).tolist())
+             for i in range(100)]
+    # Floats whose orjson representation differs from the json module's
+    extreme = diffs[:50] + [(day, 1e-05, -1e16, 0.1 + 0.2, -0.0)] + \
+        diffs[50:] + [(day, 0.0, 2e-7, 1.0, 1e300)]
+    for city_name in ("Novi Sad", "Niš \"\u2028\n null"):
+        for rows in (diffs, extreme):
+            expected = JSONResponse(jsonable_encoder(
+                [ForecastDiffResponse(city_name, *diff)
+                 for diff in rows])).body
+            assert diffs_to_json(city_name, rows) == expected
+            with monkeypatch.context() as patch:
+                patch.setattr("schemas.forecasts.orjson", None)
+                assert diffs_to_json(city_name, rows) == expected
+    assert diffs_to_json("Novi Sad", []) == b"[]"
+
+
+def test_versioned_cache():
+    from utils.cache import VersionedCache
+
+    cache = VersionedCache(maxsize=2)
+    cache.set(("Novi Sad",), b"[]", version=1)
+    assert cache.get(("Novi Sad",), version=1) == b"[]"
+    assert cache.get(("Novi Sad",), version=2) is None
+
+    cache.set(("Beograd",), b"[1]", version=1)
+    cache.set(("Beograd", "2023-05"), b"[2]", version=1)
+    assert cache.get(("Novi Sad",), version=1) is None
+
+    cache.invalidate("Beograd")
+    assert len(cache) == 0
+
+
+def test_handle_open_meteo_rows(openmeteo_data):
+    from utils.handlers import handle_open_meteo_data, handle_open_meteo_rows
+
+    city_name = "Novi Sad"
+    rows = handle_open_meteo_rows(city_name, openmeteo_data)
+    forecasts = handle_open_meteo_data(city_name, openmeteo_data)
+    assert rows == [forecast.as_row() for forecast in forecasts]
+    assert not rows[0]["is_forecast"] and rows[1]["is_forecast"]
+
+    missing = {"daily": {**openmeteo_data["daily"],
+                         "precipitation_sum": [None] * len(rows)}}
+    assert all(row["precipitation_sum"] == 0.0
+               for row in handle_open_meteo_rows(city_name, missing))
+
+    for data in bad_openmeteo_data():
+        with pytest.raises((ValueError, TypeError, ForecastRetrievalException)):
+            handle_open_meteo_rows(city_name, data)
+
+
+def test_get_forecast_incremental(memory_session_factory, monkeypatch):
+    import dataclasses
+    from benchmarks.stub_upstream import StubUpstream
+    from models.forecast import Forecast
+    from utils.utils import open_meteo_config
+
+    monkeypatch.setattr("models.forecast.ReadDBSession",
+                        memory_session_factory)
+    monkeypatch.setattr("database.db.DBSession", memory_session_factory)
+    today = datetime.date.today()
+
+    with StubUpstream() as stub:
+        def config(days, max_days=None):
+            return dataclasses.replace(
+                open_meteo_config(45.25, 19.84, {
+                    "start_date": today,
+                    "end_date": today + datetime.timedelta(days=days - 1)}),
+                api_url=stub.forecast_url, max_days=max_days)
+
+        result = Forecast.get_forecast("Novi Sad", config(5))
+        assert (result.inserted, result.stored_days, result.fetched_days) == \
+               (5, 0, 5)
+
+        result = Forecast.get_forecast("Novi Sad", config(10, max_days=2))
+        assert (result.inserted, result.stored_days, result.fetched_days) == \
+               (5, 5, 5)
+        assert stub.requests == 4
+        assert [row["measure_date"] for row in result.rows] == \
+               [today + datetime.timedelta(days=i) for i in range(5, 10)]
+
+        result = Forecast.get_forecast("Novi Sad", config(10))
+        assert (len(result), result.stored_days) == (0, 10)
+        assert stub.requests == 4
+
+
+def test_parallel_chunks(memory_session_factory, monkeypatch):
+    import asyncio
+    import threading
+    import time
+    from models.forecast import MAX_PARALLEL_CHUNKS, Forecast
+    from utils.planning import FetchPlan
+    from utils.utils import ClientConfig
+
+    day = datetime.date(2023, 5, 10)
+    # Every other day is stored, so each missing day is a range of its own
+    plan = FetchPlan([(day + datetime.timedelta(days=i),) * 2
+                      for i in range(0, 200, 2)])
+    monkeypatch.setattr(Forecast, "plan_fetch", lambda *_: plan)
+    monkeypatch.setattr("models.forecast.ReadDBSession",
+                        memory_session_factory)
+    config = ClientConfig("http://upstream", {}, lambda *_: [])
+    lock = threading.Lock()
+    counts = {"active": 0, "max": 0, "requests": 0}
+
+    def enter():
+        with lock:
+            counts["active"] += 1
+            counts["requests"] += 1
+            counts["max"] = max(counts["max"], counts["active"])
+
+    def leave():
+        with lock:
+            counts["active"] -= 1
+
+    class Response:
+        def json(self):
+            return {}
+
+    class Session:
+        def prepare_request(self, request):
+            return request
+
+        def send(self, _):
+            enter()
+            time.sleep(0.001)
+            leave()
+            return Response()
+
+    class Client:
+        async def get(self, *_, **__):
+            enter()
+            await asyncio.sleep(0.001)
+            leave()
+            return Response()
+
+    Forecast.get_forecast("Novi Sad", config, session=Session(),
+                          save_to_db=False)
+    assert counts["requests"] == len(plan.ranges)
+    assert 1 < counts["max"] <= MAX_PARALLEL_CHUNKS
+
+    counts.update(max=0, requests=0)
+    asyncio.run(Forecast.get_forecast_async("Novi Sad", config, Client(),
+                                            save_to_db=False))
+    assert (counts["requests"], counts["max"]) == \
+           (len(plan.ranges), MAX_PARALLEL_CHUNKS)
+
+
+def test_hourly_forecasts(memory_session_factory, monkeypatch):
+    import dataclasses
+    from benchmarks.stub_upstream import StubUpstream
+    from models.forecast import Forecast
+    from models.hourly_forecast import (HOURS, HourlyForecast, pack_hours,
+                                        unpack_hours)
+    from utils.handlers import handle_open_meteo_rows
+    from utils.utils import open_meteo_config
+
+    today = datetime.date.today()
+    days = [today - datetime.timedelta(days=1), today]
+    hours = [f"{day}T{hour:02d}:00" for day in days for hour in range(HOURS)
+             # The first day lacks an hour, e.g. on a DST change
+             if (day, hour) != (days[0], 2)]
+    values = np.arange(len(hours), dtype=float)
+    response = {"daily": {"time": [str(day) for day in days],
+                          "temperature_2m_min": [1, 2],
+                          "temperature_2m_max": [3, 4],
+                          "precipitation_sum": [0, 0],
+                          "windspeed_10m_max": [5, 6]},
+                "hourly": {"time": hours,
+                           "temperature_2m": values.tolist(),
+                           "precipitation": [None] * len(hours),
+                           "windspeed_10m": (values / 2).tolist()}}
+    rows = handle_open_meteo_rows("Novi Sad", response)
+    temperature = unpack_hours([row["hourly"]["temperature"]
+                                for row in rows])
+    assert temperature.shape == (2, HOURS)
+    assert np.isnan(temperature[0, 2]) and temperature[0, 3] == 2
+    assert temperature[1, 0] == HOURS - 1
+    assert np.isnan(unpack_hours([rows[0]["hourly"]["precipitation"]])).all()
+    with pytest.raises(ValueError):
+        pack_hours(values[:HOURS - 1])
+
+    # Measurements of both days, and a forecast of the second one made
+    # the day before, whose temperatures are 1.5 higher
+    forecast = {**rows[1], "request_date": days[0], "is_forecast": True,
+                "lead_days": 1,
+                "hourly": {**rows[1]["hourly"], "temperature": pack_hours(
+                    unpack_hours([rows[1]["hourly"]["temperature"]])[0]
+                    + 1.5)}}
+    with memory_session_factory() as db_session:
+        result = Forecast.upsert(rows + [forecast], db_session)
+        assert (result.inserted, result.hourly_days) == (3, 3)
+        measure_dates, diffs = HourlyForecast.diffs(db_session.execute(
+            HourlyForecast.diff_query("Novi Sad")).all())
+        assert HourlyForecast.diffs([])[1]["windspeed_diff"].shape == \
+               (0, HOURS)
+    assert measure_dates == [today]
+    assert (diffs["temperature_diff"] == 1.5).all()
+    assert (diffs["windspeed_diff"] == 0).all()
+    assert np.isnan(diffs["precipitation_diff"]).all()
+
+    monkeypatch.setattr("models.forecast.ReadDBSession",
+                        memory_session_factory)
+    monkeypatch.setattr("database.db.DBSession", memory_session_factory)
+    with StubUpstream() as stub:
+        def config(hourly):
+            return dataclasses.replace(
+                open_meteo_config(45.25, 19.84, {
+                    "start_date": today,
+                    "end_date": today + datetime.timedelta(days=2),
+                    "hourly": hourly}),
+                api_url=stub.forecast_url)
+
+        result = Forecast.get_forecast("Beograd", config(False))
+        assert (result.fetched_days, result.hourly_days) == (3, 0)
+        # Days stored without their hourly values are fetched again
+        result = Forecast.get_forecast("Beograd", config(True))
+        assert (result.fetched_days, result.hourly_days) == (3, 3)
+        assert "hourly_days" in result.to_dict()
+        result = Forecast.get_forecast("Beograd", config(True))
+        assert (result.stored_days, result.fetched_days) == (3, 0)
+    with memory_session_factory() as db_session:
+        assert db_session.query(HourlyForecast).filter_by(
+            city_name="Beograd").count() == 3
+
+
+def test_compare_benchmark_results():
+    from benchmarks.run import compare, metric
+
+    baseline = {"diffs.p50": metric(10.0, "ms"),
+                "ingest.rows_per_second": metric(1000.0, "rows/s", True),
+                "api.errors": metric(0, "requests")}
+    current = {"diffs.p50": metric(10.5, "ms"),
+               "ingest.rows_per_second": metric(800.0, "rows/s", True),
+               "api.errors": metric(3, "requests"),
+               "parse.rows.cpu": metric(1.0, "ms")}
+
+    regressions = {name: regressed for name, *_, regressed
+                   in compare(current, baseline, threshold=0.1)}
+    assert regressions == {"diffs.p50": False,
+                           "ingest.rows_per_second": True,
+                           "api.errors": True}
@@ -0,0 +1,84 @@
+import argparse
+import datetime
+import sys
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streams the forecasts "
+                                                 "table from and to CSV "
+                                                 "files, e.g. to seed a new "
+                                                 "environment or backfill "
+                                                 "history.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export",
+                                        help="Write the stored forecasts "
+                                             "as CSV.")
+    export_parser.add_argument("output",
+                               nargs="?",
+                               default="-",
+                               type=argparse.FileType("w", encoding="utf-8"),
+                               help="CSV file to write, stdout by default.")
+
+    export_parser.add_argument("-c",
+                               "--city_name",
+                               action="append",
+                               help="Only export this city; may be repeated.")
+
+    export_parser.add_argument("-s",
+                               "--start_date",
+                               type=datetime.date.fromisoformat,
+                               help="First measure date exported, "
+                                    "YYYY-MM-DD.")
+
+    export_parser.add_argument("-e",
+                               "--end_date",
+                               type=datetime.date.fromisoformat,
+                               help="Last measure date exported, "
+                                    "YYYY-MM-DD.")
+
+    import_parser = commands.add_parser("import",
+                                        help="Load forecasts from CSV, "
+                                             "replacing the values of rows "
+                                             "which are already stored.")
+    import_parser.add_argument("source",
+                               type=argparse.FileType("r", encoding="utf-8"),
+                               help="CSV file to read, - for stdin. Needs "
+                                    "a header row with the city_name, "
+                                    "request_date, measure_date, temp_min, "
+                                    "temp_max, precipitation_sum and "
+                                    "windspeed_max columns.")
+
+    import_parser.add_argument("-b",
+                               "--batch_size",
+                               type=int,
+                               default=50000,
+                               help="Number of forecasts written per "
+                                    "database transaction.")
+
+    import_parser.add_argument("--drop_indexes",
+                               action="store_true",
+                               help="Drop the secondary indexes during the "
+                                    "load and rebuild them afterwards, "
+                                    "which is faster for large files.")
+    args = parser.parse_args()
+
+    from database.db import configure_database
+    from utils.transfer import export_forecasts, import_forecasts
+    from utils.utils import configure_logging
+
+    configure_logging()
+    configure_database()
+    if args.command == "export":
+        with args.output:
+            summary = export_forecasts(args.output, args.city_name,
+                                       args.start_date, args.end_date)
+        # Keeps stdout clean when the CSV is written to it
+        print(summary.format("Exported"), file=sys.stderr)
+    else:
+        with args.source:
+            try:
+                summary = import_forecasts(args.source, args.batch_size,
+                                           args.drop_indexes)
+            except ValueError as e:
+                parser.exit(1, f"{e}\n")
+        print(summary.format("Imported"))
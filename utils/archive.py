@@ -0,0 +1,255 @@
+"""
+Columnar on-disk archive of the forecast history, meant for long-horizon
+scans which would be slow through SQLite and the ORM.
+
+The archive is a directory holding one partition per city and measure
+month. Every partition stores each column as a fixed-width NumPy array
+in its own .npy file, so the columns can be memory-mapped and read as
+zero-copy views. A JSON manifest lists the partitions:
+
+    archive/
+        manifest.json
+        Novi Sad/2023-04/measure_date.npy
+        Novi Sad/2023-04/temp_min.npy
+        ...
+"""
+import datetime
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+from urllib.parse import quote
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# Archived columns and their on-disk types, rows sorted by measure date
+# and request date within a partition
+COLUMNS = {"request_date": "datetime64[D]",
+           "measure_date": "datetime64[D]",
+           "lead_days": "int16",
+           "temp_min": "float32",
+           "temp_max": "float32",
+           "precipitation_sum": "float32",
+           "windspeed_max": "float32"}
+
+
+def month_of(day: datetime.date) -> str:
+    return day.strftime("%Y-%m")
+
+
+def partition_dir(city_name: str, month: str) -> str:
+    # Dots are escaped as well, so no city maps to "." or ".."
+    return f"{quote(city_name, safe=' ').replace('.', '%2E')}/{month}"
+
+
+@dataclass
+class ArchiveSummary:
+    cities: int = 0
+    partitions: int = 0
+    rows: int = 0
+    through: str | None = None
+    seconds: float = 0.0
+
+    def format(self) -> str:
+        return (f"Archived {self.rows} forecasts of {self.cities} "
+                f"city(ies) into {self.partitions} partition(s) in "
+                f"{self.seconds:.2f}s. The archive covers measurements "
+                f"up to {self.through or 'no month'}.")
+
+
+@dataclass
+class ForecastArchive:
+    """
+    Reader and writer of a forecast archive directory.
+    """
+    path: str
+    _manifest: dict | None = field(default=None, init=False, repr=False)
+
+    @property
+    def manifest(self) -> dict:
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.path, MANIFEST_NAME),
+                          encoding="utf-8") as manifest_file:
+                    self._manifest = json.load(manifest_file)
+            except FileNotFoundError:
+                self._manifest = {"version": FORMAT_VERSION,
+                                  "columns": COLUMNS,
+                                  "through": None,
+                                  "partitions": {}}
+            if self._manifest["version"] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported archive format version "
+                                 f"{self._manifest['version']}.")
+        return self._manifest
+
+    def cities(self) -> list[str]:
+        return sorted(self.manifest["partitions"])
+
+    def months(self, city_name: str) -> list[str]:
+        return sorted(self.manifest["partitions"].get(city_name, {}))
+
+    def partition(self, city_name: str, month: str,
+                  columns: Iterable[str] | None = None) \
+            -> dict[str, np.ndarray]:
+        """
+        Memory-maps the columns of a partition. The returned arrays are
+        read-only views of the files, so nothing is read until they are
+        accessed.
+
+        Args:
+            city_name (str): name of the city
+            month (str): measure month, YYYY-MM
+            columns (Iterable[str]): optional subset of the columns
+
+        Returns:
+            dict[str, np.ndarray] (arrays by column name)
+        """
+        entry = self.manifest["partitions"][city_name][month]
+        directory = os.path.join(self.path, entry["path"])
+        return {name: np.load(os.path.join(directory, f"{name}.npy"),
+                              mmap_mode="r")
+                for name in (columns or COLUMNS)}
+
+    def scan(self,
+             columns: Iterable[str] | None = None,
+             city_names: Iterable[str] | None = None,
+             start_month: str | None = None,
+             end_month: str | None = None) \
+            -> Iterator[tuple[str, str, dict[str, np.ndarray]]]:
+        """
+        Iterates over the memory-mapped partitions in city and month order,
+        see ForecastArchive.partition.
+
+        Args:
+            columns (Iterable[str]): optional subset of the columns
+            city_names (Iterable[str]): optional subset of the cities
+            start_month (str): optional first month (inclusive), YYYY-MM
+            end_month (str): optional last month (inclusive), YYYY-MM
+
+        Returns:
+            Iterator of (city_name, month, columns) tuples
+        """
+        columns = list(columns or COLUMNS)
+        for city_name in (sorted(city_names) if city_names is not None
+                          else self.cities()):
+            for month in self.months(city_name):
+                if start_month is not None and month < start_month or \
+                        end_month is not None and month > end_month:
+                    continue
+                yield city_name, month, self.partition(city_name, month,
+                                                       columns)
+
+    def update(self,
+               db_session: Session,
+               incremental: bool = True,
+               today: datetime.date | None = None) -> ArchiveSummary:
+        """
+        Archives the forecasts of all months which have ended. In
+        incremental mode only the months after the last archived one are
+        read and written, so earlier partitions stay untouched; otherwise
+        the whole archive is rewritten, which also picks up later changes
+        of archived months. Rows are read with plain SQL, without creating
+        Forecast objects, and the manifest is replaced last, so an
+        interrupted run leaves the previous archive readable.
+
+        Args:
+            db_session (Session): session used for reading the forecasts
+            incremental (bool): flag which indicates if only new months
+                                are archived
+            today (date): current date, defaults to today
+
+        Returns:
+            ArchiveSummary
+        """
+        started = time.perf_counter()
+        today = today or datetime.date.today()
+        # Months are archived once they have ended
+        cutoff = today.replace(day=1)
+        manifest = self.manifest
+        partitions = manifest["partitions"] if incremental else {}
+        through = manifest["through"] if incremental else None
+        first_day = datetime.date.min
+        if through is not None:
+            first_day = (datetime.date.fromisoformat(f"{through}-01")
+                         + datetime.timedelta(days=31)).replace(day=1)
+
+        summary = ArchiveSummary()
+        connection = db_session.connection()
+        city_names = [name for name, in connection.exec_driver_sql(
+            "SELECT DISTINCT city_name FROM forecasts "
+            "WHERE measure_date >= ? AND measure_date < ?",
+            (first_day.isoformat(), cutoff.isoformat()))]
+        for city_name in city_names:
+            rows = connection.exec_driver_sql(
+                f"SELECT {', '.join(COLUMNS)} FROM forecasts "
+                f"WHERE city_name = ? AND measure_date >= ? "
+                f"AND measure_date < ? ORDER BY measure_date, request_date",
+                (city_name, first_day.isoformat(),
+                 cutoff.isoformat())).fetchall()
+            summary.cities += 1
+            for month, arrays in self._partitions(rows):
+                partitions.setdefault(city_name, {})[month] = \
+                    self._write(city_name, month, arrays)
+                summary.partitions += 1
+                summary.rows += len(arrays["measure_date"])
+
+        if cutoff > first_day:
+            through = month_of(cutoff - datetime.timedelta(days=1))
+        if not incremental:
+            self._remove_stale(partitions)
+        self._write_manifest({"version": FORMAT_VERSION,
+                              "columns": COLUMNS,
+                              "through": through,
+                              "partitions": partitions})
+        summary.through = through
+        summary.seconds = time.perf_counter() - started
+        return summary
+
+    @staticmethod
+    def _partitions(rows: list[tuple]) \
+            -> Iterator[tuple[str, dict[str, np.ndarray]]]:
+        if not rows:
+            return
+        arrays = {name: np.array(values, dtype=dtype) for (name, dtype),
+                  values in zip(COLUMNS.items(), zip(*rows))}
+        months = arrays["measure_date"].astype("datetime64[M]")
+        # Rows are sorted by measure date, so every month is one slice
+        starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(months)]):
+            yield (str(months[start]),
+                   {name: values[start:end]
+                    for name, values in arrays.items()})
+
+    def _write(self, city_name: str, month: str,
+               arrays: dict[str, np.ndarray]) -> dict:
+        relative_path = partition_dir(city_name, month)
+        directory = os.path.join(self.path, relative_path)
+        staging = f"{directory}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for name, values in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), values)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(staging, directory)
+        return {"path": relative_path, "rows": len(arrays["measure_date"])}
+
+    def _remove_stale(self, partitions: dict) -> None:
+        for city_name, months in self.manifest["partitions"].items():
+            for month, entry in months.items():
+                if month not in partitions.get(city_name, {}):
+                    shutil.rmtree(os.path.join(self.path, entry["path"]),
+                                  ignore_errors=True)
+
+    def _write_manifest(self, manifest: dict) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        with open(f"{manifest_path}.tmp", "w",
+                  encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+        self._manifest = manifest
@@ -0,0 +1,371 @@
+import asyncio
+import datetime
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from anyio import to_thread
+from sqlalchemy.exc import SQLAlchemyError
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread safe, size bounded LRU cache whose entries expire after
+    a configurable time to live.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0,
+                 timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the cached value for the key, or the default value if the
+        key is missing or its entry has expired.
+
+        Args:
+            key (Hashable): cache key
+            default (Any): value returned on a cache miss
+
+        Returns:
+            Any
+        """
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > self.timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """
+        Stores the value under the key, evicting the least recently used
+        entry if the cache is full.
+
+        Args:
+            key (Hashable): cache key
+            value (Any): value to be cached
+            ttl (float): entry time to live in seconds,
+                         defaults to the cache wide TTL
+
+        Returns:
+            None
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (self.timer() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class VersionedCache(TTLCache):
+    """
+    Size bounded LRU cache of payloads tagged with the data version they
+    were built from. Entries are only returned for a matching version,
+    so they never need to expire on their own.
+    Keys are tuples whose first element is the location key of the city.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__(maxsize=maxsize, ttl=float("inf"))
+
+    def get(self, key: tuple, version: int = 0, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[1][0] != version:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1][1]
+
+    def set(self, key: tuple, value: Any, version: int = 0,
+            ttl: float | None = None) -> None:
+        super().set(key, (version, value), ttl)
+
+    def invalidate(self, city_name: str) -> None:
+        """
+        Drops all entries of a city.
+
+        Args:
+            city_name (str): name of the city whose data changed
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for key in [key for key in self._data if key[0] == city_name]:
+                del self._data[key]
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts
+    the work in its own task, and callers arriving while it runs await
+    the same task, so they all get its result or its exception.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable,
+                 fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the result of fn, or of the call already running under
+        the same key.
+
+        Args:
+            key (Hashable): key of identical calls
+            fn (Callable): coroutine function doing the work
+
+        Returns:
+            Any
+        """
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # A cancelled caller must not cancel the work the others wait for
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+def normalize_city_name(city_name: str) -> str:
+    """
+    Normalizes a city name so that spelling variations in case and
+    whitespace ("novi  sad", "Novi Sad") map to the same cache key.
+
+    Args:
+        city_name (str): raw city name
+
+    Returns:
+        str
+    """
+    return " ".join(unicodedata.normalize("NFKC", city_name)
+                    .split()).casefold()
+
+
+class GeocodeCache:
+    """
+    Two level cache for geocoding lookups: an in-process TTL LRU cache in
+    front of the persistent "geocodes" table. Unknown cities are cached
+    as well, but with a shorter, negative TTL. Concurrent asynchronous
+    lookups of the same uncached city share one persistent cache query and
+    upstream request, see SingleFlight.
+    """
+
+    def __init__(self, maxsize: int = 4096,
+                 ttl: float = 30 * 24 * 3600.0,
+                 negative_ttl: float = 3600.0,
+                 session_factory: Callable | None = None):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._session_factory = session_factory
+        self.persistent_hits = 0
+        self.upstream_lookups = 0
+        self.lookups = SingleFlight()
+        self.logger = logging.getLogger("forecast")
+
+    def lookup(self, city_name: str,
+               fetch_fn: Callable[[str], tuple[float, float]]) \
+            -> tuple[float, float]:
+        """
+        Returns the coordinates of the city, calling fetch_fn only if
+        neither the memory nor the persistent cache contain a valid entry.
+
+        Args:
+            city_name (str): name of the city whose coordinates are needed
+            fetch_fn (Callable): function which retrieves the coordinates
+                                 from the upstream service
+
+        Returns:
+            tuple of floats (city coordinates)
+        """
+        from utils.utils import ForecastRetrievalException
+
+        key = self._key(city_name)
+        coordinates = self.memory.get(key, _MISSING)
+        if coordinates is _MISSING:
+            coordinates = self._load(key)
+        if coordinates is _MISSING:
+            self.upstream_lookups += 1
+            try:
+                coordinates = fetch_fn(city_name)
+            except ForecastRetrievalException as e:
+                self._store_failure(key, e)
+                raise
+            self._store(key, coordinates, self.ttl)
+
+        return self._coordinates(coordinates)
+
+    async def lookup_async(
+            self, city_name: str,
+            fetch_fn: Callable[[str], Awaitable[tuple[float, float]]]) \
+            -> tuple[float, float]:
+        """
+        Asynchronous variant of lookup, which awaits fetch_fn and runs
+        the persistent cache queries in a worker thread. Lookups missing
+        the memory cache are coalesced by normalized city name.
+
+        Args:
+            city_name (str): name of the city whose coordinates are needed
+            fetch_fn (Callable): coroutine function which retrieves the
+                                 coordinates from the upstream service
+
+        Returns:
+            tuple of floats (city coordinates)
+        """
+        key = self._key(city_name)
+        coordinates = self.memory.get(key, _MISSING)
+        if coordinates is _MISSING:
+            coordinates = await self.lookups.do(
+                key, lambda: self._load_or_fetch_async(key, city_name,
+                                                       fetch_fn))
+        return self._coordinates(coordinates)
+
+    async def _load_or_fetch_async(
+            self, key: str, city_name: str,
+            fetch_fn: Callable[[str], Awaitable[tuple[float, float]]]) \
+            -> tuple[float, float] | None:
+        from utils.utils import ForecastRetrievalException
+
+        coordinates = await to_thread.run_sync(self._load, key)
+        if coordinates is _MISSING:
+            self.upstream_lookups += 1
+            try:
+                coordinates = await fetch_fn(city_name)
+            except ForecastRetrievalException as e:
+                await to_thread.run_sync(self._store_failure, key, e)
+                raise
+            await to_thread.run_sync(self._store, key, coordinates, self.ttl)
+        return coordinates
+
+    @staticmethod
+    def _key(city_name: str) -> str:
+        from utils.utils import ForecastRetrievalException
+
+        key = normalize_city_name(city_name)
+        if not key:
+            raise ForecastRetrievalException(
+                ForecastRetrievalException.INVALID_CITY)
+        return key
+
+    @staticmethod
+    def _coordinates(coordinates: tuple[float, float] | None) \
+            -> tuple[float, float]:
+        from utils.utils import ForecastRetrievalException
+
+        if coordinates is None:
+            raise ForecastRetrievalException(
+                ForecastRetrievalException.INVALID_CITY)
+        return coordinates
+
+    def _store_failure(self, key: str, error: Exception) -> None:
+        if error.message == error.INVALID_CITY:
+            self._store(key, None, self.negative_ttl)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the cache hit/miss counters.
+
+        Returns:
+            dict
+        """
+        return {"hits": self.memory.hits + self.persistent_hits,
+                "misses": self.upstream_lookups,
+                "memory_hits": self.memory.hits,
+                "persistent_hits": self.persistent_hits,
+                "size": len(self.memory)}
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.persistent_hits = self.upstream_lookups = 0
+
+    @property
+    def session_factory(self) -> Callable:
+        if self._session_factory is None:
+            from database.db import ReadDBSession
+            return ReadDBSession
+        return self._session_factory
+
+    def _write(self, fn: Callable) -> None:
+        if self._session_factory is None:
+            from database.db import run_write
+            run_write(fn)
+            return
+        with self._session_factory() as db_session:
+            fn(db_session)
+            db_session.commit()
+
+    def _load(self, key: str):
+        from models.geocode import Geocode
+
+        try:
+            with self.session_factory() as db_session:
+                geocode = db_session.get(Geocode, key)
+        except SQLAlchemyError:
+            self.logger.warning("Geocode cache lookup failed.", exc_info=True)
+            return _MISSING
+
+        now = datetime.datetime.utcnow()
+        if geocode is None or geocode.expires_at <= now:
+            return _MISSING
+
+        self.persistent_hits += 1
+        coordinates = geocode.coordinates
+        self.memory.set(key, coordinates,
+                        (geocode.expires_at - now).total_seconds())
+        return coordinates
+
+    def _store(self, key: str, coordinates: tuple[float, float] | None,
+               ttl: float) -> None:
+        from models.geocode import Geocode
+
+        self.memory.set(key, coordinates, ttl)
+        latitude, longitude = coordinates or (None, None)
+        expires_at = datetime.datetime.utcnow() + \
+            datetime.timedelta(seconds=ttl)
+        try:
+            self._write(lambda db_session: db_session.merge(
+                Geocode(key, latitude, longitude, expires_at)))
+        except SQLAlchemyError:
+            self.logger.warning("Geocode cache update failed.", exc_info=True)
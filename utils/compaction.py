@@ -0,0 +1,196 @@
+"""
+Retention and compaction of the forecasts table. Superseded rows are
+deleted in small write transactions, so the API keeps being served in
+between, and the freed pages are released with an incremental vacuum.
+"""
+import datetime
+import math
+import os
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+from utils.metrics import COMPACTED_ROWS, COMPACTION_RECLAIMED_BYTES
+
+# PRAGMA auto_vacuum value of databases which release pages on request
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Rows removed by compaction, on top of measurements replaced by a
+    later measurement of the same date, which are always removed.
+    """
+    # Forecasts kept per city and measure date, newest first; all if None
+    keep_latest: int | None = None
+    # Rows measured more than max_age_days ago are removed; none if None
+    max_age_days: int | None = None
+
+    @staticmethod
+    def from_env() -> "RetentionPolicy":
+        environ = os.environ
+        keep_latest = environ.get("WAGA_RETENTION_KEEP_LATEST")
+        max_age_days = environ.get("WAGA_RETENTION_MAX_AGE_DAYS")
+        return RetentionPolicy(
+            keep_latest=int(keep_latest) if keep_latest else None,
+            max_age_days=int(max_age_days) if max_age_days else None)
+
+    def before(self, today: datetime.date) -> datetime.date | None:
+        if self.max_age_days is None:
+            return None
+        return today - datetime.timedelta(days=self.max_age_days)
+
+
+@dataclass
+class CompactionResult:
+    rows_removed: int = 0
+    batches: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    # Bytes of pages which are free but still part of the file
+    free_bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    def format(self) -> str:
+        return (f"Removed {self.rows_removed} forecasts in {self.batches} "
+                f"batch(es) and reclaimed {self.bytes_reclaimed} bytes "
+                f"({self.bytes_before} -> {self.bytes_after}) in "
+                f"{self.seconds:.2f}s. {self.free_bytes} bytes are free "
+                f"within the database file.")
+
+
+def database_size(db_session: Session) -> tuple[int, int]:
+    """
+    Returns the size of the database and of its free pages in bytes.
+
+    Args:
+        db_session (Session): session used for executing the pragmas
+
+    Returns:
+        tuple[int, int]
+    """
+    connection = db_session.connection()
+    page_size = connection.exec_driver_sql("PRAGMA page_size").scalar_one()
+    return (page_size * connection.exec_driver_sql(
+                "PRAGMA page_count").scalar_one(),
+            page_size * connection.exec_driver_sql(
+                "PRAGMA freelist_count").scalar_one())
+
+
+def incremental_vacuum(db_session: Session, pages: int) -> int:
+    """
+    Releases up to the given number of free pages to the file system.
+    Committing is left to the caller.
+
+    Args:
+        db_session (Session): session used for executing the pragmas
+        pages (int): maximum number of released pages
+
+    Returns:
+        int (number of free pages left)
+    """
+    cursor = db_session.connection().connection.cursor()
+    try:
+        # The pragma releases one page per step, and the sqlite3 module
+        # only steps a statement without result columns once
+        for _ in range(pages):
+            cursor.execute("PRAGMA incremental_vacuum")
+        return cursor.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def compact(policy: RetentionPolicy,
+            batch_size: int = 500,
+            pause: float = 0.01,
+            vacuum_pages: int = 1024,
+            today: datetime.date | None = None) -> CompactionResult:
+    """
+    Deletes the forecasts the retention policy does not keep, batch_size
+    rows per write transaction with a short pause in between, then
+    releases the freed pages if the database uses incremental auto vacuum,
+    vacuum_pages pages at a time, and refreshes the query planner
+    statistics.
+
+    Args:
+        policy (RetentionPolicy): rows to be kept
+        batch_size (int): number of rows deleted per transaction
+        pause (float): seconds waited between transactions
+        vacuum_pages (int): number of pages released per transaction
+        today (date): current date, defaults to today
+
+    Returns:
+        CompactionResult
+    """
+    from database.db import ReadDBSession, run_write
+    from models.forecast import Forecast
+
+    started = time.perf_counter()
+    today = today or datetime.date.today()
+    result = CompactionResult()
+    with ReadDBSession() as db_session:
+        result.bytes_before, _ = database_size(db_session)
+        auto_vacuum = db_session.connection().exec_driver_sql(
+            "PRAGMA auto_vacuum").scalar_one()
+        # Rows only become more superseded over time, so the ids selected
+        # up front stay valid while new forecasts are stored
+        ids = db_session.scalars(Forecast.superseded_query(
+            policy.keep_latest, policy.before(today))).all()
+
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        result.rows_removed += run_write(
+            lambda db_session: Forecast.delete(batch, db_session))
+        result.batches += 1
+        time.sleep(pause)
+
+    if auto_vacuum == AUTO_VACUUM_INCREMENTAL:
+        # Stops once no pages are left, or other writers free pages as
+        # fast as they are released
+        free_pages = math.inf
+        while 0 < (left := run_write(lambda db_session: incremental_vacuum(
+                db_session, vacuum_pages))) < free_pages:
+            free_pages = left
+            time.sleep(pause)
+    run_write(lambda db_session: db_session.connection()
+              .exec_driver_sql("ANALYZE"))
+
+    with ReadDBSession() as db_session:
+        result.bytes_after, result.free_bytes = database_size(db_session)
+    result.seconds = time.perf_counter() - started
+    COMPACTED_ROWS.inc(result.rows_removed)
+    COMPACTION_RECLAIMED_BYTES.inc(max(result.bytes_reclaimed, 0))
+    return result
+
+
+def vacuum(bind: Engine) -> None:
+    """
+    Rebuilds the database file with incremental auto vacuum enabled, which
+    databases created before it was the default need once. Unlike
+    compaction, this locks the database for the whole rebuild.
+
+    Args:
+        bind (Engine): engine bound to the database
+
+    Returns:
+        None
+    """
+    connection = bind.raw_connection()
+    isolation_level = connection.driver_connection.isolation_level
+    try:
+        # VACUUM cannot run within a transaction
+        connection.driver_connection.isolation_level = None
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+        cursor.close()
+    finally:
+        connection.driver_connection.isolation_level = isolation_level
+        connection.close()
@@ -1,8 +1,132 @@
 import datetime
-from datetime import date
+
+import numpy as np
 
 from utils.utils import ForecastRetrievalException, LoggingCtxManager
 
+# open-meteo.com daily fields and the Forecast columns they are stored in
+OPEN_METEO_DAILY_FIELDS = {"temperature_2m_min": "temp_min",
+                           "temperature_2m_max": "temp_max",
+                           "precipitation_sum": "precipitation_sum",
+                           "windspeed_10m_max": "windspeed_max"}
+# open-meteo.com hourly fields and the HourlyForecast columns they are
+# stored in
+OPEN_METEO_HOURLY_FIELDS = {"temperature_2m": "temperature",
+                            "precipitation": "precipitation",
+                            "windspeed_10m": "windspeed"}
+
+
+def parse_open_meteo_daily(response_data: dict) -> dict[str, np.ndarray]:
+    """
+    Parses the daily open-meteo.com data into typed NumPy columns,
+    converting each field in a single pass. Missing values (None or NaN)
+    are replaced with 0.0.
+
+    Args:
+        response_data (dict): dict containing JSON response data
+
+    Returns:
+        dict[str, np.ndarray] (measure_date as datetime64[D] and the
+                               Forecast value columns as float64)
+    """
+    if response_data.get("error"):
+        raise ForecastRetrievalException(response_data["reason"])
+
+    daily = response_data["daily"]
+    with LoggingCtxManager():
+        columns = {"measure_date": np.array(daily["time"],
+                                            dtype="datetime64[D]")}
+        for field, column in OPEN_METEO_DAILY_FIELDS.items():
+            values = np.array(daily[field], dtype=np.float64)
+            values[np.isnan(values)] = 0.0
+            columns[column] = values
+
+        if any(len(values) != len(columns["measure_date"])
+               for values in columns.values()):
+            raise ValueError("Daily data fields differ in length.")
+
+    return columns
+
+
+def parse_open_meteo_hourly(response_data: dict) -> dict[str, np.ndarray]:
+    """
+    Parses the hourly open-meteo.com data into one row of hourly values
+    per day. Unlike the daily values, missing values stay NaN, as do the
+    hours a day lacks, e.g. on daylight saving time changes.
+
+    Args:
+        response_data (dict): dict containing JSON response data
+
+    Returns:
+        dict[str, np.ndarray] (measure_date as datetime64[D] and the
+                               HourlyForecast value columns as float32
+                               arrays of shape (days, 24))
+    """
+    from models.hourly_forecast import HOURLY_DTYPE, HOURS
+
+    if response_data.get("error"):
+        raise ForecastRetrievalException(response_data["reason"])
+
+    hourly = response_data["hourly"]
+    with LoggingCtxManager():
+        times = np.array(hourly["time"], dtype="datetime64[m]")
+        days = times.astype("datetime64[D]")
+        measure_dates, day_index = np.unique(days, return_inverse=True)
+        hours = (times - days).astype("timedelta64[h]").astype(np.int64)
+        columns = {"measure_date": measure_dates}
+        for field, column in OPEN_METEO_HOURLY_FIELDS.items():
+            values = np.array(hourly[field], dtype=np.float64)
+            if len(values) != len(times):
+                raise ValueError("Hourly data fields differ in length.")
+            # Repeated hours keep the last value
+            packed = np.full((len(measure_dates), HOURS), np.nan,
+                             dtype=HOURLY_DTYPE)
+            packed[day_index, hours] = values
+            columns[column] = packed
+
+    return columns
+
+
+def handle_open_meteo_rows(city_name: str,
+                           response_data: dict) -> list[dict]:
+    """
+    Handler function for open-meteo.com data.
+    Converts the received data into forecast rows which can be passed
+    to Forecast.upsert directly, without creating Forecast objects.
+    If the response holds hourly data, the packed hourly values of each
+    day are attached to its row under the "hourly" key.
+
+    Args:
+        city_name (str): name of the city whose forecast data has been received
+        response_data (dict): dict containing JSON response data
+
+    Returns:
+        list[dict]
+    """
+    columns = parse_open_meteo_daily(response_data)
+
+    today = datetime.date.today()
+    lead_days = columns["measure_date"] - np.datetime64(today)
+    columns["is_forecast"] = lead_days > np.timedelta64(0, "D")
+    columns["lead_days"] = lead_days.astype(np.int64)
+    names = list(columns)
+    rows = [{"city_name": city_name, "request_date": today,
+             **dict(zip(names, row))}
+            for row in zip(*(columns[name].tolist() for name in names))]
+
+    if "hourly" in response_data:
+        hourly = parse_open_meteo_hourly(response_data)
+        values = {column: [day.tobytes() for day in hourly[column]]
+                  for column in OPEN_METEO_HOURLY_FIELDS.values()}
+        days = {measure_date: {column: packed[i]
+                               for column, packed in values.items()}
+                for i, measure_date in
+                enumerate(hourly["measure_date"].tolist())}
+        for row in rows:
+            if row["measure_date"] in days:
+                row["hourly"] = days[row["measure_date"]]
+    return rows
+
 
 def handle_open_meteo_data(city_name: str,
                            response_data: dict) -> list["Forecast"]:
@@ -18,26 +142,12 @@ def handle_open_meteo_data(city_name: str,
     Returns:
         list[Forecast]
     """
-    if response_data.get("error"):
-        raise ForecastRetrievalException(response_data["reason"])
-
-    sanitizers = {"time": lambda ts: date.fromisoformat(ts),
-                  "temperature_2m_min":
-                      lambda temp: float(temp) if temp is not None else 0.0,
-                  "temperature_2m_max":
-                      lambda temp: float(temp) if temp is not None else 0.0,
-                  "precipitation_sum":
-                      lambda p_sum: float(p_sum) if p_sum is not None else 0.0,
-                  "windspeed_10m_max":
-                      lambda wind: float(wind) if wind is not None else 0.0}
-
-    with LoggingCtxManager():
-        sanitized_data = [list(map(sanitizers[key], values))
-                          for key, values in response_data["daily"].items()]
+    columns = parse_open_meteo_daily(response_data)
 
     today = datetime.date.today()
 
     forecasts = [Forecast(city_name, today, *data)
-                 for data in zip(*sanitized_data)]
+                 for data in zip(*(values.tolist()
+                                   for values in columns.values()))]
 
-    return forecasts
\ No newline at end of file
+    return forecasts
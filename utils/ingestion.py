@@ -0,0 +1,231 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Iterable, TextIO
+
+from utils.cache import normalize_city_name
+from utils.utils import (ClientConfig, LoggingCtxManager,
+                         create_http_session, generate_open_meteo_config)
+
+
+@dataclass
+class CityResult:
+    city_name: str
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    stored_days: int = 0
+    fetched_days: int = 0
+    seconds: float = 0.0
+    error: str | None = None
+    # City within the same grid cell whose fetch was shared
+    shared_with: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class BatchSummary:
+    results: list[CityResult] = field(default_factory=list)
+    wall_time: float = 0.0
+
+    @property
+    def succeeded(self) -> list[CityResult]:
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self) -> list[CityResult]:
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def total_rows(self) -> int:
+        return sum(result.rows for result in self.succeeded)
+
+    def format(self) -> str:
+        """
+        Formats the per-city outcome of a batch run as a printable report.
+
+        Returns:
+            str
+        """
+        lines = [f"{'OK' if result.ok else 'FAILED':<6} "
+                 f"{result.city_name}: "
+                 + (result.error if not result.ok else
+                    f"shares the forecasts of {result.shared_with}"
+                    if result.shared_with is not None else
+                    f"{result.rows} forecasts ({result.inserted} inserted, "
+                    f"{result.updated} updated, {result.unchanged} unchanged,"
+                    f" {result.stored_days} day(s) from storage,"
+                    f" {result.fetched_days} fetched)"
+                    f" in {result.seconds:.2f}s")
+                 for result in self.results]
+        lines.append(f"{len(self.succeeded)} succeeded, "
+                     f"{len(self.failed)} failed, "
+                     f"{self.total_rows} forecasts stored "
+                     f"in {self.wall_time:.2f}s.")
+        return "\n".join(lines)
+
+
+def error_message(e: Exception) -> str:
+    return getattr(e, "message", None) or str(e) or type(e).__name__
+
+
+def read_city_names(lines: Iterable[str] | TextIO) -> list[str]:
+    """
+    Reads city names, one per line, skipping empty lines, "#" comments
+    and names which only differ in letter case or whitespace.
+
+    Args:
+        lines (Iterable[str]): city list file or any iterable of lines
+
+    Returns:
+        list[str]
+    """
+    city_names = {}
+    for line in lines:
+        city_name = line.split("#", 1)[0].strip()
+        if city_name:
+            city_names.setdefault(normalize_city_name(city_name), city_name)
+    return list(city_names.values())
+
+
+def ingest_cities(city_names: list[str],
+                  start_date: date,
+                  end_date: date,
+                  workers: int = 8,
+                  batch_size: int = 5000,
+                  incremental: bool = True,
+                  hourly: bool = False) -> BatchSummary:
+    """
+    Fetches forecasts for multiple cities concurrently. Geocoding and
+    forecast requests run on a bounded thread pool sharing one pooled
+    HTTP session, while the fetched rows are committed from the calling
+    thread in transactions of at least batch_size rows. All cities are
+    geocoded first, so the forecasts of a grid cell are fetched once,
+    for the first of its cities, and shared by the others through
+    their location aliases.
+
+    Args:
+        city_names (list[str]): names of the cities to be fetched
+        start_date (date): starting date used for forecast retrieval
+        end_date (date): ending date used for forecast retrieval
+        workers (int): maximum number of concurrent fetches
+        batch_size (int): number of rows committed per transaction
+        incremental (bool): flag which indicates if days already stored
+                            today should be skipped
+        hourly (bool): flag which indicates if the hourly values are
+                       fetched and stored as well
+
+    Returns:
+        BatchSummary
+    """
+    from database.db import ReadDBSession, run_write
+    from models.forecast import Forecast
+    from models.location_alias import LocationAlias
+
+    started = time.perf_counter()
+    http_session = create_http_session(pool_size=workers)
+    results = {city_name: CityResult(city_name) for city_name in city_names}
+    configs: dict[str, ClientConfig] = {}
+
+    def locate(city_name: str) -> ClientConfig:
+        return generate_open_meteo_config({"city_name": city_name,
+                                           "start_date": start_date,
+                                           "end_date": end_date,
+                                           "hourly": hourly},
+                                          session=http_session)
+
+    def fetch(city_name: str) -> list[dict]:
+        fetch_started = time.perf_counter()
+        config = configs[city_name]
+        result = Forecast.get_forecast(config.location_key, config,
+                                       save_to_db=False,
+                                       session=http_session,
+                                       incremental=incremental)
+        results[city_name].seconds = time.perf_counter() - fetch_started
+        results[city_name].stored_days = result.stored_days
+        results[city_name].fetched_days = result.fetched_days
+        return result.rows
+
+    pending: dict[str, list[dict]] = {}
+
+    def commit_pending() -> None:
+        if not pending:
+            return
+        try:
+            with LoggingCtxManager():
+                counts = run_write(
+                    lambda db_session: {
+                        city_name: Forecast.upsert(rows, db_session)
+                        for city_name, rows in pending.items()})
+        except Exception as e:
+            for city_name in pending:
+                results[city_name].error = f"Database error: {e}"
+        else:
+            for city_name, rows in pending.items():
+                result = results[city_name]
+                result.rows = len(rows)
+                result.inserted = counts[city_name].inserted
+                result.updated = counts[city_name].updated
+                result.unchanged = counts[city_name].unchanged
+        pending.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(locate, city_name): city_name
+                   for city_name in city_names}
+        for future in as_completed(futures):
+            city_name = futures[future]
+            try:
+                configs[city_name] = future.result()
+            except Exception as e:
+                results[city_name].error = error_message(e)
+
+        # Cities keep their input order, the first one of a cell fetches it
+        fetched_by: dict[str, str] = {}
+        for city_name in city_names:
+            if city_name in configs:
+                location_key = configs[city_name].location_key
+                fetched_by.setdefault(location_key, city_name)
+                if fetched_by[location_key] != city_name:
+                    results[city_name].shared_with = \
+                        fetched_by[location_key]
+        try:
+            with ReadDBSession() as db_session:
+                location_keys = LocationAlias.resolve(configs, db_session)
+            changed = {city_name: config.location_key
+                       for city_name, config in configs.items()
+                       if location_keys[city_name] != config.location_key}
+            if changed:
+                with LoggingCtxManager():
+                    run_write(lambda db_session: [
+                        LocationAlias.register(city_name, location_key,
+                                               db_session)
+                        for city_name, location_key in changed.items()])
+        except Exception as e:
+            for city_name in configs:
+                results[city_name].error = f"Database error: {e}"
+            fetched_by.clear()
+
+        futures = {executor.submit(fetch, city_name): city_name
+                   for city_name in fetched_by.values()}
+        for future in as_completed(futures):
+            city_name = futures[future]
+            try:
+                pending[city_name] = future.result()
+            except Exception as e:
+                results[city_name].error = error_message(e)
+                continue
+            if sum(map(len, pending.values())) >= batch_size:
+                commit_pending()
+        commit_pending()
+
+    for result in results.values():
+        if result.ok and result.shared_with is not None:
+            result.error = results[result.shared_with].error
+    http_session.close()
+    return BatchSummary(results=list(results.values()),
+                        wall_time=time.perf_counter() - started)
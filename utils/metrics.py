@@ -0,0 +1,309 @@
+"""
+Lightweight in-process metrics, rendered in the Prometheus text format by
+the /metrics route. Recording is a no-op when metrics are disabled with
+WAGA_METRICS=0.
+"""
+import asyncio
+import functools
+import math
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+from sqlalchemy import Engine, event
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+LabelValues = tuple[str, ...]
+
+
+class Registry:
+    """
+    Collection of the metrics exposed by the application.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: dict[str, "Metric"] = {}
+
+    def register(self, metric: "Metric") -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(enabled=os.environ.get("WAGA_METRICS", "1") != "0")
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def format_sample(name: str, labels: dict[str, str], value: float) -> str:
+    if labels:
+        name += "{" + ",".join(f'{key}="{escape_label(label)}"'
+                               for key, label in labels.items()) + "}"
+    if math.isinf(value):
+        return f"{name} {'+Inf' if value > 0 else '-Inf'}"
+    return f"{name} {value:g}" if float(value).is_integer() \
+        else f"{name} {value!r}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self._lock = threading.Lock()
+        self.registry.register(self)
+
+    def _key(self, labels: dict) -> LabelValues:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels "
+                             f"{', '.join(self.labelnames)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues) -> dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value, e.g. the number of ingested rows.
+    """
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [format_sample(self.name, self._labels(key), value)
+                for key, value in values]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, e.g. request durations in seconds,
+    counted into cumulative buckets.
+    """
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label values: bucket counts, followed by the sum
+        self._values: dict[LabelValues, list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._values.get(self._key(labels), [0.0])[:-1])
+
+    def time(self, **labels) -> "Timer":
+        """
+        Returns a context manager, also usable as a function decorator,
+        which observes the time spent in its block in seconds.
+
+        Args:
+            labels: label values of the observation
+
+        Returns:
+            Timer
+        """
+        return Timer(self, labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts))
+                      for key, counts in self._values.items()]
+        lines = []
+        for key, counts in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(format_sample(
+                    f"{self.name}_bucket",
+                    {**labels, "le": "+Inf" if math.isinf(bound)
+                     else f"{bound:g}"}, cumulative))
+            lines.append(format_sample(f"{self.name}_sum", labels,
+                                       counts[-1]))
+            lines.append(format_sample(f"{self.name}_count", labels,
+                                       cumulative))
+        return lines
+
+
+class CallbackMetric(Metric):
+    """
+    Metric whose values are read from the callback when rendered, e.g. from
+    the counters kept by the caches. The callback returns a mapping from
+    label values to values.
+    """
+
+    def __init__(self, name: str, documentation: str, type: str,
+                 callback: Callable[[], dict[LabelValues, float]],
+                 labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        return [format_sample(self.name, self._labels(key), value)
+                for key, value in self.callback().items()]
+
+
+class Timer:
+    """
+    Observes the duration of a block or function call into a histogram.
+    """
+    __slots__ = ("histogram", "labels", "_started")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+        self._started = None
+
+    def __enter__(self) -> "Timer":
+        if self.histogram.registry.enabled:
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._started is not None:
+            self.histogram.observe(time.perf_counter() - self._started,
+                                   **self.labels)
+            self._started = None
+
+    def __call__(self, fn: Callable) -> Callable:
+        histogram, labels = self.histogram, self.labels
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with Timer(histogram, labels):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Timer(histogram, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+# Seconds spent executing SQL statements during the current request
+request_db_time: ContextVar[list[float] | None] = \
+    ContextVar("request_db_time", default=None)
+
+
+def instrument_engine(bind: Engine) -> None:
+    """
+    Adds the execution time of the engine's statements to
+    request_db_time, if it is set in the current context.
+
+    Args:
+        bind (Engine): instrumented engine
+
+    Returns:
+        None
+    """
+    if not registry.enabled:
+        return
+
+    @event.listens_for(bind, "before_cursor_execute")
+    def before_cursor_execute(connection, *_):
+        connection.info.setdefault("query_started", []).append(
+            time.perf_counter())
+
+    @event.listens_for(bind, "after_cursor_execute")
+    def after_cursor_execute(connection, *_):
+        elapsed = time.perf_counter() - connection.info["query_started"].pop()
+        db_time = request_db_time.get()
+        if db_time is not None:
+            db_time[0] += elapsed
+
+
+UPSTREAM_SECONDS = Histogram(
+    "waga_upstream_request_seconds",
+    "Duration of requests to the upstream services.", ("service",))
+PARSE_SECONDS = Histogram(
+    "waga_parse_seconds",
+    "Time spent converting upstream responses into forecast rows.")
+DB_SECONDS = Histogram(
+    "waga_db_seconds",
+    "Duration of database operations.", ("operation",))
+ROWS_INGESTED = Counter(
+    "waga_forecast_rows_total",
+    "Forecast rows written by upserts, by outcome.", ("outcome",))
+HTTP_SECONDS = Histogram(
+    "waga_http_request_seconds",
+    "Duration of HTTP requests.", ("method", "route", "status"))
+HTTP_DB_SECONDS = Histogram(
+    "waga_http_db_seconds",
+    "Time spent executing SQL statements per HTTP request.",
+    ("method", "route"))
+JOB_SECONDS = Histogram(
+    "waga_ingestion_job_seconds",
+    "Duration of scheduled ingestion jobs, by outcome.", ("outcome",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+JOB_WAIT_SECONDS = Histogram(
+    "waga_ingestion_job_wait_seconds",
+    "Time scheduled ingestion jobs spent queued before they started.",
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0))
+COMPACTED_ROWS = Counter(
+    "waga_compacted_rows_total",
+    "Forecast rows removed by compaction.")
+COMPACTION_RECLAIMED_BYTES = Counter(
+    "waga_compaction_reclaimed_bytes_total",
+    "Bytes returned to the file system by compaction.")
@@ -0,0 +1,80 @@
+import datetime
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from utils.utils import ForecastRetrievalException
+
+DateRange = tuple[datetime.date, datetime.date]
+
+
+@dataclass
+class FetchPlan:
+    """
+    Date ranges which have to be fetched from the upstream service,
+    and the number of requested days already found in storage.
+    """
+    ranges: list[DateRange] = field(default_factory=list)
+    stored_days: int = 0
+
+    @property
+    def fetched_days(self) -> int:
+        return sum((end - start).days + 1 for start, end in self.ranges)
+
+
+def as_date(value: datetime.date | str) -> datetime.date:
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(value)
+
+
+def plan_fetch(start_date: datetime.date,
+               end_date: datetime.date,
+               stored_dates: Iterable[datetime.date] = (),
+               max_days: int | None = None) -> FetchPlan:
+    """
+    Coalesces the days between start_date and end_date which are not
+    stored yet into the fewest contiguous ranges, and splits ranges longer
+    than max_days into chunks the upstream service accepts.
+
+    Args:
+        start_date (date): first requested day
+        end_date (date): last requested day
+        stored_dates (Iterable[date]): days which are already stored
+        max_days (int): optional maximum length of a fetched range
+
+    Returns:
+        FetchPlan
+    """
+    if start_date > end_date:
+        raise ForecastRetrievalException(
+            ForecastRetrievalException.INVALID_DATE)
+
+    stored = {day for day in stored_dates if start_date <= day <= end_date}
+    plan = FetchPlan(stored_days=len(stored))
+    one_day = datetime.timedelta(days=1)
+
+    range_start = None
+    day = start_date
+    while day <= end_date + one_day:
+        missing = day <= end_date and day not in stored
+        if missing and range_start is None:
+            range_start = day
+        elif not missing and range_start is not None:
+            plan.ranges.extend(split_range(range_start, day - one_day,
+                                           max_days))
+            range_start = None
+        day += one_day
+
+    return plan
+
+
+def split_range(start_date: datetime.date,
+                end_date: datetime.date,
+                max_days: int | None) -> list[DateRange]:
+    ranges = []
+    while start_date <= end_date:
+        chunk_end = end_date if max_days is None else \
+            min(end_date, start_date + datetime.timedelta(days=max_days - 1))
+        ranges.append((start_date, chunk_end))
+        start_date = chunk_end + datetime.timedelta(days=1)
+    return ranges
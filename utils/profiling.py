@@ -0,0 +1,229 @@
+"""
+Opt-in profiling of HTTP requests, enabled with WAGA_PROFILING=1. A random
+sample of the requests, and the requests sending the profiling token in
+the X-Waga-Profile header, run under cProfile with their SQL statements
+and timings recorded, see routers.profiling. Profiles of requests slower
+than the threshold, and of all requests asking for one, are kept in a
+bounded ring of pstats files on disk.
+"""
+import datetime
+import hmac
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from sqlalchemy import Engine, event
+
+if TYPE_CHECKING:
+    import cProfile
+
+PROFILE_HEADER = "X-Waga-Profile"
+PROFILE_ID_HEADER = "X-Waga-Profile-Id"
+# Statements recorded per request, and characters kept of each
+MAX_STATEMENTS = 200
+MAX_STATEMENT_LENGTH = 1000
+# Statements included in the log entry of a kept profile, slowest first
+LOGGED_STATEMENTS = 20
+
+PROFILE_ID = re.compile(r"\d{8}T\d{12}-[0-9a-f]{8}")
+
+
+@dataclass
+class ProfilingConfig:
+    enabled: bool = False
+    # Fraction of the requests profiled at random
+    sample_rate: float = 0.0
+    # Requests sending it in PROFILE_HEADER are profiled and always kept,
+    # and the /profiles routes require it; profiling on demand is off if None
+    token: str | None = None
+    # Seconds; profiled requests which took less are discarded
+    threshold: float = 0.5
+    directory: str = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", "profiles"))
+    max_profiles: int = 50
+
+    @staticmethod
+    def from_env() -> "ProfilingConfig":
+        environ = os.environ
+        return ProfilingConfig(
+            enabled=environ.get("WAGA_PROFILING", "0") == "1",
+            sample_rate=float(environ.get("WAGA_PROFILING_SAMPLE_RATE", 0.0)),
+            token=environ.get("WAGA_PROFILING_TOKEN") or None,
+            threshold=float(environ.get("WAGA_PROFILING_THRESHOLD_MS",
+                                        500)) / 1000,
+            directory=environ.get("WAGA_PROFILING_DIR",
+                                  ProfilingConfig.directory),
+            max_profiles=int(environ.get("WAGA_PROFILING_MAX_FILES", 50)))
+
+    def authorized(self, header: str | None) -> bool:
+        """
+        Returns whether the PROFILE_HEADER value is the profiling token.
+        """
+        if self.token is None or header is None:
+            return False
+        return hmac.compare_digest(header.encode(), self.token.encode())
+
+
+class ProfileStore:
+    """
+    Ring of captured profiles in a directory. Every profile consists of
+    a pstats file and a JSON file with the request details and its SQL
+    statements; once more than max_profiles are stored, the oldest ones
+    are removed.
+    """
+
+    def __init__(self, directory: str, max_profiles: int):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, profiler: "cProfile.Profile", info: dict) -> str:
+        """
+        Stores the profile and its details, evicting the oldest profiles
+        beyond max_profiles.
+
+        Args:
+            profiler (Profile): finished profiler
+            info (dict): details of the profiled request
+
+        Returns:
+            str (id of the profile)
+        """
+        now = datetime.datetime.utcnow()
+        # Ids sort in the order the profiles were captured
+        profile_id = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.directory, exist_ok=True)
+        profiler.dump_stats(self._path(profile_id, "prof"))
+        # Written last, so only complete profiles are listed
+        with open(self._path(profile_id, "json"), "w",
+                  encoding="utf-8") as file:
+            json.dump({"id": profile_id, "created": now.isoformat(), **info},
+                      file)
+        with self._lock:
+            ids = self._ids()
+            for stale in ids[:max(len(ids) - self.max_profiles, 0)]:
+                for extension in ("json", "prof"):
+                    try:
+                        os.remove(self._path(stale, extension))
+                    except FileNotFoundError:
+                        pass
+        return profile_id
+
+    def profiles(self) -> list[dict]:
+        """
+        Returns the details of the stored profiles without their SQL
+        statements, newest first.
+
+        Returns:
+            list[dict]
+        """
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            info = self.info(profile_id)
+            if info is not None:
+                info.pop("statements", None)
+                profiles.append(info)
+        return profiles
+
+    def info(self, profile_id: str) -> dict | None:
+        path = self.path(profile_id, "json")
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            # Evicted in the meantime
+            return None
+
+    def stats(self, profile_id: str, limit: int = 30) -> str | None:
+        """
+        Returns the functions of the profile with the highest cumulative
+        time as pstats text.
+
+        Args:
+            profile_id (str): id of the profile
+            limit (int): number of listed functions
+
+        Returns:
+            str | None (None if there is no such profile)
+        """
+        import pstats
+
+        path = self.path(profile_id, "prof")
+        if path is None:
+            return None
+        output = io.StringIO()
+        pstats.Stats(path, stream=output).sort_stats(
+            pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return output.getvalue()
+
+    def path(self, profile_id: str, extension: str = "prof") -> str | None:
+        """
+        Returns the path of the profile's file, or None if there is no such
+        profile. Ids are validated, so they cannot point outside the
+        directory.
+        """
+        if not PROFILE_ID.fullmatch(profile_id):
+            return None
+        path = self._path(profile_id, extension)
+        return path if os.path.isfile(path) else None
+
+    def _path(self, profile_id: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def _ids(self) -> list[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(".json")] for name in names
+                      if name.endswith(".json")
+                      and PROFILE_ID.fullmatch(name[:-len(".json")]))
+
+
+config = ProfilingConfig.from_env()
+store = ProfileStore(config.directory, config.max_profiles)
+
+# SQL statements executed during the current profiled request, as
+# [statement, seconds] pairs
+request_statements: ContextVar[list[list] | None] = \
+    ContextVar("request_statements", default=None)
+
+# cProfile hooks the whole thread, so one request is profiled at a time
+profiler_lock = threading.Lock()
+
+
+def record_statements(bind: Engine) -> None:
+    """
+    Appends the statements executed by the engine and their duration to
+    request_statements, if it is set in the current context.
+
+    Args:
+        bind (Engine): instrumented engine
+
+    Returns:
+        None
+    """
+    if not config.enabled:
+        return
+
+    @event.listens_for(bind, "before_cursor_execute")
+    def before_cursor_execute(connection, *_):
+        connection.info.setdefault("statement_started", []).append(
+            time.perf_counter())
+
+    @event.listens_for(bind, "after_cursor_execute")
+    def after_cursor_execute(connection, _, statement, *__):
+        elapsed = time.perf_counter() - \
+            connection.info["statement_started"].pop()
+        statements = request_statements.get()
+        if statements is not None and len(statements) < MAX_STATEMENTS:
+            statements.append([statement[:MAX_STATEMENT_LENGTH], elapsed])
@@ -0,0 +1,294 @@
+"""
+Background refresh of the scheduled cities' forecasts, run within the
+application lifespan when WAGA_SCHEDULER=1.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+import httpx
+
+from utils.metrics import JOB_SECONDS, JOB_WAIT_SECONDS
+from utils.utils import (ForecastRetrievalException, forecast_fetches,
+                         generate_open_meteo_config_async)
+
+# Job counts per status, as of the last scheduler tick
+queue_depth: dict[str, int] = {}
+
+
+class TokenBucket:
+    """
+    Rate limiter which allows bursts of up to capacity requests and
+    rate requests per second on average.
+    """
+
+    def __init__(self, rate: float, capacity: float,
+                 timer: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.timer = timer
+        self.tokens = capacity
+        self.updated = timer()
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Takes the tokens if available.
+
+        Args:
+            tokens (float): number of tokens needed
+
+        Returns:
+            float (0 if the tokens were taken, otherwise the number of
+                   seconds until they are available)
+        """
+        now = self.timer()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        while (delay := self.try_acquire(tokens)) > 0:
+            await asyncio.sleep(delay)
+
+
+def backoff_delay(attempt: int, base: float, cap: float,
+                  rng: random.Random = random) -> float:
+    """
+    Returns the delay before the next attempt, drawn uniformly between 0
+    and the exponentially growing backoff ("full jitter"), so failed jobs
+    do not retry in lockstep.
+
+    Args:
+        attempt (int): number of attempts made so far
+        base (float): backoff after the first attempt, in seconds
+        cap (float): maximum backoff, in seconds
+        rng (random.Random): random number generator
+
+    Returns:
+        float (seconds)
+    """
+    return rng.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+@dataclass
+class SchedulerConfig:
+    enabled: bool = False
+    # Upstream requests per second, and the allowed burst
+    rate: float = 2.0
+    burst: int = 5
+    workers: int = 4
+    tick_interval: float = 5.0
+    max_attempts: int = 5
+    backoff_base: float = 30.0
+    backoff_cap: float = 3600.0
+    # Fraction of the interval randomly added to every reschedule
+    jitter: float = 0.1
+    # Seconds between compactions of the forecasts table, 0 disables them
+    compaction_interval: float = 0.0
+    # Seconds finished jobs are kept before being deleted
+    job_retention: float = 7 * 24 * 3600.0
+
+    @staticmethod
+    def from_env() -> "SchedulerConfig":
+        environ = os.environ
+        return SchedulerConfig(
+            enabled=environ.get("WAGA_SCHEDULER", "0") == "1",
+            rate=float(environ.get("WAGA_SCHEDULER_RATE", 2.0)),
+            burst=int(environ.get("WAGA_SCHEDULER_BURST", 5)),
+            workers=int(environ.get("WAGA_SCHEDULER_WORKERS", 4)),
+            compaction_interval=3600 * float(
+                environ.get("WAGA_COMPACTION_INTERVAL_HOURS", 0)),
+            job_retention=3600 * float(
+                environ.get("WAGA_SCHEDULER_JOB_RETENTION_HOURS", 7 * 24)))
+
+
+@dataclass
+class Scheduler:
+    """
+    Enqueues a refresh job whenever a scheduled city is due, and runs the
+    queued jobs with a pool of worker tasks. Jobs are persisted in the
+    ingestion_jobs table, so they survive restarts. All upstream requests
+    made by the workers pass through one token bucket, and failed jobs are
+    retried with jittered exponential backoff. Optionally, the forecasts
+    table is compacted periodically, see utils.compaction.
+    """
+    config: SchedulerConfig = field(default_factory=SchedulerConfig)
+    rng: random.Random = field(default_factory=random.Random)
+
+    def __post_init__(self):
+        self.limiter = TokenBucket(self.config.rate, self.config.burst)
+        self.logger = logging.getLogger("forecast")
+        self._client: httpx.AsyncClient | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        from database.db import run_write_async
+        from models.ingestion_job import IngestionJob
+
+        await run_write_async(IngestionJob.requeue_running)
+        self._client = httpx.AsyncClient(
+            timeout=30.0, event_hooks={"request": [self._rate_limit]})
+        self._tasks = [asyncio.create_task(self._schedule())] + \
+            [asyncio.create_task(self._work())
+             for _ in range(self.config.workers)]
+        if self.config.compaction_interval > 0:
+            self._tasks.append(asyncio.create_task(self._compact()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def _rate_limit(self, _: httpx.Request) -> None:
+        await self.limiter.acquire()
+
+    @staticmethod
+    def now() -> datetime.datetime:
+        return datetime.datetime.utcnow()
+
+    async def tick(self) -> int:
+        """
+        Enqueues the refresh jobs of the due cities, deletes the jobs which
+        finished more than job_retention seconds ago, and refreshes the
+        queue depth.
+
+        Returns:
+            int (number of enqueued jobs)
+        """
+        from database.db import AsyncReadDBSession, run_write_async
+        from models.ingestion_job import IngestionJob
+        from models.scheduled_city import ScheduledCity
+
+        now = self.now()
+        today = now.date()
+
+        def enqueue_due(db_session) -> int:
+            enqueued = 0
+            for city_name, interval, forecast_days in \
+                    ScheduledCity.due(now, db_session):
+                enqueued += IngestionJob.enqueue(
+                    city_name, today,
+                    today + datetime.timedelta(days=forecast_days - 1),
+                    now, db_session)
+                # Spreads refreshes of cities registered at the same time
+                delay = interval * (1 + self.rng.uniform(0,
+                                                         self.config.jitter))
+                ScheduledCity.reschedule(
+                    city_name, now + datetime.timedelta(seconds=delay),
+                    db_session)
+            IngestionJob.prune(
+                now - datetime.timedelta(seconds=self.config.job_retention),
+                db_session)
+            return enqueued
+
+        enqueued = await run_write_async(enqueue_due)
+        async with AsyncReadDBSession() as db_session:
+            queue_depth.update(await db_session.run_sync(IngestionJob.depth))
+        if enqueued:
+            self._wakeup.set()
+        return enqueued
+
+    async def run_next(self) -> bool:
+        """
+        Claims and runs the queued job which is due first.
+
+        Returns:
+            bool (False if no job was due)
+        """
+        from database.db import run_write_async
+        from models.forecast import Forecast
+        from models.ingestion_job import IngestionJob
+        from models.location_alias import LocationAlias
+
+        job = await run_write_async(
+            lambda db_session: IngestionJob.claim(self.now(), db_session))
+        if job is None:
+            return False
+
+        started = time.perf_counter()
+        JOB_WAIT_SECONDS.observe(
+            (self.now() - job.enqueued_at).total_seconds())
+        error = retry_at = None
+        try:
+            config = await generate_open_meteo_config_async(
+                {"city_name": job.city_name,
+                 "start_date": job.start_date,
+                 "end_date": job.end_date}, self._client)
+            location_key = config.location_key
+            await LocationAlias.register_async(job.city_name, location_key)
+            # Jobs refresh every day, so they share the fetch with refreshing
+            # API requests and with jobs of the same grid cell
+            await forecast_fetches.do(
+                (location_key, job.start_date, job.end_date, True, False),
+                lambda: Forecast.get_forecast_async(location_key, config,
+                                                    self._client,
+                                                    incremental=False))
+        except Exception as e:
+            error = getattr(e, "message", None) or str(e) or \
+                type(e).__name__
+            permanent = isinstance(e, ForecastRetrievalException) and \
+                e.message == ForecastRetrievalException.INVALID_CITY
+            if not permanent and job.attempts < self.config.max_attempts:
+                retry_at = self.now() + datetime.timedelta(
+                    seconds=backoff_delay(job.attempts,
+                                          self.config.backoff_base,
+                                          self.config.backoff_cap,
+                                          self.rng))
+            self.logger.warning(f"Refresh of {job.city_name} failed "
+                                f"(attempt {job.attempts}): {error}")
+
+        await run_write_async(lambda db_session: IngestionJob.finish(
+            job.id, self.now(), db_session, error, retry_at))
+        outcome = "done" if error is None else \
+            "retried" if retry_at is not None else "failed"
+        JOB_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+        return True
+
+    async def _schedule(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                self.logger.exception("Scheduler tick failed.")
+            await asyncio.sleep(self.config.tick_interval)
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                if await self.run_next():
+                    continue
+            except Exception:
+                self.logger.exception("Ingestion job failed.")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       self.config.tick_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _compact(self) -> None:
+        from utils.compaction import RetentionPolicy, compact
+
+        while True:
+            await asyncio.sleep(self.config.compaction_interval)
+            try:
+                # Deletes run in small transactions from a worker thread,
+                # so requests keep being served in between
+                result = await asyncio.to_thread(
+                    compact, RetentionPolicy.from_env())
+                self.logger.info(result.format())
+            except Exception:
+                self.logger.exception("Compaction failed.")
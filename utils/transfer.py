@@ -0,0 +1,228 @@
+"""
+Bulk CSV import and export of the forecasts table. Both directions
+stream the rows in chunks, so memory use does not grow with the file or
+table size. The CSV columns are the natural key and the values of the
+forecasts, see CSV_COLUMNS; is_forecast and lead_days are derived from
+the dates on import.
+"""
+import csv
+import datetime
+import functools
+import math
+import time
+from dataclasses import dataclass
+from typing import Iterable, Iterator, TextIO
+
+from sqlalchemy import Connection, select
+
+CSV_COLUMNS = ("city_name", "request_date", "measure_date", "temp_min",
+               "temp_max", "precipitation_sum", "windspeed_max")
+
+
+@dataclass
+class TransferSummary:
+    rows: int = 0
+    cities: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def format(self, verb: str) -> str:
+        return (f"{verb} {self.rows} forecasts of {self.cities} city(ies) "
+                f"in {self.seconds:.2f}s ({self.rows_per_second:.0f} "
+                f"rows/s).")
+
+
+def export_forecasts(output: TextIO,
+                     city_names: Iterable[str] | None = None,
+                     start_date: datetime.date | None = None,
+                     end_date: datetime.date | None = None,
+                     batch_size: int = 10000) -> TransferSummary:
+    """
+    Writes the stored forecasts as CSV, ordered by city, measure date and
+    request date. Rows are read from a server-side cursor in batches of
+    batch_size rows. City names are resolved through their location
+    aliases, see LocationAlias.
+
+    Args:
+        output (TextIO): file the CSV is written to
+        city_names (Iterable[str]): optional subset of the cities
+        start_date (date): optional first measure date (inclusive)
+        end_date (date): optional last measure date (inclusive)
+        batch_size (int): number of rows fetched per batch
+
+    Returns:
+        TransferSummary
+    """
+    from database.db import ReadDBSession
+    from models.forecast import Forecast
+    from models.location_alias import LocationAlias
+
+    started = time.perf_counter()
+    summary = TransferSummary()
+    table = Forecast.__table__
+    query = select(*(table.c[name] for name in CSV_COLUMNS)).order_by(
+        table.c.city_name, table.c.measure_date, table.c.request_date)
+    if start_date is not None:
+        query = query.where(table.c.measure_date >= start_date)
+    if end_date is not None:
+        query = query.where(table.c.measure_date <= end_date)
+
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(CSV_COLUMNS)
+    with ReadDBSession() as db_session:
+        if city_names is not None:
+            query = query.where(table.c.city_name.in_(set(
+                LocationAlias.resolve(city_names, db_session).values())))
+        result = db_session.execute(
+            query.execution_options(yield_per=batch_size))
+        last_city = None
+        for rows in result.partitions():
+            writer.writerows(rows)
+            summary.rows += len(rows)
+            for city_name, *_ in rows:
+                if city_name != last_city:
+                    summary.cities += 1
+                    last_city = city_name
+    summary.seconds = time.perf_counter() - started
+    return summary
+
+
+def import_forecasts(source: TextIO,
+                     batch_size: int = 50000,
+                     drop_indexes: bool = False) -> TransferSummary:
+    """
+    Loads forecasts from CSV, batch_size rows per transaction, each written
+    with a single executemany of an INSERT ... ON CONFLICT DO UPDATE
+    statement, so rows already stored under the same natural key take the
+    imported values. Extra columns are ignored, an invalid row stops the
+    import with a ValueError, keeping the batches written before it. City
+    names are resolved through their location aliases, see LocationAlias, so
+    rows of an aliased city are stored under its location key like fetched
+    ones. Since the rows bypass Forecast.upsert, the accuracy sums of the
+    imported cities are rebuilt and their data versions incremented once the
+    load is done.
+
+    Args:
+        source (TextIO): CSV file with a header row
+        batch_size (int): number of rows written per transaction
+        drop_indexes (bool): flag which indicates if the secondary indexes
+                             are dropped during the load and rebuilt after
+                             it, which is faster for large loads; the
+                             natural key index is kept
+
+    Returns:
+        TransferSummary
+    """
+    from database.db import run_write
+    from models.accuracy import ForecastAccuracy, ForecastLeadAccuracy
+    from models.data_version import DataVersion
+    from models.forecast import Forecast
+    from models.location_alias import LocationAlias
+
+    started = time.perf_counter()
+    summary = TransferSummary()
+    table = Forecast.__table__
+    columns = CSV_COLUMNS + ("is_forecast", "lead_days")
+    statement = (
+        f"INSERT INTO forecasts ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))}) "
+        f"ON CONFLICT (city_name, request_date, measure_date) DO UPDATE SET "
+        + ", ".join(f"{name} = excluded.{name}" for name in columns[3:]))
+    indexes = [index for index in table.indexes
+               if not index.unique] if drop_indexes else []
+
+    def drop(db_session) -> None:
+        for index in indexes:
+            index.drop(db_session.connection(), checkfirst=True)
+
+    def rebuild(db_session) -> None:
+        ForecastAccuracy.rebuild(db_session, city_names)
+        ForecastLeadAccuracy.rebuild(db_session, city_names)
+        DataVersion.bump(city_names, db_session)
+
+    def write(rows: list[tuple], db_session) -> list[tuple]:
+        location_keys = LocationAlias.resolve({row[0] for row in rows},
+                                              db_session)
+        rows = [(location_keys[row[0]], *row[1:]) for row in rows]
+        db_session.connection().exec_driver_sql(statement, rows)
+        return rows
+
+    city_names = set()
+    run_write(drop)
+    try:
+        for rows in read_csv(source, batch_size):
+            rows = run_write(functools.partial(write, rows))
+            summary.rows += len(rows)
+            city_names.update(row[0] for row in rows)
+    finally:
+        run_write(lambda db_session: restore_indexes(
+            db_session.connection(), indexes))
+        # Also after an invalid row, since the earlier batches are kept
+        if city_names:
+            run_write(rebuild)
+    summary.cities = len(city_names)
+    summary.seconds = time.perf_counter() - started
+    return summary
+
+
+def read_csv(source: TextIO, batch_size: int) -> Iterator[list[tuple]]:
+    """
+    Parses forecast CSV rows into tuples of the CSV_COLUMNS followed by
+    is_forecast and lead_days, batch_size at a time.
+
+    Args:
+        source (TextIO): CSV file with a header row
+        batch_size (int): number of rows per batch
+
+    Returns:
+        Iterator[list[tuple]]
+    """
+    reader = csv.reader(source)
+    header = next(reader, None)
+    missing = [name for name in CSV_COLUMNS if name not in (header or ())]
+    if missing:
+        raise ValueError(f"Missing CSV column(s): {', '.join(missing)}.")
+    positions = [header.index(name) for name in CSV_COLUMNS]
+
+    batch = []
+    for values in reader:
+        if not values:
+            continue
+        try:
+            city_name, request_date, measure_date, *measures = \
+                (values[i] for i in positions)
+            request_date, request_day = parse_date(request_date)
+            measure_date, measure_day = parse_date(measure_date)
+            measures = [float(value) for value in measures]
+            if not all(map(math.isfinite, measures)):
+                raise ValueError("values must be finite")
+            lead_days = measure_day - request_day
+            batch.append((city_name, request_date, measure_date, *measures,
+                          lead_days > 0, lead_days))
+        except (IndexError, ValueError) as e:
+            raise ValueError(f"Invalid forecast on line "
+                             f"{reader.line_num}: {e}") from None
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(value: str) -> tuple[str, int]:
+    # Dates repeat across rows, so the stored format and day number of
+    # each one are only computed once
+    day = datetime.date.fromisoformat(value)
+    return day.isoformat(), day.toordinal()
+
+
+def restore_indexes(connection: Connection, indexes: list) -> None:
+    if not indexes:
+        return
+    for index in indexes:
+        index.create(connection, checkfirst=True)
+    connection.exec_driver_sql("ANALYZE forecasts")
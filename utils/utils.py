@@ -1,14 +1,53 @@
+import base64
+import binascii
+import datetime
+import os
 import traceback
+import dataclasses
 from dataclasses import dataclass
 import logging
+import math
+from typing import TYPE_CHECKING
+
 import requests
 
+from utils.cache import GeocodeCache, SingleFlight, VersionedCache
+from utils.metrics import UPSTREAM_SECONDS
+
+if TYPE_CHECKING:
+    import httpx
+
+# Upstream endpoints, overridable e.g. to point at a local stub server
+GEOCODING_API_URL = os.environ.get(
+    "WAGA_GEOCODING_URL", "https://geocoding-api.open-meteo.com/v1/search")
+FORECAST_API_URL = os.environ.get(
+    "WAGA_FORECAST_URL", "https://api.open-meteo.com/v1/forecast?")
+OPEN_METEO_MAX_DAYS = 16
+# Side of the square grid cells forecasts are stored per, in degrees;
+# 0 stores them per city name instead
+GRID_CELL_DEGREES = float(os.environ.get("WAGA_GRID_CELL_DEGREES", "0.1"))
 
-logging.basicConfig(filename="../error.log", filemode="a",
-                    format="=============\n%(levelname)s | %(asctime)s \n"
-                           "----------\n%(message)s=============\n",
-                    datefmt="%m/%d/%Y %I:%M:%S %p",
-                    level=logging.WARNING)
+_logging_configured = False
+
+
+def configure_logging() -> None:
+    """
+    Sets up the error log file on first use rather than at import time.
+    The file itself is only opened once something is logged.
+
+    Returns:
+        None
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    logging.basicConfig(handlers=[logging.FileHandler("../error.log",
+                                                      mode="a", delay=True)],
+                        format="=============\n%(levelname)s | %(asctime)s \n"
+                               "----------\n%(message)s=============\n",
+                        datefmt="%m/%d/%Y %I:%M:%S %p",
+                        level=logging.WARNING)
 
 
 class LoggingCtxManager:
@@ -19,6 +58,7 @@ class LoggingCtxManager:
 
     def __init__(self, logger_name: str = "forecast",
                  level: int = logging.ERROR):
+        configure_logging()
         self.logger = logging.getLogger(logger_name)
         self.logger.setLevel(level)
 
@@ -35,25 +75,114 @@ class ClientConfig:
     api_url: str
     params: dict
     handler_fn: callable
+    # Longest date range the service returns in a single response
+    max_days: int | None = None
+    # Key the fetched forecasts are stored under, see grid_cell
+    location_key: str | None = None
+
+    def for_range(self, start_date: datetime.date,
+                  end_date: datetime.date) -> "ClientConfig":
+        return dataclasses.replace(self, params={**self.params,
+                                                 "start_date": start_date,
+                                                 "end_date": end_date})
+
 
+geocode_cache = GeocodeCache()
+# Serialized GET /forecasts payloads, validated by DataVersion
+diff_cache = VersionedCache(maxsize=1024)
+# Identical concurrent POST /forecasts requests
+forecast_fetches = SingleFlight()
 
-def get_city_lat_long(city_name: str) -> tuple[float, float]:
+
+def create_http_session(pool_size: int = 10) -> requests.Session:
+    """
+    Creates a requests session whose connection pool can be shared
+    between pool_size concurrent threads.
+
+    Args:
+        pool_size (int): maximum number of pooled connections per host
+
+    Returns:
+        requests.Session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_city_lat_long(city_name: str,
+                      session: requests.Session | None = None) \
+        -> tuple[float, float]:
     """
     Utility function for retrieving lat/long coordinates of a specified city.
+    Lookups are served from the geocoding cache when possible, see
+    GeocodeCache. Hit/miss counters are available through
+    geocode_cache.stats().
+
+    Args:
+        city_name (str): name of the city whose coordinates will be fetched.
+        session (requests.Session): optional session used for the request
+
+    Returns:
+        tuple of floats (city coordinates)
+    """
+    return geocode_cache.lookup(
+        city_name, lambda name: fetch_city_lat_long(name, session))
+
+
+def fetch_city_lat_long(city_name: str,
+                        session: requests.Session | None = None) \
+        -> tuple[float, float]:
+    """
+    Retrieves lat/long coordinates of a specified city, bypassing the cache.
     Uses open-meteo.com API, which is free use for non-commercial cases
     at the time of writing.
 
     Args:
         city_name (str): name of the city whose coordinates will be fetched.
+        session (requests.Session): optional session used for the request
+
+    Returns:
+        tuple of floats (city coordinates)
+    """
+    with LoggingCtxManager(), UPSTREAM_SECONDS.time(service="geocoding"):
+        response = (session or requests).get(
+            GEOCODING_API_URL, params=geocoding_params(city_name)).json()
+
+    return parse_geocoding_response(response)
+
+
+async def get_city_lat_long_async(city_name: str,
+                                  client: "httpx.AsyncClient") \
+        -> tuple[float, float]:
+    """
+    Asynchronous variant of get_city_lat_long, sharing its cache.
+
+    Args:
+        city_name (str): name of the city whose coordinates will be fetched.
+        client (httpx.AsyncClient): client used for the request
 
     Returns:
         tuple of floats (city coordinates)
     """
-    with LoggingCtxManager():
-        response = requests.get(f"https://geocoding-api.open-meteo.com/v1/"
-                                f"search?name={city_name}&count=1&language=en"
-                                f"&format=json").json()
+    async def fetch(name: str) -> tuple[float, float]:
+        with LoggingCtxManager():
+            with UPSTREAM_SECONDS.time(service="geocoding"):
+                response = await client.get(GEOCODING_API_URL,
+                                            params=geocoding_params(name))
+            return parse_geocoding_response(response.json())
+
+    return await geocode_cache.lookup_async(city_name, fetch)
+
+
+def geocoding_params(city_name: str) -> dict:
+    return {"name": city_name, "count": 1, "language": "en", "format": "json"}
 
+
+def parse_geocoding_response(response: dict) -> tuple[float, float]:
     response = response.get("results")
     if response is None:
         raise ForecastRetrievalException(
@@ -66,6 +195,8 @@ def get_city_lat_long(city_name: str) -> tuple[float, float]:
 class ForecastRetrievalException(Exception):
     INVALID_DATE = "Invalid date"
     INVALID_CITY = "Invalid city"
+    INVALID_CURSOR = "Invalid cursor"
+    NO_FORECASTS = "No stored forecasts"
     message: str
 
     def to_dict(self):
@@ -77,10 +208,15 @@ class ForecastRetrievalException(Exception):
                     {"loc": ["query", "end_date"],
                      "type": "value_error.date",
                      "msg": self.message.lower()}]
-        elif self.message == ForecastRetrievalException.INVALID_CITY:
+        elif self.message in (ForecastRetrievalException.INVALID_CITY,
+                              ForecastRetrievalException.NO_FORECASTS):
             return [{"loc": ["query", "city_name"],
                      "type": "value_error.str",
                      "msg": self.message.lower()}]
+        elif self.message == ForecastRetrievalException.INVALID_CURSOR:
+            return [{"loc": ["query", "cursor"],
+                     "type": "value_error.str",
+                     "msg": self.message.lower()}]
 
         return [{"loc":
                      ["unknown", "unknown"],
@@ -89,23 +225,84 @@ class ForecastRetrievalException(Exception):
                 ]
 
 
-def generate_open_meteo_config(args: dict) -> ClientConfig:
+def generate_open_meteo_config(args: dict,
+                               session: requests.Session | None = None) \
+        -> ClientConfig:
     """
     Generates and returns a valid ClientConfig object, which contains
     the base url and all query parameters needed to make a
     successful HTTP request, and a reference to the handler function
-    which will parse the incoming data and transform it into Forecast objects.
+    which will parse the incoming data and transform it into forecast rows.
+
+    Args:
+        args (dict): dictionary containing the city_name,
+                     start_date and end_date parameters
+        session (requests.Session): optional session used for geocoding
+
+    Returns:
+        ClientConfig
+    """
+    latitude, longitude = get_city_lat_long(args["city_name"], session)
+    return open_meteo_config(latitude, longitude, args,
+                             city_name=args["city_name"])
+
+
+async def generate_open_meteo_config_async(args: dict,
+                                           client: "httpx.AsyncClient") \
+        -> ClientConfig:
+    """
+    Asynchronous variant of generate_open_meteo_config.
 
     Args:
         args (dict): dictionary containing the city_name,
                      start_date and end_date parameters
+        client (httpx.AsyncClient): client used for geocoding
 
     Returns:
         ClientConfig
     """
-    from utils.handlers import handle_open_meteo_data
+    latitude, longitude = await get_city_lat_long_async(args["city_name"],
+                                                        client)
+    return open_meteo_config(latitude, longitude, args,
+                             city_name=args["city_name"])
+
+
+def grid_cell(latitude: float, longitude: float,
+              cell_degrees: float = GRID_CELL_DEGREES) \
+        -> tuple[str, float, float]:
+    """
+    Quantizes coordinates to the grid cell containing them, so nearby
+    places share one location key and one upstream request.
+
+    Args:
+        latitude (float): latitude in degrees
+        longitude (float): longitude in degrees
+        cell_degrees (float): side of the grid cells in degrees
+
+    Returns:
+        tuple (location key, latitude and longitude of the cell center)
+    """
+    latitude, longitude = (
+        round((math.floor(coordinate / cell_degrees) + 0.5) * cell_degrees, 4)
+        for coordinate in (latitude, longitude))
+    return f"{latitude:.4f},{longitude:.4f}", latitude, longitude
 
-    latitude, longitude = get_city_lat_long(args["city_name"])
+
+def open_meteo_config(latitude: float, longitude: float,
+                      args: dict,
+                      city_name: str | None = None) -> ClientConfig:
+    """
+    Builds the ClientConfig of a forecast request. If the city name is
+    passed and GRID_CELL_DEGREES is set, the center of the city's grid
+    cell is requested and the forecasts are keyed by the cell, see
+    grid_cell; otherwise by the city name. Hourly values are requested
+    along with the daily ones if args["hourly"] is set.
+    """
+    from utils.handlers import handle_open_meteo_rows
+
+    location_key = city_name
+    if city_name is not None and GRID_CELL_DEGREES > 0:
+        location_key, latitude, longitude = grid_cell(latitude, longitude)
     params = {"latitude": latitude,
               "longitude": longitude,
               "start_date": args["start_date"],
@@ -117,6 +314,42 @@ def generate_open_meteo_config(args: dict) -> ClientConfig:
               "daily": "temperature_2m_min,temperature_2m_max,"
                        "precipitation_sum,windspeed_10m_max"
               }
-    return ClientConfig(api_url="https://api.open-meteo.com/v1/forecast?",
+    if args.get("hourly"):
+        params["hourly"] = "temperature_2m,precipitation,windspeed_10m"
+    return ClientConfig(api_url=FORECAST_API_URL,
                         params=params,
-                        handler_fn=handle_open_meteo_data)
\ No newline at end of file
+                        handler_fn=handle_open_meteo_rows,
+                        max_days=OPEN_METEO_MAX_DAYS,
+                        location_key=location_key)
+
+
+def encode_cursor(measure_date: datetime.date) -> str:
+    """
+    Encodes the last returned measure date as an opaque pagination cursor.
+
+    Args:
+        measure_date (date): measure date of the last returned row
+
+    Returns:
+        str
+    """
+    return base64.urlsafe_b64encode(
+        measure_date.isoformat().encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> datetime.date:
+    """
+    Decodes a pagination cursor created by encode_cursor.
+
+    Args:
+        cursor (str): pagination cursor
+
+    Returns:
+        date
+    """
+    try:
+        return datetime.date.fromisoformat(base64.urlsafe_b64decode(
+            cursor + "=" * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ForecastRetrievalException(
+            ForecastRetrievalException.INVALID_CURSOR) from None